@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from fastapi import Depends, HTTPException, Request, status
+
+import db
+import metrics
+from cache import TTLCache
+from oauth2 import user_id_from_token
+
+# ----- CONFIG -----
+# Turn bursts away early (429/503 with Retry-After) instead of letting them queue on the connection pool.
+# Off by default: the limits below are a starting point, check them against real traffic before turning it on.
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "0") == "1"
+# Token buckets per user and route class: "<class>=<requests per second>/<burst>". The defaults let each user
+# make 10 booking writes (create, batch, decide) at once and then 1 per second, and 30 availability or other
+# list reads at once and then 5 per second. A class left out is not rate limited.
+ADMISSION_RATE_LIMITS = os.getenv("ADMISSION_RATE_LIMITS", "booking_write=1/10,availability=5/30,read=5/30")
+# Also rate limit anonymous callers, one bucket per client IP. Off by default: behind a reverse proxy or a
+# campus NAT every anonymous caller would share one bucket. Turn it on together with the header below.
+ADMISSION_LIMIT_ANONYMOUS = os.getenv("ADMISSION_LIMIT_ANONYMOUS", "0") == "1"
+# Header the trusted reverse proxy puts the client address in, e.g. X-Forwarded-For; its last entry (the one
+# the proxy added) is used. Unset uses the TCP peer address.
+ADMISSION_FORWARDED_FOR_HEADER = os.getenv("ADMISSION_FORWARDED_FOR_HEADER")
+# Once every pool slot is held, this many requests may wait up to ADMISSION_WAIT_SECONDS for one; the rest get a 503
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", str(db.DB_POOL_CAPACITY)))
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", "1"))
+ADMISSION_RETRY_AFTER_SECONDS = 1
+# Share the buckets between workers, e.g. redis://localhost:6379/0 (needs the redis package); unset keeps them per process
+ADMISSION_BACKEND_URL = os.getenv("ADMISSION_BACKEND_URL")
+ADMISSION_MAX_KEYS = 100000
+
+log = logging.getLogger("admission")
+
+
+def parse_rate_limits(spec: str):
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route_class, _, limit = item.partition("=")
+        rate, _, burst = limit.partition("/")
+        try:
+            limits[route_class.strip()] = (float(rate), int(burst))
+        except ValueError:
+            raise ValueError(f"ADMISSION_RATE_LIMITS: expected <class>=<rate>/<burst>, got {item!r}")
+    return limits
+
+
+RATE_LIMITS = parse_rate_limits(ADMISSION_RATE_LIMITS)  # route class -> (tokens per second, burst)
+
+
+# ----- RATE LIMIT BACKENDS -----
+# A backend has `async take(key, rate, burst)`: take a token from bucket `key` (refilled at `rate` per second,
+# holding at most `burst`) and return 0, or return the seconds until one is available without taking it.
+
+# Buckets in this process; one that has had time to refill completely is simply dropped
+class MemoryBackend:
+    def __init__(self, max_keys: int = ADMISSION_MAX_KEYS):
+        self._lock = threading.Lock()
+        self._buckets = TTLCache(max_keys)  # key -> (tokens, monotonic time of last update)
+
+    async def take(self, key: str, rate: float, burst: int):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            tokens -= 1
+            self._buckets.set(key, (tokens, now), ttl=(burst - tokens) / rate)
+            return 0
+
+
+# Buckets in Redis, shared by every worker. Updated atomically by a script using the Redis clock.
+REDIS_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+if tokens < 1 then
+  return tostring((1 - tokens) / rate)
+end
+tokens = tokens - 1
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return '0'
+"""
+
+
+class RedisBackend:
+    def __init__(self, url: str, prefix: str = "admission:"):
+        import redis.asyncio  # optional: only needed with ADMISSION_BACKEND_URL
+
+        self._redis = redis.asyncio.from_url(url)
+        self._take = self._redis.register_script(REDIS_TAKE_SCRIPT)
+        self._prefix = prefix
+
+    async def take(self, key: str, rate: float, burst: int):
+        try:
+            return float(await self._take(keys=[self._prefix + key], args=[rate, burst]))
+        except Exception:
+            # Rate limiting is best effort: an unreachable store must not take the API down with it
+            log.exception("Rate limit backend failed; admitting %s", key)
+            return 0
+
+
+backend = RedisBackend(ADMISSION_BACKEND_URL) if ADMISSION_BACKEND_URL else MemoryBackend()
+
+
+def set_backend(new_backend):
+    global backend
+    backend = new_backend
+
+
+# ----- POOL CAPACITY -----
+# At most `capacity` admitted requests per connection pool, so the pool never has a queue of its own.
+# Only used from the event loop, so the counters need no lock.
+class PoolLimiter:
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.in_flight = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.in_flight < self.capacity and not self._waiters:
+            self.in_flight += 1
+            self._report()
+            return True
+        if len(self._waiters) >= ADMISSION_MAX_WAITING:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._report()
+        try:
+            await asyncio.wait_for(waiter, ADMISSION_WAIT_SECONDS)
+            return True  # release() handed its slot over
+        except asyncio.TimeoutError:
+            return False
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # handed a slot just as the request went away: pass it on
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._report()
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+        self._report()
+
+    def _report(self):
+        metrics.ADMISSION_IN_FLIGHT.labels(self.name).set(self.in_flight)
+        metrics.ADMISSION_WAITING.labels(self.name).set(len(self._waiters))
+
+
+limiters = {"primary": PoolLimiter("primary", db.DB_POOL_CAPACITY)}
+limiters["replica"] = limiters["primary"] if db.replica_engine is db.engine else PoolLimiter("replica", db.DB_POOL_CAPACITY)
+
+
+# ----- ROUTE DEPENDENCY -----
+def _client_ip(request: Request):
+    if ADMISSION_FORWARDED_FOR_HEADER:
+        forwarded = request.headers.get(ADMISSION_FORWARDED_FOR_HEADER, "")
+        addresses = [address.strip() for address in forwarded.split(",") if address.strip()]
+        if addresses:
+            return addresses[-1]
+    return request.client.host if request.client else "unknown"
+
+
+# Rate limited per user, so one client's retries cannot starve everyone else's.
+# None (no bucket) for anonymous callers unless ADMISSION_LIMIT_ANONYMOUS is on.
+def _client_key(request: Request):
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        user_id = user_id_from_token(token)
+        if user_id is not None:
+            return f"user:{user_id}"
+    if not ADMISSION_LIMIT_ANONYMOUS:
+        return None
+    return f"ip:{_client_ip(request)}"
+
+
+# The limiters of the connections a request will hold. A replica read that _reads_from_primary sends to the
+# primary holds a primary slot instead; the same pool twice means two connections from it.
+def _limiters(request: Request, pools):
+    for pool in pools:
+        if pool == "replica" and db._reads_from_primary(request):
+            pool = "primary"
+        yield limiters[pool]
+
+
+# dependencies=[admission.admit(...)] on a route: take a token from the caller's `route_class` bucket,
+# then hold a slot of each of `pools` ("primary" or "replica") until the request is done. Routes that read
+# the replica as a signed-in user list "primary" too, for get_current_user's session. No pools only rate
+# limits (for long-lived streams that don't keep a connection).
+def admit(route_class: str, *pools: str):
+    async def dependency(request: Request):
+        if not ADMISSION_CONTROL:
+            yield
+            return
+
+        limit = RATE_LIMITS.get(route_class)
+        client_key = _client_key(request)
+        if limit is not None and client_key is not None:
+            retry_after = await backend.take(f"{route_class}:{client_key}", *limit)
+            if retry_after > 0:
+                metrics.ADMISSION_REJECTED.labels(route_class, "rate_limited").inc()
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many requests, please retry shortly",
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+                )
+
+        held = []
+        try:
+            for limiter in _limiters(request, pools):
+                if not await limiter.acquire():
+                    metrics.ADMISSION_REJECTED.labels(route_class, "overloaded").inc()
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="Server is busy, please retry shortly",
+                        headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)},
+                    )
+                held.append(limiter)
+            yield
+        finally:
+            for limiter in held:
+                limiter.release()
+
+    return Depends(dependency)
@@ -6,7 +6,7 @@ from sqlalchemy import pool
 from alembic import context
 
 
-from db import Base  # Make sure your Base is imported from db.py or models
+from db import Base, SQLALCHEMY_DATABASE_URL  # Make sure your Base is imported from db.py or models
 from models import *  # All models must be imported so Alembic can see them
 
 
@@ -19,6 +19,9 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
+# Migrate the same database the app uses (DATABASE_URL), not the URL in alembic.ini
+config.set_main_option("sqlalchemy.url", SQLALCHEMY_DATABASE_URL.replace("%", "%%"))
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
@@ -62,6 +65,14 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    # startup.create_schema() passes its own connection (and transaction) in config.attributes
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
@@ -0,0 +1,130 @@
+"""add booking slot index
+
+Revision ID: 3f9b2e7c4a15
+Revises: 8d1f3a6c2b90
+Create Date: 2026-10-18 16:40:52.107934
+
+"""
+import logging
+import os
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9b2e7c4a15'
+down_revision: Union[str, None] = '8d1f3a6c2b90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ACTIVE_WHERE = sa.text("status IN ('pending', 'approved')")
+BACKFILL_BATCH_SIZE = 10000
+
+# Active bookings with an earlier active booking of the same instrument and slot index
+DUPLICATES_WHERE = """
+    status IN ('pending', 'approved')
+    AND slot_index IS NOT NULL
+    AND EXISTS (
+        SELECT 1 FROM bookings AS earlier
+        WHERE earlier.instrument_id = bookings.instrument_id
+          AND earlier.slot_index = bookings.slot_index
+          AND earlier.status IN ('pending', 'approved')
+          AND earlier.id < bookings.id
+    )
+"""
+
+log = logging.getLogger('alembic.runtime.migration')
+
+labs = sa.table(
+    'labs',
+    sa.column('id', sa.Integer),
+    sa.column('slot_start', sa.Time),
+    sa.column('slot_minutes', sa.Integer),
+    sa.column('slots_per_day', sa.Integer),
+)
+instruments = sa.table('instruments', sa.column('instrument_id', sa.Integer), sa.column('lab_id', sa.Integer))
+bookings = sa.table(
+    'bookings',
+    sa.column('id', sa.Integer),
+    sa.column('instrument_id', sa.Integer),
+    sa.column('slot', sa.DateTime),
+    sa.column('slot_index', sa.Integer),
+)
+
+
+# slots.SlotGrid.index() as of this revision
+def _slot_index(slot, slot_start, slot_minutes, slots_per_day):
+    diff = (slot - datetime.combine(slot.date(), slot_start)).total_seconds()
+    position = int(diff // (slot_minutes * 60))
+    if diff < 0 or position >= slots_per_day:
+        return None
+    return slot.date().toordinal() * slots_per_day + position
+
+
+def _reject_duplicates() -> None:
+    duplicates = op.get_bind().execute(sa.text(f"SELECT id FROM bookings WHERE {DUPLICATES_WHERE} ORDER BY id")).scalars().all()
+    if not duplicates:
+        return
+    ids = ', '.join(str(booking_id) for booking_id in duplicates)
+    if os.getenv('REJECT_DUPLICATE_BOOKINGS', '0') != '1':
+        raise RuntimeError(
+            f"{len(duplicates)} active bookings fall in a slot already taken by an earlier active booking of the "
+            f"same instrument (ids {ids}), so the unique index can't be built. Resolve them, or run the upgrade "
+            f"again with REJECT_DUPLICATE_BOOKINGS=1 to set them to 'rejected' (the earliest booking of each slot is kept)."
+        )
+    op.execute(f"UPDATE bookings SET status = 'rejected' WHERE {DUPLICATES_WHERE}")
+    log.warning("Rejected %d duplicate active bookings (REJECT_DUPLICATE_BOOKINGS=1): ids %s", len(duplicates), ids)
+
+
+def upgrade() -> None:
+    op.add_column('bookings', sa.Column('slot_index', sa.Integer(), nullable=True))
+
+    # Backfill with each booking's lab grid, in id order and in batches; bookings outside working hours stay NULL
+    connection = op.get_bind()
+    update = bookings.update().where(bookings.c.id == sa.bindparam('booking_id')).values(slot_index=sa.bindparam('index'))
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(bookings.c.id, bookings.c.slot, labs.c.slot_start, labs.c.slot_minutes, labs.c.slots_per_day)
+            .select_from(bookings)
+            .join(instruments, instruments.c.instrument_id == bookings.c.instrument_id)
+            .join(labs, labs.c.id == instruments.c.lab_id)
+            .where(bookings.c.id > last_id)
+            .order_by(bookings.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(update, [
+            {'booking_id': row.id, 'index': _slot_index(row.slot, row.slot_start, row.slot_minutes, row.slots_per_day)}
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+    # Active bookings at different times inside the same slot (10:00 and 10:30) were never treated as conflicts.
+    # They stop the upgrade (and the transaction rolls the backfill back) unless REJECT_DUPLICATE_BOOKINGS=1
+    # allows rejecting all but the earliest of each slot.
+    _reject_duplicates()
+
+    op.drop_index('uq_bookings_active_instrument_slot', table_name='bookings')
+    op.create_index(
+        'uq_bookings_active_instrument_slot_index', 'bookings', ['instrument_id', 'slot_index'],
+        unique=True,
+        postgresql_where=ACTIVE_WHERE,
+        sqlite_where=ACTIVE_WHERE,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_bookings_active_instrument_slot_index', table_name='bookings')
+    op.create_index(
+        'uq_bookings_active_instrument_slot', 'bookings', ['instrument_id', 'slot'],
+        unique=True,
+        postgresql_where=ACTIVE_WHERE,
+        sqlite_where=ACTIVE_WHERE,
+    )
+    with op.batch_alter_table('bookings') as batch_op:
+        batch_op.drop_column('slot_index')
@@ -0,0 +1,77 @@
+"""add booking indexes and active slot unique index
+
+Revision ID: 5c2e8d41b7a3
+Revises: fa7335734eb3
+Create Date: 2026-10-18 11:02:37.418205
+
+"""
+import logging
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2e8d41b7a3'
+down_revision: Union[str, None] = 'fa7335734eb3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ACTIVE_WHERE = sa.text("status IN ('pending', 'approved')")
+
+# Active bookings with an earlier active booking of the same instrument and slot
+DUPLICATES_WHERE = """
+    status IN ('pending', 'approved')
+    AND EXISTS (
+        SELECT 1 FROM bookings AS earlier
+        WHERE earlier.instrument_id = bookings.instrument_id
+          AND earlier.slot = bookings.slot
+          AND earlier.status IN ('pending', 'approved')
+          AND earlier.id < bookings.id
+    )
+"""
+
+log = logging.getLogger('alembic.runtime.migration')
+
+
+def _reject_duplicates() -> None:
+    duplicates = op.get_bind().execute(sa.text(f"SELECT id FROM bookings WHERE {DUPLICATES_WHERE} ORDER BY id")).scalars().all()
+    if not duplicates:
+        return
+    ids = ', '.join(str(booking_id) for booking_id in duplicates)
+    if os.getenv('REJECT_DUPLICATE_BOOKINGS', '0') != '1':
+        raise RuntimeError(
+            f"{len(duplicates)} active bookings take an instrument and slot already taken by an earlier active booking "
+            f"(ids {ids}), so the unique index can't be built. Resolve them, or run the upgrade again with "
+            f"REJECT_DUPLICATE_BOOKINGS=1 to set them to 'rejected' (the earliest booking of each slot is kept)."
+        )
+    op.execute(f"UPDATE bookings SET status = 'rejected' WHERE {DUPLICATES_WHERE}")
+    log.warning("Rejected %d duplicate active bookings (REJECT_DUPLICATE_BOOKINGS=1): ids %s", len(duplicates), ids)
+
+
+def upgrade() -> None:
+    # Duplicate active bookings could only come from the old racy check-then-insert. They stop the
+    # upgrade, before any change, unless REJECT_DUPLICATE_BOOKINGS=1 allows rejecting all but the earliest of each slot.
+    _reject_duplicates()
+
+    op.create_index('ix_bookings_instrument_id_slot', 'bookings', ['instrument_id', 'slot'])
+    op.create_index('ix_bookings_requested_by_id_slot', 'bookings', ['requested_by_id', 'slot'])
+    op.create_index('ix_bookings_requested_to_id_status', 'bookings', ['requested_to_id', 'status'])
+    op.create_index('ix_bookings_slot_id', 'bookings', ['slot', 'id'])
+
+    op.create_index(
+        'uq_bookings_active_instrument_slot', 'bookings', ['instrument_id', 'slot'],
+        unique=True,
+        postgresql_where=ACTIVE_WHERE,
+        sqlite_where=ACTIVE_WHERE,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_bookings_active_instrument_slot', table_name='bookings')
+    op.drop_index('ix_bookings_slot_id', table_name='bookings')
+    op.drop_index('ix_bookings_requested_to_id_status', table_name='bookings')
+    op.drop_index('ix_bookings_requested_by_id_slot', table_name='bookings')
+    op.drop_index('ix_bookings_instrument_id_slot', table_name='bookings')
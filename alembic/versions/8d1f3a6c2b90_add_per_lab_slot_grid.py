@@ -0,0 +1,32 @@
+"""add per-lab slot grid
+
+Revision ID: 8d1f3a6c2b90
+Revises: 5c2e8d41b7a3
+Create Date: 2026-10-18 14:21:09.582311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d1f3a6c2b90'
+down_revision: Union[str, None] = '5c2e8d41b7a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing labs keep the grid that used to be hardcoded: 4 two-hour slots from 10:00
+    op.add_column('labs', sa.Column('slot_start', sa.Time(), nullable=False, server_default=sa.text("'10:00:00'")))
+    op.add_column('labs', sa.Column('slot_minutes', sa.Integer(), nullable=False, server_default=sa.text('120')))
+    op.add_column('labs', sa.Column('slots_per_day', sa.Integer(), nullable=False, server_default=sa.text('4')))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('labs') as batch_op:
+        batch_op.drop_column('slots_per_day')
+        batch_op.drop_column('slot_minutes')
+        batch_op.drop_column('slot_start')
@@ -0,0 +1,140 @@
+"""partition bookings by slot month
+
+Revision ID: b7d4e1a9c352
+Revises: 3f9b2e7c4a15
+Create Date: 2026-10-18 19:12:05.418230
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d4e1a9c352'
+down_revision: Union[str, None] = '3f9b2e7c4a15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# PostgreSQL only: elsewhere bookings stays one table.
+#
+# A unique index on a partitioned table must contain the partition key, which the active-slot index
+# (instrument_id, slot_index) doesn't. Every booking of one slot index falls on the same day, so in the
+# same month's partition: the index is created on each partition instead (partitions.create_partition
+# does the same for new months), and inserts use ON CONFLICT DO NOTHING without a conflict target.
+#
+# Copies every row in one transaction, so a failure leaves the old table as it was: plan for bookings being
+# locked (reads too) for as long as the copy and the index builds take, roughly the time of a full dump and
+# restore of the table. Waiting for that lock gives up after LOCK_TIMEOUT rather than queueing every request
+# behind it; run it again once the long transaction holding bookings is gone.
+
+PARTITIONS_AHEAD = 12  # months after the current one; `python -m partitions` keeps this topped up
+LOCK_TIMEOUT = '10s'
+COLUMNS = 'id, instrument_id, slot, slot_index, requested_by_id, requested_to_id, status'
+ACTIVE_WHERE = "status IN ('pending', 'approved')"
+INDEXES = [
+    ('ix_bookings_id', ['id']),
+    ('ix_bookings_instrument_id_slot', ['instrument_id', 'slot']),
+    ('ix_bookings_requested_by_id_slot', ['requested_by_id', 'slot']),
+    ('ix_bookings_requested_to_id_status', ['requested_to_id', 'status']),
+    ('ix_bookings_slot_id', ['slot', 'id']),
+]
+
+
+def _next_month(month: date):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _create_table(name: str, sequence: str, primary_key: str, suffix: str = ''):
+    op.execute(f"""
+        CREATE TABLE {name} (
+            id integer NOT NULL DEFAULT nextval('{sequence}'),
+            instrument_id integer NOT NULL REFERENCES instruments (instrument_id),
+            slot timestamp without time zone NOT NULL,
+            slot_index integer,
+            requested_by_id integer NOT NULL REFERENCES users (id),
+            requested_to_id integer NOT NULL REFERENCES users (id),
+            status bookingstatusenum NOT NULL,
+            PRIMARY KEY ({primary_key})
+        ) {suffix}
+    """)
+
+
+def _active_slot_index(table: str):
+    op.execute(
+        f"CREATE UNIQUE INDEX uq_{table}_active_instrument_slot_index ON {table} (instrument_id, slot_index) WHERE {ACTIVE_WHERE}"
+    )
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    if connection.dialect.name != 'postgresql':
+        return
+
+    op.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    op.execute("LOCK TABLE bookings IN ACCESS EXCLUSIVE MODE")
+    op.execute("SET LOCAL lock_timeout = 0")
+
+    sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence('bookings', 'id')")).scalar()
+    first_slot = connection.execute(sa.text("SELECT min(slot) FROM bookings")).scalar()
+
+    # The old table goes away at the end: keep its id sequence and free its constraint names
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    op.execute("ALTER TABLE bookings RENAME TO bookings_unpartitioned")
+    op.execute("ALTER TABLE bookings_unpartitioned RENAME CONSTRAINT bookings_pkey TO bookings_unpartitioned_pkey")
+
+    _create_table('bookings', sequence, 'id, slot', 'PARTITION BY RANGE (slot)')
+
+    # One partition per month from the oldest booking to PARTITIONS_AHEAD months ahead; anything
+    # further out lands in the default partition until its month is created
+    today = date.today()
+    month = date((first_slot or today).year, (first_slot or today).month, 1)
+    last = date(today.year, today.month, 1)
+    for _ in range(PARTITIONS_AHEAD):
+        last = _next_month(last)
+    partitions = ['bookings_default']
+    op.execute("CREATE TABLE bookings_default PARTITION OF bookings DEFAULT")
+    while month <= last:
+        name = f"bookings_{month:%Y_%m}"
+        op.execute(f"CREATE TABLE {name} PARTITION OF bookings FOR VALUES FROM ('{month}') TO ('{_next_month(month)}')")
+        partitions.append(name)
+        month = _next_month(month)
+
+    op.execute(f"INSERT INTO bookings ({COLUMNS}) SELECT {COLUMNS} FROM bookings_unpartitioned")
+    op.execute("DROP TABLE bookings_unpartitioned")
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY bookings.id")
+
+    # Indexes last, so the copy doesn't maintain them row by row. Created on the parent they cover every partition.
+    for name, columns in INDEXES:
+        op.create_index(name, 'bookings', columns)
+    for name in partitions:
+        _active_slot_index(name)
+    # New tables start without statistics, and autovacuum never analyzes a partitioned parent
+    op.execute("ANALYZE bookings")
+
+
+# Partitions already detached by `python -m partitions --archive-...` are not brought back
+def downgrade() -> None:
+    connection = op.get_bind()
+    if connection.dialect.name != 'postgresql':
+        return
+
+    sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence('bookings', 'id')")).scalar()
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    op.execute("ALTER TABLE bookings RENAME TO bookings_partitioned")
+    op.execute("ALTER TABLE bookings_partitioned RENAME CONSTRAINT bookings_pkey TO bookings_partitioned_pkey")
+
+    _create_table('bookings', sequence, 'id')
+    op.execute(f"INSERT INTO bookings ({COLUMNS}) SELECT {COLUMNS} FROM bookings_partitioned")
+    op.execute("DROP TABLE bookings_partitioned")
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY bookings.id")
+
+    for name, columns in INDEXES:
+        op.create_index(name, 'bookings', columns)
+    op.create_index(
+        'uq_bookings_active_instrument_slot_index', 'bookings', ['instrument_id', 'slot_index'],
+        unique=True,
+        postgresql_where=sa.text(ACTIVE_WHERE),
+    )
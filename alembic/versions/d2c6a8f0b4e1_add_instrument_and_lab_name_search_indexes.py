@@ -0,0 +1,52 @@
+"""add instrument and lab name search indexes
+
+Revision ID: d2c6a8f0b4e1
+Revises: b7d4e1a9c352
+Create Date: 2026-10-18 21:03:44.275019
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2c6a8f0b4e1'
+down_revision: Union[str, None] = 'b7d4e1a9c352'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# PostgreSQL: trigram GIN indexes serving search.py's ILIKE and `%` filters, and (PostgreSQL 14+) the
+# exact name matches of /bookings/me and /availability. CREATE EXTENSION needs a role allowed to
+# create it, or pg_trgm installed beforehand. Elsewhere: plain indexes for the exact matches.
+INDEXES = [
+    ('instruments', 'instrument_name'),
+    ('labs', 'name'),
+]
+
+
+def _index_name(table: str, column: str, dialect: str):
+    return f"ix_{table}_{column}_trgm" if dialect == 'postgresql' else f"ix_{table}_{column}"
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, column in INDEXES:
+        if dialect == 'postgresql':
+            op.create_index(
+                _index_name(table, column, dialect), table, [column],
+                postgresql_using='gin',
+                postgresql_ops={column: 'gin_trgm_ops'},
+            )
+        else:
+            op.create_index(_index_name(table, column, dialect), table, [column])
+
+
+# The extension stays: other objects may use it by now
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    for table, column in INDEXES:
+        op.drop_index(_index_name(table, column, dialect), table_name=table)
@@ -0,0 +1,200 @@
+# Bulk data generator for benchmarks.
+#
+#   DATABASE_URL=postgresql://... python -m bench.seed --reset
+#   DATABASE_URL=sqlite:///./bench.db python -m bench.seed --bookings 100000 --reset
+#
+# Users are bench_user_<n> / bench_admin_<n>, all with the same password, so bench.workload can log in as them.
+# The tables are created and stamped with the Alembic head, so the API starts against them.
+# Run with the API stopped (or restart it afterwards) so the occupancy index is warmed from the seeded rows.
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import insert, select
+
+import db
+import models
+import slots
+import startup
+from hashing import pwd_context
+
+DEFAULT_PASSWORD = "bench-password"
+
+INSTRUMENT_NAMES = [
+    "Microscope", "Centrifuge", "Spectrometer", "PCR Machine", "Oscilloscope",
+    "3D Printer", "Incubator", "Fume Hood", "Laser Cutter", "Mass Spectrometer",
+]
+
+
+def user_name(n: int):
+    return f"bench_user_{n}"
+
+
+def admin_name(n: int):
+    return f"bench_admin_{n}"
+
+
+def _insert_chunks(session, table, rows, batch_size: int):
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= batch_size:
+            session.execute(insert(table), chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        session.execute(insert(table), chunk)
+        count += len(chunk)
+    return count
+
+
+# ----- USERS -----
+def seed_users(session, args):
+    # One bcrypt hash shared by everyone: hashing thousands of passwords would dominate the run
+    hashed_password = pwd_context.hash(args.password)
+    admins = (
+        {"username": admin_name(n), "password": hashed_password, "privilege_level": models.PrivilegeLevelEnum.admin}
+        for n in range(args.admins)
+    )
+    users = (
+        {"username": user_name(n), "password": hashed_password, "privilege_level": models.PrivilegeLevelEnum.user}
+        for n in range(args.users)
+    )
+    table = models.User.__table__
+    _insert_chunks(session, table, admins, args.batch_size)
+    _insert_chunks(session, table, users, args.batch_size)
+
+    rows = session.execute(
+        select(table.c.id, table.c.privilege_level).where(table.c.username.like("bench\\_%", escape="\\"))
+    ).all()
+    admin_ids = [row.id for row in rows if row.privilege_level == models.PrivilegeLevelEnum.admin]
+    user_ids = [row.id for row in rows if row.privilege_level == models.PrivilegeLevelEnum.user]
+    return user_ids, admin_ids
+
+
+# ----- LABS / INSTRUMENTS -----
+def seed_instruments(session, args, rng: random.Random):
+    labs_table = models.Labs.__table__
+    _insert_chunks(session, labs_table, ({"name": f"Bench Lab {n}"} for n in range(args.labs)), args.batch_size)
+    lab_ids = session.execute(
+        select(labs_table.c.id).where(labs_table.c.name.like("Bench Lab %")).order_by(labs_table.c.id)
+    ).scalars().all()
+
+    # Each lab gets a few instrument kinds with several units each, like a real lab
+    instruments = []
+    for n in range(args.instruments):
+        instruments.append({
+            "instrument_name": rng.choice(INSTRUMENT_NAMES[:max(1, args.instrument_kinds)]),
+            "lab_id": lab_ids[n % len(lab_ids)],
+            "working": rng.random() >= args.broken_ratio,
+        })
+    instruments_table = models.Instrument.__table__
+    _insert_chunks(session, instruments_table, instruments, args.batch_size)
+
+    return session.execute(
+        select(instruments_table.c.instrument_id).where(instruments_table.c.lab_id.in_(lab_ids))
+    ).scalars().all()
+
+
+# ----- BOOKINGS -----
+# Spread over `days` days ending at the end of the availability window, so both history and the
+# next few days (what /availability looks at) are populated.
+# Seeded labs use the default slot grid.
+def _booking_rows(args, rng: random.Random, instrument_ids, user_ids, admin_ids):
+    grid = slots.DEFAULT_GRID
+    last_day = date.today() + timedelta(days=slots.AVAILABILITY_DAYS)
+    first_index = grid.first_index(last_day - timedelta(days=args.days))
+    slot_count = args.days * grid.per_day
+    today_index = grid.first_index(date.today())
+
+    # One flag per (instrument, slot): at most one pending/approved booking may hold it
+    taken = bytearray(len(instrument_ids) * slot_count)
+    for _ in range(args.bookings):
+        instrument = rng.randrange(len(instrument_ids))
+        offset = rng.randrange(slot_count)
+        index = first_index + offset
+
+        roll = rng.random()
+        if index < today_index:
+            status = models.BookingStatusEnum.approved if roll < 0.75 else models.BookingStatusEnum.rejected
+        elif roll < 0.6:
+            status = models.BookingStatusEnum.pending
+        elif roll < 0.9:
+            status = models.BookingStatusEnum.approved
+        else:
+            status = models.BookingStatusEnum.rejected
+
+        flag = instrument * slot_count + offset
+        if status in models.ACTIVE_BOOKING_STATUSES:
+            if taken[flag]:
+                status = models.BookingStatusEnum.rejected
+            else:
+                taken[flag] = 1
+
+        yield {
+            "instrument_id": instrument_ids[instrument],
+            "slot": grid.slot_start(index),
+            "slot_index": index,
+            "requested_by_id": rng.choice(user_ids),
+            "requested_to_id": rng.choice(admin_ids),
+            "status": status,
+        }
+
+
+def seed_bookings(session, args, rng: random.Random, instrument_ids, user_ids, admin_ids):
+    rows = _booking_rows(args, rng, instrument_ids, user_ids, admin_ids)
+    return _insert_chunks(session, models.Booking.__table__, rows, args.batch_size)
+
+
+def _timed(label: str, fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    print(f"{label}: {time.perf_counter() - started:.1f}s", flush=True)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed the database configured by DATABASE_URL with benchmark data")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--admins", type=int, default=50)
+    parser.add_argument("--labs", type=int, default=20)
+    parser.add_argument("--instruments", type=int, default=300)
+    parser.add_argument("--instrument-kinds", type=int, default=len(INSTRUMENT_NAMES))
+    parser.add_argument("--broken-ratio", type=float, default=0.05, help="share of instruments marked not working")
+    parser.add_argument("--bookings", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=365, help="days of booking history, ending with the availability window")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--seed", type=int, default=42, help="random seed; the same arguments give the same data")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--reset", action="store_true", help="DROP and recreate all tables first")
+    args = parser.parse_args(argv)
+
+    if args.users < 1 or args.admins < 1 or args.labs < 1 or args.instruments < 1 or args.days < 1:
+        parser.error("--users, --admins, --labs, --instruments and --days must be at least 1")
+
+    if args.reset:
+        models.Base.metadata.drop_all(bind=db.engine)
+    startup.create_schema()
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    with db.SessionLocal() as session:
+        table = models.User.__table__
+        if session.execute(select(table.c.id).where(table.c.username == admin_name(0))).first():
+            parser.error("benchmark data is already present; pass --reset to start over")
+
+        user_ids, admin_ids = _timed(f"{args.users} users + {args.admins} admins", seed_users, session, args)
+        instrument_ids = _timed(f"{args.labs} labs + {args.instruments} instruments", seed_instruments, session, args, rng)
+        session.commit()
+
+        count = _timed(f"{args.bookings} bookings over {args.days} days", seed_bookings, session, args, rng, instrument_ids, user_ids, admin_ids)
+        session.commit()
+
+    elapsed = time.perf_counter() - started
+    print(f"Seeded {db.engine.url.render_as_string(hide_password=True)} in {elapsed:.1f}s ({count / elapsed:,.0f} bookings/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Per-row cost of the hot list endpoints with and without FAST_JSON, on large payloads.
+#
+#   python -m bench.serialization
+#   python -m bench.serialization --rows 10000 --repeat 5
+#
+# Seeds its own throwaway SQLite database (one user owning every booking, --rows instruments and
+# bookings), then times query + formatting + serialization for each endpoint both ways:
+#   standard  ORM objects, response_model validation, jsonable_encoder + json.dumps (what FastAPI does)
+#   fast      column tuples, bulk formatting, orjson (serialization.FAST_JSON)
+# and checks that both produce the same bytes.
+import os
+import sys
+import tempfile
+
+# The app reads its configuration at import time: point it at a throwaway database first
+_db_dir = tempfile.mkdtemp(prefix="lab-booking-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_dir}/bench.db"
+os.environ.pop("REPLICA_DATABASE_URL", None)
+os.environ["HASH_WORKERS"] = "0"
+
+import argparse
+import json
+import time
+from typing import List
+
+from pydantic import parse_obj_as
+
+import db
+import models
+import schemas
+import serialization
+from bench import seed
+from oauth2 import Principal
+from routers import booking, instruments
+
+
+# ----- ENDPOINTS: (standard, fast) producers of the response body for `rows` rows -----
+def _my_bookings(principal: Principal, rows: int):
+    def standard(session):
+        result, _ = booking._get_my_bookings_formatted(session, principal, None, None, rows, 0, None, True)
+        return serialization.standard_dumps(parse_obj_as(List[dict], result))
+
+    def fast(session):
+        result, _ = booking._get_my_bookings_fast(session, principal, None, None, rows, 0, None, True)
+        return serialization.fast_dumps(result)
+
+    return standard, fast
+
+
+def _all_bookings(rows: int):
+    def standard(session):
+        bookings = booking._get_all_bookings(session, 0, rows, None, None, None, True)
+        return serialization.standard_dumps([schemas.Booking.from_orm(b) for b in bookings])
+
+    def fast(session):
+        bookings = booking._get_all_bookings(session, 0, rows, None, None, None, True, booking.BOOKING_COLUMNS)
+        return serialization.fast_dumps(serialization.as_dicts(bookings))
+
+    return standard, fast
+
+
+def _instruments():
+    def standard(session):
+        return serialization.standard_dumps([schemas.Instrument.from_orm(i) for i in instruments._get_instruments(session)])
+
+    def fast(session):
+        return serialization.fast_dumps(serialization.as_dicts(instruments._get_instruments(session, instruments.INSTRUMENT_COLUMNS)))
+
+    return standard, fast
+
+
+# Best of `repeat` runs, each with a fresh session so no ORM identity map carries over
+def _time(fn, repeat: int):
+    best = None
+    body = None
+    for _ in range(repeat):
+        with db.SessionLocal() as session:
+            started = time.perf_counter()
+            body = fn(session)
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the standard and FAST_JSON paths of the hot list endpoints")
+    parser.add_argument("--rows", type=int, default=10_000, help="rows per payload")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per path; the fastest is reported")
+    args = parser.parse_args(argv)
+
+    seed.main([
+        "--users", "1", "--admins", "1", "--labs", "10",
+        "--instruments", str(args.rows), "--bookings", str(args.rows), "--days", "3650",
+        "--reset",
+    ])
+    with db.SessionLocal() as session:
+        user = session.query(models.User).filter(models.User.username == seed.user_name(0)).one()
+        principal = Principal(id=user.id, username=user.username, privilege_level=user.privilege_level)
+
+    endpoints = {
+        "/bookings/me": _my_bookings(principal, args.rows),
+        "/bookings/": _all_bookings(args.rows),
+        "/instruments/": _instruments(),
+    }
+
+    print()
+    print(f"{'endpoint':<16}{'rows':>8}{'standard us/row':>18}{'fast us/row':>14}{'speedup':>10}  identical")
+    failed = False
+    for name, (standard, fast) in endpoints.items():
+        standard_seconds, standard_body = _time(standard, args.repeat)
+        fast_seconds, fast_body = _time(fast, args.repeat)
+        rows = len(json.loads(fast_body))
+        identical = standard_body == fast_body
+        failed |= not identical
+        print(
+            f"{name:<16}{rows:>8}{standard_seconds / rows * 1e6:>18.2f}{fast_seconds / rows * 1e6:>14.2f}"
+            f"{standard_seconds / fast_seconds:>9.1f}x  {'yes' if identical else 'NO'}"
+        )
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
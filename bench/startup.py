@@ -0,0 +1,74 @@
+# Per-worker cold start: what a fresh uvicorn worker spends before it can serve its first request.
+#
+#   DATABASE_URL=postgresql://... python -m bench.seed --reset
+#   DATABASE_URL=postgresql://... python -m bench.startup --runs 10
+#
+# Every run is a fresh interpreter, like a worker after a (rolling) restart, timed two ways:
+#   before  import main, then create_all at import time and the serial occupancy warm-up the old main.py did
+#   after   import main, then the lifespan: one-query Alembic head check and the parallel pool/catalog/occupancy warm
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PHASES = ("import", "startup", "total")
+
+
+# ----- ONE WORKER (in a child process) -----
+def _child(mode: str):
+    started = time.perf_counter()
+    import asyncio
+
+    import main
+    imported = time.perf_counter()
+
+    if mode == "before":
+        import db
+        import models
+        import occupancy
+
+        models.Base.metadata.create_all(bind=db.engine)
+        with db.SessionLocal() as session:
+            occupancy.index.warm(session)
+    else:
+        async def boot():
+            async with main.app.router.lifespan_context(main.app):
+                pass
+
+        asyncio.run(boot())
+    finished = time.perf_counter()
+
+    print(json.dumps({"import": imported - started, "startup": finished - imported, "total": finished - started}))
+
+
+def _run(mode: str):
+    output = subprocess.run(
+        [sys.executable, "-m", "bench.startup", "--child", mode],
+        check=True, capture_output=True, text=True, env={**os.environ, "HASH_WORKERS": "0"},
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare per-worker cold-start time before and after the lifespan boot")
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per mode; medians are reported")
+    parser.add_argument("--child", choices=("before", "after"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _child(args.child)
+        return 0
+
+    results = {mode: [_run(mode) for _ in range(args.runs)] for mode in ("before", "after")}
+
+    print(f"{'mode':<8}" + "".join(f"{phase + ' ms':>14}" for phase in PHASES))
+    for mode, runs in results.items():
+        print(f"{mode:<8}" + "".join(f"{statistics.median(run[phase] for run in runs) * 1000:>14.1f}" for phase in PHASES))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
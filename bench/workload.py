@@ -0,0 +1,342 @@
+# Scripted workload against a running API, with per-endpoint latency percentiles and throughput.
+#
+#   python -m bench.seed --reset && uvicorn main:app --workers 4 &
+#   python -m bench.workload --duration 60 --concurrency 32 --save bench/baseline.json
+#   python -m bench.workload --duration 60 --concurrency 32 --compare bench/baseline.json
+#
+# --compare exits with status 1 when an endpoint's p95 grew or its throughput fell by more than --tolerance.
+# Start the API with ADMISSION_CONTROL=0 to measure raw capacity: otherwise the per-user rate limits turn most of
+# a few bench users' requests into 429s.
+import argparse
+import asyncio
+import base64
+import json
+import math
+import platform
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+import httpx
+
+import slots
+from bench.seed import DEFAULT_PASSWORD, admin_name, user_name
+
+# Operation -> weight; roughly what a day of traffic looks like (mostly reads, few logins)
+DEFAULT_MIX = "availability=40,bookings_me=25,create_booking=15,approvals=10,login=10"
+OPERATIONS = ("availability", "bookings_me", "create_booking", "approvals", "login")
+
+# Non-2xx responses that are a normal outcome of the operation rather than a failure
+EXPECTED_STATUSES = {
+    "create_booking": {400},  # slot already taken
+    "decision": {400, 404},  # decided concurrently / slot re-taken
+}
+
+
+# ----- RESULTS -----
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.recording = False
+
+    def record(self, endpoint: str, elapsed: float, status):
+        if not self.recording:
+            return
+        self.latencies[endpoint].append(elapsed)
+        self.statuses[endpoint][status] += 1
+
+
+def percentile(sorted_values, fraction: float):
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def summarize(recorder: Recorder, duration: float):
+    endpoints = {}
+    for endpoint in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[endpoint])
+        statuses = recorder.statuses[endpoint]
+        expected = EXPECTED_STATUSES.get(endpoint, set())
+        errors = sum(
+            count for status, count in statuses.items()
+            if not isinstance(status, int) or (status >= 400 and status not in expected)
+        )
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "errors": errors,
+            "throughput_rps": round(len(values) / duration, 2),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        }
+    return endpoints
+
+
+def print_table(endpoints):
+    print(f"{'endpoint':<16}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, row in endpoints.items():
+        print(
+            f"{endpoint:<16}{row['requests']:>10}{row['errors']:>8}{row['throughput_rps']:>10.1f}"
+            f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+        )
+
+
+# A regression is a p95 that grew, or a throughput that fell, by more than `tolerance`
+def compare(baseline, endpoints, tolerance: float):
+    regressions = []
+    print(f"\n{'endpoint':<16}{'p95 ms (base)':>16}{'p95 ms':>10}{'req/s (base)':>15}{'req/s':>10}")
+    for endpoint, row in endpoints.items():
+        base = baseline["endpoints"].get(endpoint)
+        if base is None:
+            print(f"{endpoint:<16}{'-':>16}{row['p95_ms']:>10.1f}{'-':>15}{row['throughput_rps']:>10.1f}")
+            continue
+        flags = []
+        if row["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            flags.append("p95")
+        if row["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            flags.append("throughput")
+        if flags:
+            regressions.append((endpoint, flags))
+        print(
+            f"{endpoint:<16}{base['p95_ms']:>16.1f}{row['p95_ms']:>10.1f}"
+            f"{base['throughput_rps']:>15.1f}{row['throughput_rps']:>10.1f}"
+            + ("  REGRESSION: " + ", ".join(flags) if flags else "")
+        )
+    return regressions
+
+
+# ----- VIRTUAL USERS -----
+class Catalog:
+    def __init__(self, pairs, instrument_ids):
+        self.pairs = pairs  # (lab name, instrument name) of working instruments
+        self.instrument_ids = instrument_ids
+
+
+async def load_catalog(client: httpx.AsyncClient):
+    labs = (await client.get("/labs/")).raise_for_status().json()
+    instruments = (await client.get("/instruments/")).raise_for_status().json()
+    lab_names = {lab["id"]: lab["name"] for lab in labs}
+    working = [instrument for instrument in instruments if instrument["working"] and instrument["lab_id"] in lab_names]
+    if not working:
+        raise SystemExit("No working instruments found; seed the database with `python -m bench.seed` first")
+    pairs = sorted({(lab_names[instrument["lab_id"]], instrument["instrument_name"]) for instrument in working})
+    return Catalog(pairs, [instrument["instrument_id"] for instrument in working])
+
+
+async def timed_request(client, recorder, endpoint: str, method: str, url: str, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except httpx.HTTPError as exc:
+        recorder.record(endpoint, time.perf_counter() - started, type(exc).__name__)
+        return None
+    recorder.record(endpoint, time.perf_counter() - started, response.status_code)
+    return response
+
+
+# Bookings are addressed to an admin's id; login only returns a token, whose payload carries it
+def token_user_id(headers):
+    token = headers["Authorization"].split(" ", 1)[1]
+    payload = token.split(".")[1]
+    return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["user_id"]
+
+
+async def login(client, recorder, username: str, password: str):
+    response = await timed_request(
+        client, recorder, "login", "POST", "/user/login",
+        data={"username": username, "password": password}
+    )
+    if response is None or response.status_code != 200:
+        return None
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+class VirtualUser:
+    def __init__(self, client, recorder, catalog, args, rng: random.Random):
+        self.client = client
+        self.recorder = recorder
+        self.catalog = catalog
+        self.args = args
+        self.rng = rng
+        self.user_headers = None
+        self.admin_headers = None
+        self.admin_id = None
+        self.admin_ids = None  # every virtual user's admin, filled in once all have logged in
+
+    async def start(self):
+        self.user_headers = await login(self.client, self.recorder, self._random_user(), self.args.password)
+        self.admin_headers = await login(
+            self.client, self.recorder, admin_name(self.rng.randrange(self.args.admins)), self.args.password
+        )
+        if self.user_headers is None or self.admin_headers is None:
+            raise SystemExit("Login failed; check --password and that the seeded users exist")
+        self.admin_id = token_user_id(self.admin_headers)
+
+    def _random_user(self):
+        return user_name(self.rng.randrange(self.args.users))
+
+    async def availability(self):
+        lab_name, instrument_name = self.rng.choice(self.catalog.pairs)
+        await timed_request(
+            self.client, self.recorder, "availability", "GET",
+            f"/bookings/availability/{lab_name}/{instrument_name}"
+        )
+
+    async def bookings_me(self):
+        await timed_request(
+            self.client, self.recorder, "bookings_me", "GET", "/bookings/me",
+            params={"limit": 50}, headers=self.user_headers
+        )
+
+    async def create_booking(self):
+        day = date.today() + timedelta(days=self.rng.randrange(slots.AVAILABILITY_DAYS))
+        grid = slots.DEFAULT_GRID  # as seeded
+        slot = grid.slot_start(grid.first_index(day) + self.rng.randrange(grid.per_day))
+        await timed_request(
+            self.client, self.recorder, "create_booking", "POST", "/bookings/",
+            headers=self.user_headers,
+            json={
+                "instrument_id": self.rng.choice(self.catalog.instrument_ids),
+                "slot": slot.isoformat(),
+                "requested_to_id": self.rng.choice(self.admin_ids),
+            }
+        )
+
+    async def approvals(self):
+        # What the approver dashboard loads: the pending badge, then a page of pending bookings from today on
+        await timed_request(
+            self.client, self.recorder, "inbox_summary", "GET", "/approving/to_approve/summary",
+            params={"status": "pending"}, headers=self.admin_headers
+        )
+        response = await timed_request(
+            self.client, self.recorder, "to_approve", "GET", "/approving/to_approve",
+            params={"limit": 20, "status": "pending"}, headers=self.admin_headers
+        )
+        if response is None or response.status_code != 200:
+            return
+        pending = response.json()
+        if not pending:
+            return
+        booking = self.rng.choice(pending)
+        await timed_request(
+            self.client, self.recorder, "decision", "PUT", f"/approving/{booking['id']}/decision",
+            headers=self.admin_headers,
+            json={"status": "approved" if self.rng.random() < 0.8 else "rejected"}
+        )
+
+    async def login(self):
+        headers = await login(self.client, self.recorder, self._random_user(), self.args.password)
+        if headers is not None:
+            self.user_headers = headers
+
+    async def run(self, operations, weights, deadline: float):
+        while time.perf_counter() < deadline:
+            operation = self.rng.choices(operations, weights)[0]
+            await getattr(self, operation)()
+            if self.args.think_time:
+                await asyncio.sleep(self.rng.expovariate(1 / self.args.think_time))
+
+
+def parse_mix(mix: str):
+    operations, weights = [], []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        operations.append(name)
+        weights.append(float(weight))
+    return operations, weights
+
+
+async def run(args):
+    operations, weights = parse_mix(args.mix)
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        catalog = await load_catalog(client)
+
+        master = random.Random(args.seed)
+        users = [VirtualUser(client, recorder, catalog, args, random.Random(master.random())) for _ in range(args.concurrency)]
+        await asyncio.gather(*(user.start() for user in users))
+        admin_ids = sorted({user.admin_id for user in users})
+        for user in users:
+            user.admin_ids = admin_ids
+
+        if args.warmup:
+            print(f"Warming up for {args.warmup}s...", flush=True)
+            warmup_deadline = time.perf_counter() + args.warmup
+            await asyncio.gather(*(user.run(operations, weights, warmup_deadline) for user in users))
+
+        print(f"Running {args.concurrency} virtual users for {args.duration}s against {args.base_url}...", flush=True)
+        recorder.recording = True
+        started = time.perf_counter()
+        await asyncio.gather(*(user.run(operations, weights, started + args.duration) for user in users))
+        elapsed = time.perf_counter() - started
+        recorder.recording = False
+
+    return summarize(recorder, elapsed), elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a production-like request mix against a running API")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before the measurement")
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users issuing requests back to back")
+    parser.add_argument("--think-time", type=float, default=0, help="mean seconds a virtual user pauses between requests")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="comma separated operation=weight")
+    parser.add_argument("--users", type=int, default=5000, help="bench_user_<n> accounts to log in as (as seeded)")
+    parser.add_argument("--admins", type=int, default=50, help="bench_admin_<n> accounts to approve with (as seeded)")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression for --compare")
+    args = parser.parse_args(argv)
+
+    endpoints, elapsed = asyncio.run(run(args))
+    print()
+    print_table(endpoints)
+
+    result = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "base_url": args.base_url,
+            "duration_s": round(elapsed, 2),
+            "concurrency": args.concurrency,
+            "think_time_s": args.think_time,
+            "mix": args.mix,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "host": platform.node(),
+        },
+        "endpoints": endpoints,
+    }
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(result, file, indent=2)
+            file.write("\n")
+        print(f"\nSaved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, endpoints, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} endpoint(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# Database round trips and latency per write, before and after the INSERT/UPDATE/DELETE ... RETURNING rewrite.
+#
+#   python -m bench.writes
+#   python -m bench.writes --repeat 500
+#
+# Seeds its own throwaway SQLite database, then runs every write endpoint's database function both ways:
+#   before  the ORM version: SELECT the row first where needed, add/delete, commit, refresh
+#   after   the routers' functions: one statement with RETURNING, then commit
+# Round trips are the statements sent plus the COMMIT/ROLLBACK. SQLite is in-process, so the times only
+# show the client-side cost; against a networked database each round trip adds one latency on top.
+import os
+import sys
+import tempfile
+
+# The app reads its configuration at import time: point it at a throwaway database first
+_db_dir = tempfile.mkdtemp(prefix="lab-booking-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_dir}/bench.db"
+os.environ.pop("REPLICA_DATABASE_URL", None)
+os.environ["HASH_WORKERS"] = "0"
+
+import argparse
+import itertools
+import statistics
+import time
+
+from fastapi import HTTPException
+from sqlalchemy import event
+
+import db
+import models
+import schemas
+from bench import seed
+from oauth2 import Principal
+from routers import approving, instruments, lab, users
+
+HASHED_PASSWORD = "$2b$12$" + "x" * 53  # never verified here
+_names = itertools.count()
+
+
+# ----- BEFORE: the ORM versions the routers used to run -----
+def _create_lab_orm(session, data):
+    db_lab = models.Labs(**data.dict())
+    session.add(db_lab)
+    session.commit()
+    session.refresh(db_lab)
+    return db_lab
+
+
+def _create_instrument_orm(session, data):
+    instrument = models.Instrument(**data.dict())
+    session.add(instrument)
+    session.commit()
+    session.refresh(instrument)
+    return instrument
+
+
+def _update_instrument_orm(session, instrument_id, data):
+    instrument = session.query(models.Instrument).filter(models.Instrument.instrument_id == instrument_id).first()
+    if not instrument:
+        raise HTTPException(status_code=404, detail="Instrument not found")
+    for key, value in data.dict().items():
+        setattr(instrument, key, value)
+    session.commit()
+    session.refresh(instrument)
+    return instrument
+
+
+def _delete_instrument_orm(session, instrument_id):
+    instrument = session.query(models.Instrument).filter(models.Instrument.instrument_id == instrument_id).first()
+    if not instrument:
+        raise HTTPException(status_code=404, detail="Instrument not found")
+    session.delete(instrument)
+    session.commit()
+    return {"message": "Instrument deleted successfully"}
+
+
+def _signup_orm(session, data, hashed_password):
+    if users._get_user_by_username(session, data.username):
+        raise HTTPException(status_code=400, detail="Username already taken")
+    user = models.User(username=data.username, password=hashed_password, privilege_level=data.privilege_level)
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+    return user
+
+
+def _decide_orm(session, booking_id, decision, principal):
+    booking = session.query(models.Booking).filter(models.Booking.id == booking_id).first()
+    if not booking:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    if booking.requested_to_id != principal.id:
+        raise HTTPException(status_code=403, detail="Not authorized to make a decision on this booking")
+    booking.status = decision.status
+    session.commit()
+    session.refresh(booking)
+    return booking
+
+
+# ----- WRITES: name -> (response model, {mode: prepare(session) -> write(session)}) -----
+# prepare runs outside the measurement (update/delete need an instrument to work on)
+def _instrument_payload(lab_id):
+    return schemas.InstrumentCreate(instrument_name=f"Bench instrument {next(_names)}", lab_id=lab_id, working=True)
+
+
+def _writes(lab_id, principal, booking_ids):
+    decision = schemas.BookingStatusUpdate(status="rejected")
+
+    def create_lab(create):
+        return lambda session: lambda session: create(session, schemas.LabCreate(name=f"Bench lab {next(_names)}"))
+
+    def create_instrument(create):
+        return lambda session: lambda session: create(session, _instrument_payload(lab_id))
+
+    def on_new_instrument(write, *args):
+        def prepare(session):
+            instrument_id = instruments._create_instrument(session, _instrument_payload(lab_id)).instrument_id
+            return lambda session: write(session, instrument_id, *args)
+        return prepare
+
+    def signup(create):
+        return lambda session: lambda session: create(session, schemas.UserCreate(
+            username=f"bench_signup_{next(_names)}", password="unused", privilege_level="user"
+        ), HASHED_PASSWORD)
+
+    # A pending/approved booking per write, rejected: deciding an unchanged status would let the ORM skip its UPDATE
+    def decide(write):
+        def prepare(session):
+            booking_id = next(booking_ids)
+            return lambda session: write(session, booking_id, decision, principal)
+        return prepare
+
+    return {
+        "create_lab": (schemas.Lab, {"before": create_lab(_create_lab_orm), "after": create_lab(lab._create_lab)}),
+        "create_instrument": (schemas.Instrument, {
+            "before": create_instrument(_create_instrument_orm),
+            "after": create_instrument(instruments._create_instrument),
+        }),
+        "update_instrument": (schemas.Instrument, {
+            "before": on_new_instrument(_update_instrument_orm, _instrument_payload(lab_id)),
+            "after": on_new_instrument(instruments._update_instrument, _instrument_payload(lab_id)),
+        }),
+        "delete_instrument": (None, {
+            "before": on_new_instrument(_delete_instrument_orm),
+            "after": on_new_instrument(instruments._delete_instrument),
+        }),
+        "signup": (schemas.User, {"before": signup(_signup_orm), "after": signup(users._create_user)}),
+        "approve_or_reject": (schemas.Booking, {
+            "before": decide(_decide_orm),
+            "after": decide(approving._approve_or_reject_booking),
+        }),
+    }
+
+
+# ----- MEASURING -----
+class RoundTrips:
+    def __init__(self):
+        self.count = 0
+
+    def statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def transaction_end(self, conn):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(db.engine, "before_cursor_execute", self.statement)
+        event.listen(db.engine, "commit", self.transaction_end)
+        event.listen(db.engine, "rollback", self.transaction_end)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, "before_cursor_execute", self.statement)
+        event.remove(db.engine, "commit", self.transaction_end)
+        event.remove(db.engine, "rollback", self.transaction_end)
+
+
+# Fields that differ from one write to the next (new ids and names, another booking) only compare by type
+VARYING_FIELDS = {"id", "instrument_id", "name", "instrument_name", "username", "slot", "requested_by_id"}
+
+
+def _comparable(model, row):
+    if model is None:
+        return row
+    body = model.from_orm(row).dict()
+    return {key: type(value) if key in VARYING_FIELDS else value for key, value in body.items()}
+
+
+# (round trips of one write, median seconds, comparable response)
+def _measure(prepare, repeat: int, model):
+    trips, seconds, body = None, [], None
+    for _ in range(repeat):
+        with db.SessionLocal() as session:
+            write = prepare(session)
+            with RoundTrips() as counter:
+                started = time.perf_counter()
+                row = write(session)
+                seconds.append(time.perf_counter() - started)
+            body = _comparable(model, row)
+        trips = counter.count
+    return trips, statistics.median(seconds), body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare database round trips per write before and after RETURNING")
+    parser.add_argument("--repeat", type=int, default=200, help="writes per endpoint and mode; the median time is reported")
+    args = parser.parse_args(argv)
+
+    bookings = max(1000, 4 * args.repeat)
+    seed.main(["--users", "2", "--admins", "1", "--labs", "2", "--instruments", "10", "--bookings", str(bookings), "--reset"])
+    with db.SessionLocal() as session:
+        admin = session.query(models.User).filter(models.User.username == seed.admin_name(0)).one()
+        principal = Principal(id=admin.id, username=admin.username, privilege_level=admin.privilege_level)
+        lab_id = session.query(models.Labs.id).first()[0]
+        booking_ids = iter([booking_id for (booking_id,) in session.query(models.Booking.id).filter(
+            models.Booking.requested_to_id == admin.id,
+            models.Booking.status.in_(models.ACTIVE_BOOKING_STATUSES)
+        ).order_by(models.Booking.id).limit(2 * args.repeat)])
+
+    print()
+    print(f"{'write':<20}{'round trips':>14}{'us/write':>20}  identical")
+    failed = False
+    for name, (model, modes) in _writes(lab_id, principal, booking_ids).items():
+        before = _measure(modes["before"], args.repeat, model)
+        after = _measure(modes["after"], args.repeat, model)
+        identical = before[2] == after[2]
+        failed |= not identical
+        print(
+            f"{name:<20}{before[0]:>7} -> {after[0]:<4}{before[1] * 1e6:>10.0f} -> {after[1] * 1e6:<7.0f}"
+            f"  {'yes' if identical else 'NO'}"
+        )
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import threading
+
+from fastapi import Request, Response
+
+import serialization
+from cache import TTLCache
+
+# ----- CONFIG -----
+# Without LIVE_NOTIFY other workers don't see this process's version bumps, so entries also expire after a while
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "300"))
+CATALOG_CACHE_SIZE = 1024
+
+_lock = threading.Lock()
+_version = 0
+_responses = TTLCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)  # (key, version) -> (body, etag)
+
+
+# ----- VERSION: bumped by every lab/instrument write -----
+def version():
+    return _version
+
+
+def bump():
+    global _version
+    with _lock:
+        _version += 1
+    _responses.clear()
+
+
+# ----- PRE-SERIALIZED RESPONSES -----
+def lookup(key: str):
+    return _responses.get((key, _version))
+
+
+# (body, etag): serialized exactly like FastAPI's JSONResponse would
+def serialize(content):
+    body = serialization.dumps(content)
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    return body, etag
+
+
+# Serialize once and remember it for this version.
+# `catalog_version` must be read before the data was queried, so a concurrent bump invalidates it.
+def store(key: str, catalog_version: int, content):
+    entry = serialize(content)
+    _responses.set((key, catalog_version), entry)
+    return entry
+
+
+def _etag_matches(if_none_match: str, etag: str):
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def respond(request: Request, entry):
+    body, etag = entry
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
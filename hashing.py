@@ -0,0 +1,82 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+import metrics
+
+# ----- CONFIG -----
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Worker processes for bcrypt; 0 hashes on the default threadpool instead
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+# Jobs allowed to wait for or run on the pool before new ones get a 503
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "64"))
+HASH_RETRY_AFTER_SECONDS = 1
+
+# Hashes made with a different cost factor are flagged by needs_update() and rehashed on login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_executor = None
+_in_flight = 0
+
+
+# ----- RUN IN WORKER PROCESS -----
+def _hash(password: str):
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str):
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+# ----- POOL -----
+def _get_executor():
+    global _executor
+    if _executor is None and HASH_WORKERS > 0:
+        # forkserver: fork()ing the running server (event loop, threadpool, open connections) can deadlock the child
+        _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+# Only called from the event loop, so _in_flight needs no lock
+async def _submit(operation: str, fn, *args):
+    global _in_flight
+
+    if _in_flight >= HASH_QUEUE_SIZE:
+        metrics.HASH_REJECTED.labels(operation).inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": str(HASH_RETRY_AFTER_SECONDS)},
+        )
+
+    _in_flight += 1
+    metrics.HASH_QUEUE_DEPTH.set(_in_flight)
+    started = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _in_flight -= 1
+        metrics.HASH_QUEUE_DEPTH.set(_in_flight)
+        metrics.HASH_LATENCY.labels(operation).observe(time.perf_counter() - started)
+
+
+async def hash_password(password: str):
+    return await _submit("hash", _hash, password)
+
+
+# Returns (valid, new_hash); new_hash is set when the stored hash should be replaced
+async def verify_password(password: str, hashed_password: str):
+    return await _submit("verify", _verify_and_update, password, hashed_password)
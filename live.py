@@ -0,0 +1,402 @@
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+import catalog
+import db
+import models
+import oauth2
+import occupancy
+import slots
+
+# ----- CONFIG -----
+# Relay booking, lab/instrument and user changes between uvicorn workers with Postgres LISTEN/NOTIFY.
+# Each worker then pushes its peers' changes to its own subscribers and applies them to its own
+# occupancy index, catalog caches and principal cache.
+LIVE_NOTIFY = os.getenv("LIVE_NOTIFY", "0") == "1"
+LIVE_NOTIFY_CHANNEL = os.getenv("LIVE_NOTIFY_CHANNEL", "booking_occupancy")
+# Idle streams get a comment line this often so proxies keep them open
+LIVE_KEEPALIVE_SECONDS = float(os.getenv("LIVE_KEEPALIVE_SECONDS", "15"))
+# Messages buffered per subscriber; one that falls further behind is sent a fresh snapshot instead
+LIVE_QUEUE_SIZE = 32
+LIVE_RECONNECT_SECONDS = 5
+
+log = logging.getLogger("live")
+
+_worker_id = uuid.uuid4().hex
+
+
+# ----- SNAPSHOTS AND DELTAS (run on the threadpool) -----
+# Read from the primary: changes are announced right after they commit
+def _load_snapshot(lab_name: str, instrument_name: str, days: int):
+    today = datetime.now().date()
+    catalog_version = catalog.version()
+
+    with db.SessionLocal() as session:
+        occupancy_lookup = occupancy.lookup(session)
+        lab_id, grid, instrument_ids = occupancy_lookup.lab_instruments(lab_name, instrument_name)
+        if lab_id is None:
+            raise HTTPException(status_code=404, detail="Lab not found")
+        if not instrument_ids:
+            raise HTTPException(status_code=404, detail="No working instruments found")
+        first_index, last_index = grid.window(today, days)
+        entries = occupancy.availability(occupancy_lookup, instrument_ids, grid, first_index, last_index)
+
+    return catalog_version, today, grid, frozenset(instrument_ids), first_index, last_index, entries
+
+
+def _load_entries(grid: slots.SlotGrid, instrument_ids, slot_indexes):
+    with db.SessionLocal() as session:
+        booked_by_slot = occupancy.lookup(session).booked_counts(instrument_ids, min(slot_indexes), max(slot_indexes) + 1)
+    return [
+        occupancy.availability_entry(grid, slot_index, len(instrument_ids), booked_by_slot.get(slot_index, 0))
+        for slot_index in sorted(slot_indexes)
+    ]
+
+
+def _format(event: str, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+# ----- SUBSCRIPTIONS -----
+class Subscription:
+    def __init__(self, topic):
+        self.topic = topic
+        self.queue = asyncio.Queue(LIVE_QUEUE_SIZE)
+        self.stale = False
+
+    def push(self, message):
+        if self.stale:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Too far behind for deltas to help: drop them and catch up with one snapshot
+            self.stale = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+# Everyone watching one (lab, instrument name, horizon): deltas are computed once and fanned out
+class Topic:
+    def __init__(self, lab_name: str, instrument_name: str, days: int):
+        self.key = (lab_name, instrument_name, days)
+        self.subscriptions = set()
+        self.catalog_version = None
+        self.today = None
+        self.grid = None
+        self.instrument_ids = frozenset()
+        self.first_index = 0
+        self.last_index = 0
+        self.pending = set()  # (instrument id, slot index) changed but not sent yet
+        self.loading = 0
+        self.flushing = False
+        self.resyncing = False
+
+    def covers(self, instrument_id: int, slot_index: Optional[int]):
+        return instrument_id in self.instrument_ids and slot_index is not None \
+            and self.first_index <= slot_index < self.last_index
+
+    def watches(self, instrument_id: int, slot_index: Optional[int]):
+        # While a snapshot is loading the instrument set may be about to change, so keep everything
+        return self.loading > 0 or self.covers(instrument_id, slot_index)
+
+    def is_current(self):
+        return self.catalog_version == catalog.version() and self.today == datetime.now().date()
+
+    def publish(self, message):
+        for subscription in list(self.subscriptions):
+            subscription.push(message)
+
+
+class Broker:
+    def __init__(self):
+        self._loop = None
+        self._topics = {}
+        self._bridge = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        if LIVE_NOTIFY:
+            self._bridge = NotifyBridge(self)
+            self._bridge.start()
+
+    def stop(self):
+        if self._bridge is not None:
+            self._bridge.stop()
+            self._bridge = None
+
+    # --------- SUBSCRIBE ---------
+    async def subscribe(self, lab_name: str, instrument_name: str, days: int):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        key = (lab_name, instrument_name, days)
+        topic = self._topics.get(key)
+        if topic is None:
+            topic = self._topics[key] = Topic(lab_name, instrument_name, days)
+
+        # Registered before the snapshot loads so no change can fall between the two
+        subscription = Subscription(topic)
+        topic.subscriptions.add(subscription)
+        try:
+            snapshot = await self.refresh(topic)
+        except BaseException:
+            self.unsubscribe(subscription)
+            raise
+        return subscription, snapshot
+
+    def unsubscribe(self, subscription: Subscription):
+        topic = subscription.topic
+        topic.subscriptions.discard(subscription)
+        if not topic.subscriptions and not topic.loading and self._topics.get(topic.key) is topic:
+            del self._topics[topic.key]
+
+    async def refresh(self, topic: Topic):
+        topic.loading += 1
+        try:
+            catalog_version, today, grid, instrument_ids, first_index, last_index, entries = \
+                await run_in_threadpool(_load_snapshot, *topic.key)
+        finally:
+            topic.loading -= 1
+        topic.catalog_version = catalog_version
+        topic.today = today
+        topic.grid = grid
+        topic.instrument_ids = instrument_ids
+        topic.first_index = first_index
+        topic.last_index = last_index
+        self._schedule_flush(topic)
+        return entries
+
+    # Instruments changed or the window moved to a new day: everyone gets a new snapshot
+    async def resync(self, topic: Topic):
+        if topic.resyncing:
+            return
+        topic.resyncing = True
+        try:
+            topic.publish(("snapshot", await self.refresh(topic)))
+        except HTTPException as e:
+            topic.publish(("error", {"detail": e.detail}))
+        finally:
+            topic.resyncing = False
+
+    # --------- CHANGES ---------
+    # occupancy listener; runs on whichever thread committed the change
+    def booking_changed(self, booking_id: int, instrument_id: int, slot_index: Optional[int], status):
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._local_change, booking_id, instrument_id, slot_index, status)
+        except RuntimeError:
+            pass  # loop already closed at shutdown
+
+    def _local_change(self, booking_id: int, instrument_id: int, slot_index: Optional[int], status):
+        self.slot_changed(instrument_id, slot_index)
+        if self._bridge is not None:
+            self._loop.run_in_executor(None, self._bridge.notify, booking_id, instrument_id, slot_index, status)
+
+    # occupancy catalog listener: a lab/instrument write committed on this worker
+    def catalog_changed(self, change: dict):
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._local_catalog_change, change)
+        except RuntimeError:
+            pass
+
+    def _local_catalog_change(self, change: dict):
+        self.resync_all()
+        self._relay(change)
+
+    # oauth2 listener: a user's row changed on this worker; peers drop their cached principal
+    def principal_changed(self, user_id: int):
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._relay, {"kind": "principal", "user_id": user_id})
+        except RuntimeError:
+            pass
+
+    def _relay(self, change: dict):
+        if self._bridge is not None:
+            self._loop.run_in_executor(None, self._bridge.notify_change, change)
+
+    # On the event loop
+    def slot_changed(self, instrument_id: int, slot_index: Optional[int]):
+        for topic in self._topics.values():
+            if topic.watches(instrument_id, slot_index):
+                topic.pending.add((instrument_id, slot_index))
+                self._schedule_flush(topic)
+
+    def resync_all(self):
+        for topic in list(self._topics.values()):
+            asyncio.ensure_future(self.resync(topic))
+
+    def _schedule_flush(self, topic: Topic):
+        if topic.pending and not topic.flushing and not topic.loading:
+            topic.flushing = True
+            asyncio.ensure_future(self._flush(topic))
+
+    # Changes that arrive while a delta is being computed are coalesced into the next one
+    async def _flush(self, topic: Topic):
+        try:
+            while topic.pending and not topic.loading:
+                if not topic.is_current():
+                    topic.pending.clear()
+                    await self.resync(topic)
+                    break
+                changes, topic.pending = topic.pending, set()
+                slot_indexes = {slot_index for instrument_id, slot_index in changes if topic.covers(instrument_id, slot_index)}
+                if slot_indexes:
+                    entries = await run_in_threadpool(_load_entries, topic.grid, topic.instrument_ids, slot_indexes)
+                    topic.publish(("delta", entries))
+        except Exception:
+            log.exception("Failed to compute availability delta for %s", topic.key)
+        finally:
+            topic.flushing = False
+        # Changes that came in during a resync
+        self._schedule_flush(topic)
+
+
+broker = Broker()
+occupancy.add_listener(broker.booking_changed)
+occupancy.add_catalog_listener(broker.catalog_changed)
+oauth2.add_listener(broker.principal_changed)
+
+
+# ----- SERVER-SENT EVENTS -----
+async def stream(subscription: Subscription, snapshot):
+    try:
+        yield _format("snapshot", snapshot)
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), LIVE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if not subscription.topic.is_current():
+                    await broker.resync(subscription.topic)
+                yield ": keepalive\n\n"
+                continue
+
+            if subscription.stale:
+                subscription.stale = False
+                try:
+                    message = ("snapshot", await broker.refresh(subscription.topic))
+                except HTTPException as e:
+                    message = ("error", {"detail": e.detail})
+            if message is None:
+                continue
+
+            event, data = message
+            yield _format(event, data)
+            if event == "error":
+                return
+    finally:
+        broker.unsubscribe(subscription)
+
+
+# ----- POSTGRES LISTEN/NOTIFY BRIDGE -----
+class NotifyBridge:
+    def __init__(self, broker: Broker):
+        self._broker = broker
+        self._loop = asyncio.get_running_loop()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if db.engine.dialect.name != "postgresql":
+            log.warning("LIVE_NOTIFY needs PostgreSQL, not %s; live updates stay within this worker", db.engine.dialect.name)
+            return
+        self._thread = threading.Thread(target=self._listen, name="live-notify", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # On the threadpool, after the change has committed
+    def notify(self, booking_id: int, instrument_id: int, slot_index: Optional[int], status):
+        self._publish({
+            "kind": "booking", "booking_id": booking_id, "instrument_id": instrument_id,
+            "slot_index": slot_index, "status": getattr(status, "value", status)
+        })
+
+    # A lab/instrument change from occupancy.lab_changed() and friends, or a user's
+    def notify_change(self, change: dict):
+        self._publish(change)
+
+    def _publish(self, change: dict):
+        payload = json.dumps({"worker": _worker_id, **change})
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": LIVE_NOTIFY_CHANNEL, "payload": payload})
+                connection.commit()
+        except Exception:
+            log.exception("Failed to NOTIFY peers of %s change %r", change["kind"], change)
+
+    def _listen(self):
+        connected_before = False
+        while not self._stop.is_set():
+            try:
+                # A connection of its own, kept out of the pool for the life of the listener
+                connection = db.engine.raw_connection()
+                connection.detach()
+                try:
+                    dbapi_connection = connection.dbapi_connection
+                    dbapi_connection.autocommit = True
+                    with dbapi_connection.cursor() as cursor:
+                        cursor.execute(f'LISTEN "{LIVE_NOTIFY_CHANNEL}"')
+
+                    # Peers' changes made while disconnected were missed: rebuild from the database
+                    if connected_before:
+                        self._catch_up()
+                    connected_before = True
+
+                    while not self._stop.is_set():
+                        if select.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                            continue
+                        dbapi_connection.poll()
+                        while dbapi_connection.notifies:
+                            self._receive(dbapi_connection.notifies.pop(0).payload)
+                finally:
+                    connection.close()
+            except Exception:
+                log.exception("LISTEN %s connection failed; reconnecting", LIVE_NOTIFY_CHANNEL)
+                self._stop.wait(LIVE_RECONNECT_SECONDS)
+
+    def _receive(self, payload: str):
+        try:
+            change = json.loads(payload)
+            if change.pop("worker") == _worker_id:
+                return
+            if change["kind"] == "booking":
+                instrument_id, slot_index = change["instrument_id"], change["slot_index"]
+                occupancy.index.set_booking(change["booking_id"], instrument_id, slot_index, models.BookingStatusEnum(change["status"]))
+                self._loop.call_soon_threadsafe(self._broker.slot_changed, instrument_id, slot_index)
+            elif change["kind"] == "principal":
+                oauth2.invalidate_principal(change["user_id"])
+            else:
+                # A peer's lab/instrument write: this worker's index, catalog caches and topics follow it
+                occupancy.apply_catalog_change(change)
+                catalog.bump()
+                self._loop.call_soon_threadsafe(self._broker.resync_all)
+        except Exception:
+            log.exception("Ignoring malformed %s notification: %r", LIVE_NOTIFY_CHANNEL, payload)
+
+    def _catch_up(self):
+        oauth2.clear_principals()
+        if occupancy.OCCUPANCY_INDEX_ENABLED and occupancy.index.ready:
+            with db.SessionLocal() as session:
+                occupancy.index.warm(session)
+        self._loop.call_soon_threadsafe(self._broker.resync_all)
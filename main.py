@@ -1,11 +1,15 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from routers import instruments,booking,users,approving,lab
 
-import models
-import db
-models.Base.metadata.create_all(bind=db.engine)
+import metrics
+import startup
 
-app=FastAPI()
+# Tables come from Alembic (`alembic upgrade head`, or `python -m startup --create-schema` for a new database).
+# Startup checks the revision, warms the pools and caches, then /healthz/ready reports ready.
+app=FastAPI(lifespan=startup.lifespan)
+
+# Latency, SQL count, DB time and pool wait per route on /metrics; SLOW_REQUEST_MS enables the slow log
+app.add_middleware(metrics.RequestMetricsMiddleware)
 
 app.include_router(users.router)
 app.include_router(lab.router)
@@ -14,6 +18,26 @@ app.include_router(booking.router)
 app.include_router(approving.router)
 
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+  return metrics.metrics_response()
+
+
+# Liveness: the worker's event loop answers. Never touches the database, so a DB outage doesn't get workers restarted.
+@app.get("/healthz/live", include_in_schema=False)
+async def liveness():
+  return {"status": "alive"}
+
+
+# Readiness: booted and the database answers; 503 takes the worker out of the load balancer
+@app.get("/healthz/ready", include_in_schema=False)
+async def readiness(response: Response):
+  ready, reason = await startup.readiness()
+  if not ready:
+    response.status_code = 503
+  return {"status": reason}
+
+
 @app.get('/')
 def root():
-  return {"message":"Hello"}
\ No newline at end of file
+  return {"message":"Hello"}
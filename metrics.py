@@ -0,0 +1,214 @@
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# ----- CONFIG -----
+# Log requests slower than this many milliseconds with their SQL and parameters (unset = off)
+SLOW_REQUEST_MS = float(os.environ["SLOW_REQUEST_MS"]) if os.getenv("SLOW_REQUEST_MS") else None
+SLOW_REQUEST_MAX_PARAMS_CHARS = 500
+
+slow_request_log = logging.getLogger("perf.slow_requests")
+
+# ----- PASSWORD HASHING -----
+HASH_QUEUE_DEPTH = Gauge(
+    "password_hash_queue_depth",
+    "Password hash/verify jobs waiting for or running on the hashing pool"
+)
+HASH_LATENCY = Histogram(
+    "password_hash_seconds",
+    "Time from submitting a password hash/verify job to getting its result",
+    ["operation"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0, 10.0)
+)
+HASH_REJECTED = Counter(
+    "password_hash_rejected_total",
+    "Password hash/verify jobs refused with 503 because the queue was full",
+    ["operation"]
+)
+
+
+# ----- ADMISSION CONTROL -----
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Requests turned away before touching the database: rate_limited (429) or overloaded (503)",
+    ["route_class", "reason"]
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight",
+    "Admitted requests holding one of a connection pool's slots",
+    ["pool"]
+)
+ADMISSION_WAITING = Gauge(
+    "admission_waiting",
+    "Requests waiting for one of a connection pool's slots",
+    ["pool"]
+)
+
+
+# ----- STARTUP -----
+STARTUP_SECONDS = Gauge(
+    "startup_seconds",
+    "Time this worker spent on each boot phase: schema check, warm (pool, catalog, occupancy) and total",
+    ["phase"]
+)
+
+
+# ----- REQUESTS -----
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route template",
+    ["method", "route", "status"]
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    "http_request_sql_statements",
+    "SQL statements executed per request",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+REQUEST_SQL_REPEATED = Histogram(
+    "http_request_sql_repeated_statements",
+    "Statements per request whose SQL text was already run earlier in the same request (N+1 indicator)",
+    ["method", "route"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100)
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds",
+    "Time per request spent executing SQL",
+    ["method", "route"]
+)
+REQUEST_POOL_WAIT_SECONDS = Histogram(
+    "http_request_pool_wait_seconds",
+    "Time per request spent waiting to check a connection out of the pool",
+    ["method", "route"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+)
+
+
+# Per-request counters, shared with the threadpool / run_sync code through a context variable
+class RequestStats:
+    def __init__(self, capture_statements: bool):
+        self.statements = 0
+        self.repeated = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.captured = [] if capture_statements else None
+        self._seen = set()
+
+    def record_statement(self, statement: str, parameters, elapsed: float):
+        self.statements += 1
+        self.db_seconds += elapsed
+        if statement in self._seen:
+            self.repeated += 1
+        else:
+            self._seen.add(statement)
+        if self.captured is not None:
+            self.captured.append((elapsed, statement, repr(parameters)[:SLOW_REQUEST_MAX_PARAMS_CHARS]))
+
+
+_current_request = ContextVar("request_stats", default=None)
+
+
+# Pure ASGI middleware: the stats are finalised when the last body chunk is sent, not when the headers
+# go out, so streamed responses (/bookings/export) count their SQL and streaming time too
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(capture_statements=SLOW_REQUEST_MS is not None)
+        token = _current_request.set(stats)
+        started = time.perf_counter()
+        state = {"status": 500, "done": False}
+
+        def finish():
+            if not state["done"]:
+                state["done"] = True
+                _observe(scope, state["status"], time.perf_counter() - started, stats)
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            finish()  # errors and client disconnects
+            _current_request.reset(token)
+
+
+def _observe(scope, status: int, elapsed: float, stats: RequestStats):
+    route = scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+    method = scope["method"]
+
+    REQUEST_LATENCY.labels(method, route_path, str(status)).observe(elapsed)
+    REQUEST_SQL_STATEMENTS.labels(method, route_path).observe(stats.statements)
+    REQUEST_SQL_REPEATED.labels(method, route_path).observe(stats.repeated)
+    REQUEST_DB_SECONDS.labels(method, route_path).observe(stats.db_seconds)
+    REQUEST_POOL_WAIT_SECONDS.labels(method, route_path).observe(stats.pool_wait_seconds)
+
+    if SLOW_REQUEST_MS is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+        _log_slow_request(method, scope["path"], status, elapsed, stats)
+
+
+def _log_slow_request(method: str, path: str, status: int, elapsed: float, stats: RequestStats):
+    lines = [
+        f"{method} {path} -> {status} took {elapsed * 1000:.1f} ms: "
+        f"{stats.statements} statements ({stats.repeated} repeated), "
+        f"{stats.db_seconds * 1000:.1f} ms in SQL, {stats.pool_wait_seconds * 1000:.1f} ms waiting for the pool"
+    ]
+    for statement_elapsed, statement, parameters in stats.captured:
+        lines.append(f"  [{statement_elapsed * 1000:.1f} ms] {statement} -- {parameters}")
+    slow_request_log.warning("\n".join(lines))
+
+
+# ----- SQLALCHEMY HOOKS -----
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        stats = _current_request.get()
+        if stats is not None:
+            stats.record_statement(statement, parameters, elapsed)
+
+
+# Pools that time how long a checkout waits for a free (or new) connection
+class _TimedCheckout:
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats = _current_request.get()
+            if stats is not None:
+                stats.pool_wait_seconds += time.perf_counter() - started
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+# ----- PROMETHEUS ENDPOINT -----
+def metrics_response():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
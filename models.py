@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Boolean, Index, Time, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
 from db import Base
+import slots
 
 class PrivilegeLevelEnum(str, enum.Enum):
     user = "user"
@@ -13,14 +14,23 @@ class BookingStatusEnum(str, enum.Enum):
     approved = "approved"
     rejected = "rejected"
 
+# Bookings that hold their slot
+ACTIVE_BOOKING_STATUSES = (BookingStatusEnum.pending, BookingStatusEnum.approved)
+
 class Labs(Base):
     __tablename__ = "labs"
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String, nullable=False)
 
+    # Slot grid for bookings on this lab's instruments (slots.SlotGrid); kept in sync with alembic revision 8d1f3a6c2b90
+    slot_start = Column(Time, nullable=False, default=slots.DEFAULT_SLOT_START, server_default=text("'10:00:00'"))
+    slot_minutes = Column(Integer, nullable=False, default=slots.DEFAULT_SLOT_MINUTES, server_default=text("120"))
+    slots_per_day = Column(Integer, nullable=False, default=slots.DEFAULT_SLOTS_PER_DAY, server_default=text("4"))
+
     instruments = relationship("Instrument", back_populates="lab")
 
 
+# labs.name and instruments.instrument_name are indexed for search.py by alembic revision d2c6a8f0b4e1
 class Instrument(Base):
     __tablename__ = "instruments"
 
@@ -51,7 +61,10 @@ class Booking(Base):
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     instrument_id = Column(Integer, ForeignKey("instruments.instrument_id"), nullable=False)
     slot = Column(DateTime, nullable=False)
-    
+    # The slot `slot` falls in, as slots.SlotGrid.index() of the instrument's lab grid. Conflicts, counts
+    # and ranges compare this instead of datetimes. NULL only for old bookings outside working hours.
+    slot_index = Column(Integer)
+
     requested_by_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     requested_to_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
@@ -61,3 +74,19 @@ class Booking(Base):
     instrument = relationship("Instrument", back_populates="bookings")
     requested_by = relationship("User", foreign_keys=[requested_by_id], back_populates="bookings_requested")
     requested_to = relationship("User", foreign_keys=[requested_to_id], back_populates="bookings_approved")
+
+    # Kept in sync with alembic revisions 5c2e8d41b7a3 and 3f9b2e7c4a15. On PostgreSQL, revision b7d4e1a9c352
+    # then range-partitions the table by slot month (see partitions.py), with the unique index per partition.
+    __table_args__ = (
+        Index("ix_bookings_instrument_id_slot", "instrument_id", "slot"),
+        Index("ix_bookings_requested_by_id_slot", "requested_by_id", "slot"),
+        Index("ix_bookings_requested_to_id_status", "requested_to_id", "status"),
+        Index("ix_bookings_slot_id", "slot", "id"),
+        # At most one pending/approved booking per instrument and slot
+        Index(
+            "uq_bookings_active_instrument_slot_index", "instrument_id", "slot_index",
+            unique=True,
+            postgresql_where=text("status IN ('pending', 'approved')"),
+            sqlite_where=text("status IN ('pending', 'approved')")
+        ),
+    )
@@ -1,20 +1,46 @@
+import os
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 
 import models
-from db import get_db
+from cache import TTLCache
+from db import get_session, run_db
 
 # ----- CONFIG -----
 SECRET_KEY = "your_secret_key_here"  # 🔐 Replace with a secure, long random string
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Authenticated users are cached per process for this many seconds (0 disables the cache). User rows
+# changed through the ORM are dropped from this worker's cache when the change commits, and from other
+# workers' caches when LIVE_NOTIFY relays it. Without LIVE_NOTIFY other workers keep serving the old
+# privilege level (or a deleted user) for up to this long; so do all workers after bulk or hand-written SQL.
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="user/login")  # POST /login
 
 
+# What authenticated routes get as current_user: the user row without the password hash
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    privilege_level: models.PrivilegeLevelEnum
+
+
+_principals = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)  # user id -> Principal
+_verified_tokens = TTLCache(TOKEN_CACHE_SIZE)  # token -> user id, kept until the token's exp
+_listeners = []  # called with the user id after a change to that user commits
+
+
 # ----- 1. CREATE JWT TOKEN -----
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -28,20 +54,36 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
 
 # ----- 2. VERIFY JWT TOKEN -----
 def verify_access_token(token: str, credentials_exception):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("user_id")
+    user_id = user_id_from_token(token)
+    if user_id is None:
+        raise credentials_exception
+    return user_id
 
-        if user_id is None:
-            raise credentials_exception
 
+# User id of a valid token or None, for callers that only need to peek (no 401)
+def user_id_from_token(token: str):
+    user_id = _verified_tokens.get(token)
+    if user_id is not None:
         return user_id
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
-        raise credentials_exception
+        return None
+    user_id: int = payload.get("user_id")
+    if user_id is None:
+        return None
+
+    # The signature check can be skipped for this token until it expires
+    exp = payload.get("exp")
+    if exp is not None:
+        _verified_tokens.set(token, user_id, ttl=exp - time.time())
+
+    return user_id
 
 
 # ----- 3. GET CURRENT USER -----
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(get_session)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -49,9 +91,52 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     )
 
     user_id = verify_access_token(token, credentials_exception)
-    user = db.query(models.User).filter(models.User.id == user_id).first()
 
-    if user is None:
-        raise credentials_exception
+    principal = _principals.get(user_id)
+    if principal is None:
+        principal = await run_db(db, _get_principal, user_id)
+        if principal is None:
+            raise credentials_exception
+        _principals.set(user_id, principal)
+
+    return principal
+
+
+def _get_principal(db: Session, user_id: int):
+    row = db.query(models.User.id, models.User.username, models.User.privilege_level)\
+        .filter(models.User.id == user_id).first()
+    return Principal(*row) if row else None
+
+
+# ----- 4. PRINCIPAL CACHE INVALIDATION -----
+def invalidate_principal(user_id: int):
+    _principals.pop(user_id)
+
+
+def clear_principals():
+    _principals.clear()
+
+
+def add_listener(listener):
+    _listeners.append(listener)
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _user_changed(mapper, connection, target):
+    invalidate_principal(target.id)
+    Session.object_session(target).info.setdefault("changed_users", set()).add(target.id)
+
+
+# Again once committed: a request may have cached the old row in between. Then tell the listeners.
+@event.listens_for(Session, "after_commit")
+def _user_changes_committed(session):
+    for user_id in session.info.pop("changed_users", ()):
+        invalidate_principal(user_id)
+        for listener in _listeners:
+            listener(user_id)
+
 
-    return user
+@event.listens_for(Session, "after_rollback")
+def _user_changes_rolled_back(session):
+    session.info.pop("changed_users", None)
@@ -0,0 +1,329 @@
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, time
+from typing import Optional
+
+from sqlalchemy import and_, distinct, func
+from sqlalchemy.orm import Session
+
+import models
+import slots
+from db import SessionLocal
+
+# ----- CONFIG -----
+# Per-process index of booked slots used to answer /bookings/availability from memory.
+# Each uvicorn worker keeps its own copy, so it is only on by default when LIVE_NOTIFY relays booking
+# and lab/instrument changes between workers. OCCUPANCY_INDEX=1 also turns it on for a single worker.
+OCCUPANCY_INDEX_ENABLED = os.getenv("OCCUPANCY_INDEX", os.getenv("LIVE_NOTIFY", "0")) == "1"
+
+ACTIVE_STATUSES = models.ACTIVE_BOOKING_STATUSES
+
+log = logging.getLogger("occupancy")
+
+
+class OccupancyIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ready = False
+        self._labs = {}  # lab id -> (name, slot grid)
+        self._instruments = {}  # instrument id -> (lab id, instrument name, working)
+        self._booked = defaultdict(Counter)  # instrument id -> {booking slot index: active bookings}
+        self._bookings = {}  # active booking id -> (instrument id, slot index)
+        self._warming = 0
+        self._journal = []  # set_booking() calls made while a warm() was reading, replayed on its result
+        self._rewarm = None  # background re-warm thread, while one runs
+
+    # --------- WARM FROM DATABASE ---------
+    def warm(self, db: Session):
+        with self._lock:
+            self._warming += 1
+        try:
+            self._load(db)
+        finally:
+            with self._lock:
+                self._warming -= 1
+                if not self._warming:
+                    self._journal = []
+
+    def _load(self, db: Session):
+        today_start = datetime.combine(datetime.now().date(), datetime.min.time())
+
+        labs = {
+            row.id: (row.name, slots.SlotGrid.for_lab(row))
+            for row in db.query(
+                models.Labs.id,
+                models.Labs.name,
+                models.Labs.slot_start,
+                models.Labs.slot_minutes,
+                models.Labs.slots_per_day,
+            )
+        }
+        instruments = {
+            row.instrument_id: (row.lab_id, row.instrument_name, bool(row.working))
+            for row in db.query(
+                models.Instrument.instrument_id,
+                models.Instrument.lab_id,
+                models.Instrument.instrument_name,
+                models.Instrument.working,
+            )
+        }
+
+        booked = defaultdict(Counter)
+        bookings = {}
+        rows = db.query(models.Booking.id, models.Booking.instrument_id, models.Booking.slot_index).filter(
+            models.Booking.slot >= today_start,
+            models.Booking.slot_index.isnot(None),
+            models.Booking.status.in_(ACTIVE_STATUSES)
+        )
+        for booking_id, instrument_id, slot_index in rows:
+            booked[instrument_id][slot_index] += 1
+            bookings[booking_id] = (instrument_id, slot_index)
+
+        with self._lock:
+            self._labs = labs
+            self._instruments = instruments
+            self._booked = booked
+            self._bookings = bookings
+            # Changes committed while the snapshot was read may or may not be in it: applying them again is harmless
+            for change in self._journal:
+                self._set_booking(*change)
+            self.ready = True
+
+    # One warm() at a time in the background, from the primary; misses while it runs don't start another
+    def rewarm(self):
+        with self._lock:
+            if self._rewarm is not None:
+                return self._rewarm
+            self._rewarm = threading.Thread(target=self._run_rewarm, name="occupancy-rewarm", daemon=True)
+        self._rewarm.start()
+        return self._rewarm
+
+    def _run_rewarm(self):
+        try:
+            with SessionLocal() as session:
+                self.warm(session)
+        except Exception:
+            log.exception("Failed to re-warm the occupancy index")
+        finally:
+            with self._lock:
+                self._rewarm = None
+
+    # --------- INCREMENTAL UPDATES ---------
+    def set_lab(self, lab_id: int, name: str, grid: slots.SlotGrid):
+        with self._lock:
+            self._labs[lab_id] = (name, grid)
+
+    def set_instrument(self, instrument_id: int, instrument_name: str, lab_id: int, working: bool):
+        with self._lock:
+            self._instruments[instrument_id] = (lab_id, instrument_name, bool(working))
+
+    def remove_instrument(self, instrument_id: int):
+        with self._lock:
+            self._instruments.pop(instrument_id, None)
+
+    def set_booking(self, booking_id: int, instrument_id: int, slot_index: Optional[int], status):
+        with self._lock:
+            if self._warming:
+                self._journal.append((booking_id, instrument_id, slot_index, status))
+            self._set_booking(booking_id, instrument_id, slot_index, status)
+
+    # Holding the lock
+    def _set_booking(self, booking_id: int, instrument_id: int, slot_index: Optional[int], status):
+        previous = self._bookings.pop(booking_id, None)
+        if previous is not None:
+            counts = self._booked[previous[0]]
+            counts[previous[1]] -= 1
+            if counts[previous[1]] <= 0:
+                del counts[previous[1]]
+
+        if status in ACTIVE_STATUSES and slot_index is not None:
+            self._booked[instrument_id][slot_index] += 1
+            self._bookings[booking_id] = (instrument_id, slot_index)
+
+    # --------- LOOKUPS (mirror the SQL path in get_availability) ---------
+    def lab_id(self, lab_name: str):
+        with self._lock:
+            ids = [lab_id for lab_id, (name, grid) in self._labs.items() if name == lab_name]
+        return min(ids) if ids else None
+
+    def working_instruments(self, lab_id: int, instrument_name: str):
+        with self._lock:
+            return [
+                instrument_id
+                for instrument_id, (instr_lab_id, name, working) in self._instruments.items()
+                if instr_lab_id == lab_id and name == instrument_name and working
+            ]
+
+    # (lab id, lab's slot grid, working instrument ids); lab id and grid are None when there is no such lab
+    def lab_instruments(self, lab_name: str, instrument_name: str):
+        lab_id = self.lab_id(lab_name)
+        if lab_id is None:
+            return None, None, []
+        with self._lock:
+            grid = self._labs[lab_id][1]
+        return lab_id, grid, self.working_instruments(lab_id, instrument_name)
+
+    # Number of instruments with at least one active booking, per slot index in [first, last)
+    def booked_counts(self, instrument_ids, first_index: int, last_index: int):
+        counts = Counter()
+        with self._lock:
+            for instrument_id in instrument_ids:
+                for index in self._booked.get(instrument_id, ()):
+                    if first_index <= index < last_index:
+                        counts[index] += 1
+        return counts
+
+
+# Same lookups as OccupancyIndex, answered with SQL. Used until the index is warm.
+class DatabaseOccupancy:
+    def __init__(self, db: Session):
+        self.db = db
+
+    # One query: the lab (lowest id of that name) with its grid, outer joined to its matching working instruments
+    def lab_instruments(self, lab_name: str, instrument_name: str):
+        rows = self.db.query(
+            models.Labs.id,
+            models.Labs.slot_start,
+            models.Labs.slot_minutes,
+            models.Labs.slots_per_day,
+            models.Instrument.instrument_id
+        ).outerjoin(models.Instrument, and_(
+            models.Instrument.lab_id == models.Labs.id,
+            models.Instrument.instrument_name == instrument_name,
+            models.Instrument.working == True
+        )).filter(models.Labs.name == lab_name).order_by(models.Labs.id).all()
+        if not rows:
+            return None, None, []
+        lab_id = rows[0].id
+        instrument_ids = [row.instrument_id for row in rows if row.id == lab_id and row.instrument_id is not None]
+        return lab_id, slots.SlotGrid.for_lab(rows[0]), instrument_ids
+
+    # One aggregate over the active-slot unique index, whatever the horizon. Like the index, it
+    # ignores bookings before today, which also keeps it to the current and future monthly partitions.
+    def booked_counts(self, instrument_ids, first_index: int, last_index: int):
+        today_start = datetime.combine(datetime.now().date(), datetime.min.time())
+        rows = self.db.query(
+            models.Booking.slot_index,
+            func.count(distinct(models.Booking.instrument_id))
+        ).filter(
+            models.Booking.instrument_id.in_(instrument_ids),
+            models.Booking.slot_index >= first_index,
+            models.Booking.slot_index < last_index,
+            models.Booking.slot >= today_start,
+            models.Booking.status.in_(ACTIVE_STATUSES)
+        ).group_by(models.Booking.slot_index).all()
+
+        return Counter(dict(rows))
+
+
+# The index, with its misses checked against the database: a lab or instrument written by another worker
+# may not have reached this one's index. When the database knows it, this request is answered with SQL
+# and the index is re-warmed from the primary in the background.
+class IndexedOccupancy:
+    def __init__(self, db: Session):
+        self.db = db
+        self._source = index
+
+    def lab_instruments(self, lab_name: str, instrument_name: str):
+        lab_id, grid, instrument_ids = index.lab_instruments(lab_name, instrument_name)
+        if lab_id is not None and instrument_ids:
+            return lab_id, grid, instrument_ids
+
+        from_database = DatabaseOccupancy(self.db)
+        lab_id, grid, instrument_ids = from_database.lab_instruments(lab_name, instrument_name)
+        if lab_id is not None and instrument_ids:
+            self._source = from_database
+            index.rewarm()
+        return lab_id, grid, instrument_ids
+
+    def booked_counts(self, instrument_ids, first_index: int, last_index: int):
+        return self._source.booked_counts(instrument_ids, first_index, last_index)
+
+
+index = OccupancyIndex()
+_listeners = []  # called with (booking id, instrument id, slot index, status) after every booking change
+_catalog_listeners = []  # called with a lab/instrument change (a JSON-able dict, see below) after it commits
+
+
+def lookup(db: Session):
+    if OCCUPANCY_INDEX_ENABLED and index.ready:
+        return IndexedOccupancy(db)
+    return DatabaseOccupancy(db)
+
+
+def add_listener(listener):
+    _listeners.append(listener)
+
+
+def add_catalog_listener(listener):
+    _catalog_listeners.append(listener)
+
+
+# Write paths call this once a booking change has committed
+def booking_changed(booking_id: int, instrument_id: int, slot_index: Optional[int], status):
+    index.set_booking(booking_id, instrument_id, slot_index, status)
+    for listener in _listeners:
+        listener(booking_id, instrument_id, slot_index, status)
+
+
+# ----- LAB / INSTRUMENT CHANGES -----
+# Write paths call these once a lab/instrument write has committed; apply_catalog_change() replays a
+# change (e.g. one relayed from another worker) on this worker's index
+def lab_changed(lab_id: int, name: str, grid: slots.SlotGrid):
+    _catalog_changed({
+        "kind": "lab", "lab_id": lab_id, "name": name,
+        "slot_start": grid.start.isoformat(), "slot_minutes": grid.minutes, "slots_per_day": grid.per_day
+    })
+
+
+def instrument_changed(instrument_id: int, instrument_name: str, lab_id: int, working: bool):
+    _catalog_changed({
+        "kind": "instrument", "instrument_id": instrument_id, "instrument_name": instrument_name,
+        "lab_id": lab_id, "working": bool(working)
+    })
+
+
+def instrument_removed(instrument_id: int):
+    _catalog_changed({"kind": "instrument_removed", "instrument_id": instrument_id})
+
+
+def _catalog_changed(change: dict):
+    apply_catalog_change(change)
+    for listener in _catalog_listeners:
+        listener(change)
+
+
+def apply_catalog_change(change: dict):
+    if change["kind"] == "lab":
+        grid = slots.SlotGrid(time.fromisoformat(change["slot_start"]), change["slot_minutes"], change["slots_per_day"])
+        index.set_lab(change["lab_id"], change["name"], grid)
+    elif change["kind"] == "instrument":
+        index.set_instrument(change["instrument_id"], change["instrument_name"], change["lab_id"], change["working"])
+    elif change["kind"] == "instrument_removed":
+        index.remove_instrument(change["instrument_id"])
+    else:
+        raise ValueError(f"Unknown lab/instrument change {change['kind']!r}")
+
+
+# ----- AVAILABILITY (shape served by get_availability) -----
+def availability_entry(grid: slots.SlotGrid, slot_index: int, total: int, booked: int):
+    slot_start = grid.slot_start(slot_index)
+    available = total - booked
+    return {
+        "date": slot_start.strftime("%A, %d %B %Y"),
+        "slot": slot_start.isoformat(),
+        "available": available,
+        "status": f"{available} out of {total}",
+        "can_book": available > 0
+    }
+
+
+def availability(occupancy_lookup, instrument_ids, grid: slots.SlotGrid, first_index: int, last_index: int):
+    booked_by_slot = occupancy_lookup.booked_counts(instrument_ids, first_index, last_index)
+    total = len(instrument_ids)
+    return [
+        availability_entry(grid, slot_index, total, booked_by_slot.get(slot_index, 0))
+        for slot_index in range(first_index, last_index)
+    ]
@@ -0,0 +1,48 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_
+
+import models
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+# ----- OPAQUE CURSORS: base64url of [slot, id] of the last booking on a page -----
+def encode_cursor(booking: models.Booking):
+    raw = json.dumps([booking.slot.isoformat(), booking.id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        slot, booking_id = json.loads(raw)
+        return datetime.fromisoformat(slot), int(booking_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# Order bookings by (slot, id) and, with a cursor, continue right after it.
+# The row comparison is answered from an index on slot, so deep pages cost the same as the first.
+def keyset(query, cursor: str = None):
+    query = query.order_by(models.Booking.slot, models.Booking.id)
+    if cursor:
+        slot, booking_id = decode_cursor(cursor)
+        query = query.filter(tuple_(models.Booking.slot, models.Booking.id) > tuple_(slot, booking_id))
+    return query
+
+
+# A full page may have more rows after it; a short page is the last one
+def next_cursor(bookings, limit: int):
+    if limit is None or len(bookings) < limit or not bookings:
+        return None
+    return encode_cursor(bookings[-1])
+
+
+def set_next_cursor(response: Response, cursor: str):
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
@@ -0,0 +1,168 @@
+# Monthly range partitions of `bookings` on PostgreSQL (alembic revision b7d4e1a9c352).
+#
+#   python -m partitions                                  # create the next BOOKING_PARTITIONS_AHEAD months
+#   python -m partitions --archive-older-than 24          # also detach months that ended over 24 months ago
+#   python -m partitions --archive-older-than 24 --drop   # ... and drop them instead of keeping them archived
+#
+# Meant for a monthly cron job. Detached months are moved to the BOOKING_ARCHIVE_SCHEMA schema, where
+# they can still be queried or dumped but no longer weigh on any index or scan of `bookings`.
+import argparse
+import os
+import re
+import sys
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+import db
+import models
+
+# ----- CONFIG -----
+BOOKING_PARTITIONS_AHEAD = int(os.getenv("BOOKING_PARTITIONS_AHEAD", "12"))
+BOOKING_ARCHIVE_SCHEMA = os.getenv("BOOKING_ARCHIVE_SCHEMA", "archive")
+# Creating a month blocks writes to bookings while it moves that month's rows out of the default partition and
+# attaches it; give up (and retry on the next run) rather than queue every write behind a lock that won't come
+BOOKING_PARTITION_LOCK_TIMEOUT = os.getenv("BOOKING_PARTITION_LOCK_TIMEOUT", "5s")
+
+DEFAULT_PARTITION = "bookings_default"
+_MONTH_PARTITION = re.compile(r"^bookings_(\d{4})_(\d{2})$")
+
+
+# ----- LISTINGS -----
+# Listings only show bookings from today on unless include_history is set. On a partitioned table
+# the bound on `slot` keeps them to the current and future months' partitions.
+def history_cutoff():
+    return datetime.combine(date.today(), datetime.min.time())
+
+
+def current_bookings(query, include_history: bool):
+    if include_history:
+        return query
+    return query.filter(models.Booking.slot >= history_cutoff())
+
+
+# ----- MONTHS -----
+def month_start(day: date):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, months: int):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date):
+    return f"bookings_{month:%Y_%m}"
+
+
+# ----- DDL -----
+def is_partitioned(connection):
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('bookings')"
+    )).first() is not None
+
+
+# Month partitions currently attached to bookings
+def attached_months(connection):
+    names = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits"
+        " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+        " WHERE pg_inherits.inhparent = 'bookings'::regclass"
+    )).scalars()
+    months = []
+    for name in names:
+        match = _MONTH_PARTITION.match(name)
+        if match:
+            months.append(date(int(match[1]), int(match[2]), 1))
+    return sorted(months)
+
+
+# Built next to the table and attached once filled, so bookings that already landed in the default
+# partition for this month move into it. Every booking of a slot index is in one month, so the
+# active-slot unique index per partition is as good as one over the whole table.
+#
+# Writers wait from the move until the ATTACH commits: a booking for this month inserted in between would
+# land in the default partition and make the ATTACH fail. Locks are taken parent first, like an INSERT does.
+# Readers only wait on the default partition, which the ATTACH locks anyway.
+def create_partition(connection, month: date):
+    name = partition_name(month)
+    bounds = {"start": month, "end": add_months(month, 1)}
+    connection.execute(text("SELECT set_config('lock_timeout', :timeout, true)"), {"timeout": BOOKING_PARTITION_LOCK_TIMEOUT})
+    connection.execute(text("LOCK TABLE ONLY bookings IN SHARE ROW EXCLUSIVE MODE"))
+    connection.execute(text(f"LOCK TABLE {DEFAULT_PARTITION} IN ACCESS EXCLUSIVE MODE"))
+    connection.execute(text(f"CREATE TABLE {name} (LIKE bookings INCLUDING DEFAULTS)"))
+    connection.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE slot >= :start AND slot < :end RETURNING *)"
+        f" INSERT INTO {name} SELECT * FROM moved"
+    ), bounds)
+    connection.execute(text(
+        f"CREATE UNIQUE INDEX uq_{name}_active_instrument_slot_index ON {name} (instrument_id, slot_index)"
+        " WHERE status IN ('pending', 'approved')"
+    ))
+    connection.execute(text(
+        f"ALTER TABLE bookings ATTACH PARTITION {name} FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')"
+    ))
+
+
+def detach_partition(connection, month: date, drop: bool = False, schema: str = BOOKING_ARCHIVE_SCHEMA):
+    name = partition_name(month)
+    connection.execute(text(f"ALTER TABLE bookings DETACH PARTITION {name}"))
+    if drop:
+        connection.execute(text(f"DROP TABLE {name}"))
+    else:
+        connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+        connection.execute(text(f'ALTER TABLE {name} SET SCHEMA "{schema}"'))
+
+
+# ----- MAINTENANCE -----
+# Each partition in its own transaction, so one failure (e.g. a lock timeout) doesn't undo the others
+def ensure_partitions(engine, ahead: int = BOOKING_PARTITIONS_AHEAD):
+    with engine.connect() as connection:
+        existing = set(attached_months(connection))
+    created = []
+    current = month_start(date.today())
+    for month in (add_months(current, n) for n in range(ahead + 1)):
+        if month not in existing:
+            with engine.begin() as connection:
+                create_partition(connection, month)
+            created.append(month)
+    return created
+
+
+# Months that ended more than `older_than` months before the current one
+def archive_partitions(engine, older_than: int, drop: bool = False):
+    if older_than < 1:
+        raise ValueError("Only months that have ended can be archived")
+    cutoff = add_months(month_start(date.today()), -older_than)
+    with engine.connect() as connection:
+        months = [month for month in attached_months(connection) if month < cutoff]
+    for month in months:
+        with engine.begin() as connection:
+            detach_partition(connection, month, drop)
+    return months
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create upcoming and archive old monthly partitions of bookings")
+    parser.add_argument("--ahead", type=int, default=BOOKING_PARTITIONS_AHEAD, help="months to create after the current one")
+    parser.add_argument("--archive-older-than", type=int, metavar="MONTHS", help="detach months that ended over MONTHS months ago")
+    parser.add_argument("--drop", action="store_true", help="drop archived months instead of moving them to the archive schema")
+    args = parser.parse_args(argv)
+
+    with db.engine.connect() as connection:
+        if not is_partitioned(connection):
+            print("bookings is not partitioned (PostgreSQL at alembic revision b7d4e1a9c352 or later); nothing to do")
+            return 0
+
+    for month in ensure_partitions(db.engine, args.ahead):
+        print(f"created {partition_name(month)}")
+    if args.archive_older_than is not None:
+        for month in archive_partitions(db.engine, args.archive_older_than, args.drop):
+            print(f"{'dropped' if args.drop else 'archived'} {partition_name(month)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from sqlalchemy import case, cast, func, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 
-import models, schemas
-from db import get_db
-from oauth2 import get_current_user
+import admission, models, schemas, occupancy, pagination, partitions
+from db import get_read_session, get_session, mark_recent_write, run_db
+from oauth2 import Principal, get_current_user
 
 router = APIRouter(
     prefix="/approving",
@@ -13,33 +15,257 @@ router = APIRouter(
 )
 
 # --------- GET BOOKINGS TO APPROVE (for profs/admins) ---------
-@router.get("/to_approve", response_model=List[schemas.Booking])
-def get_bookings_to_approve(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+# Filters shared by the inbox and its summary: ?status=pending&status=approved, a slot range
+# (slot_from replaces the default "from today on" bound) and include_history
+class InboxFilters:
+    def __init__(
+        self,
+        statuses: Optional[List[schemas.BookingStatus]] = Query(None, alias="status"),
+        slot_from: Optional[datetime] = None,
+        slot_to: Optional[datetime] = None,
+        include_history: bool = Query(False)
+    ):
+        self.statuses = statuses
+        self.slot_from = slot_from
+        self.slot_to = slot_to
+        self.include_history = include_history
+
+    def apply(self, query, current_user: Principal):
+        query = query.filter(models.Booking.requested_to_id == current_user.id)
+        if self.statuses:
+            query = query.filter(models.Booking.status.in_([models.BookingStatusEnum(s.value) for s in self.statuses]))
+        if self.slot_from:
+            query = query.filter(models.Booking.slot >= self.slot_from)
+        else:
+            query = partitions.current_bookings(query, self.include_history)
+        if self.slot_to:
+            query = query.filter(models.Booking.slot <= self.slot_to)
+        return query
+
+
+@router.get("/to_approve", response_model=List[schemas.Booking], dependencies=[admission.admit("read", "replica", "primary")])
+async def get_bookings_to_approve(
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    filters: InboxFilters = Depends(),
+    response: Response = None,
+    db = Depends(get_read_session),
+    current_user: Principal = Depends(get_current_user)
 ):
-    return db.query(models.Booking).filter(
-        models.Booking.requested_to_id == current_user.id
-    ).all()
+    bookings = await run_db(db, _get_bookings_to_approve, current_user, limit, cursor, filters)
+    pagination.set_next_cursor(response, pagination.next_cursor(bookings, limit))
+    return bookings
+
+
+def _get_bookings_to_approve(db: Session, current_user: Principal, limit, cursor, filters: InboxFilters):
+    query = filters.apply(db.query(models.Booking), current_user)
+    return pagination.keyset(query, cursor).limit(limit).all()
+
+
+# --------- INBOX COUNTS (dashboard badges, without downloading the list) ---------
+@router.get("/to_approve/summary", response_model=schemas.InboxSummary, dependencies=[admission.admit("read", "replica", "primary")])
+async def get_inbox_summary(
+    filters: InboxFilters = Depends(),
+    db = Depends(get_read_session),
+    current_user: Principal = Depends(get_current_user)
+):
+    return await run_db(db, _get_inbox_summary, current_user, filters)
+
+
+# One GROUP BY (instrument, status); the per-status totals are summed from its rows
+def _get_inbox_summary(db: Session, current_user: Principal, filters: InboxFilters):
+    query = db.query(
+        models.Instrument.instrument_id,
+        models.Instrument.instrument_name,
+        models.Instrument.lab_id,
+        models.Booking.status,
+        func.count(models.Booking.id)
+    ).join(models.Instrument, models.Booking.instrument_id == models.Instrument.instrument_id)
+    rows = filters.apply(query, current_user).group_by(
+        models.Instrument.instrument_id,
+        models.Instrument.instrument_name,
+        models.Instrument.lab_id,
+        models.Booking.status
+    ).order_by(models.Instrument.instrument_id).all()
+
+    by_status = {member.value: 0 for member in models.BookingStatusEnum}
+    by_instrument = {}
+    for instrument_id, instrument_name, lab_id, booking_status, count in rows:
+        by_status[booking_status.value] += count
+        entry = by_instrument.get(instrument_id)
+        if entry is None:
+            entry = by_instrument[instrument_id] = {
+                "instrument_id": instrument_id,
+                "instrument_name": instrument_name,
+                "lab_id": lab_id,
+                "total": 0,
+                "by_status": {member.value: 0 for member in models.BookingStatusEnum},
+            }
+        entry["total"] += count
+        entry["by_status"][booking_status.value] += count
+
+    return {
+        "total": sum(by_status.values()),
+        "by_status": by_status,
+        "by_instrument": list(by_instrument.values())
+    }
 
 
 # --------- APPROVE OR REJECT BOOKING ---------
-@router.put("/{booking_id}/decision", response_model=schemas.Booking)
-def approve_or_reject_booking(
+@router.put("/{booking_id}/decision", response_model=schemas.Booking, dependencies=[admission.admit("booking_write", "primary")])
+async def approve_or_reject_booking(
     booking_id: int,
     decision: schemas.BookingStatusUpdate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    response: Response,
+    db = Depends(get_session),
+    current_user: Principal = Depends(get_current_user)
 ):
-    booking = db.query(models.Booking).filter(models.Booking.id == booking_id).first()
+    booking = await run_db(db, _approve_or_reject_booking, booking_id, decision, current_user)
+    mark_recent_write(current_user.id, response)
+    return booking
 
-    if not booking:
-        raise HTTPException(status_code=404, detail="Booking not found")
 
-    if booking.requested_to_id != current_user.id:
+# One UPDATE ... RETURNING, limited to bookings addressed to the current user; only when it matches
+# nothing does a lookup tell 404 from 403
+def _approve_or_reject_booking(db: Session, booking_id: int, decision: schemas.BookingStatusUpdate, current_user: Principal):
+    table = models.Booking.__table__
+    statement = update(table)\
+        .where(table.c.id == booking_id, table.c.requested_to_id == current_user.id)\
+        .values(status=models.BookingStatusEnum(decision.status.value))\
+        .returning(*table.c)
+
+    try:
+        booking = db.execute(statement).first()
+    except IntegrityError:
+        # Re-activating a rejected booking whose slot has been taken since
+        db.rollback()
+        raise HTTPException(status_code=400, detail="This time slot is already booked.")
+
+    if booking is None:
+        db.rollback()
+        if db.query(models.Booking.id).filter(models.Booking.id == booking_id).first() is None:
+            raise HTTPException(status_code=404, detail="Booking not found")
         raise HTTPException(status_code=403, detail="Not authorized to make a decision on this booking")
 
-    booking.status = decision.status
     db.commit()
-    db.refresh(booking)
+    occupancy.booking_changed(booking.id, booking.instrument_id, booking.slot_index, booking.status)
     return booking
+
+
+# --------- APPROVE OR REJECT MANY BOOKINGS AT ONCE ---------
+@router.put("/decisions", response_model=schemas.BookingDecisionBatchResult, dependencies=[admission.admit("booking_write", "primary")])
+async def decide_bookings_batch(
+    batch: schemas.BookingDecisionBatch,
+    response: Response,
+    db = Depends(get_session),
+    current_user: Principal = Depends(get_current_user)
+):
+    result = await run_db(db, _decide_bookings_batch, batch, current_user)
+    mark_recent_write(current_user.id, response)
+    return result
+
+
+def _decide_bookings_batch(db: Session, batch: schemas.BookingDecisionBatch, current_user: Principal):
+    decisions = {decision.booking_id: decision.status for decision in batch.decisions}  # last one wins
+    booking_ids = list(decisions)
+
+    conflicts = []
+    try:
+        updated = _apply_decisions(db, decisions, current_user)
+    except IntegrityError:
+        # Re-activating a booking whose slot is taken (rare): report those, apply the rest. Bookings this
+        # batch deactivates go first, so the slots they free can be taken by the ones it activates.
+        db.rollback()
+        conflicts = _reactivation_conflicts(db, decisions, current_user)
+        remaining = {booking_id: decision for booking_id, decision in decisions.items() if booking_id not in conflicts}
+        try:
+            updated = _apply_decisions(db, {booking_id: decision for booking_id, decision in remaining.items() if not _activates(decision)}, current_user)\
+                + _apply_decisions(db, {booking_id: decision for booking_id, decision in remaining.items() if _activates(decision)}, current_user)
+        except IntegrityError:
+            # A slot was taken concurrently
+            db.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail="A booking in this batch conflicts with an active booking for the same slot; nothing was changed"
+            )
+
+    # Ids that were not updated either don't exist or belong to another supervisor
+    applied = {row.id for row in updated}
+    missing = [booking_id for booking_id in booking_ids if booking_id not in applied and booking_id not in conflicts]
+    existing = set()
+    if missing:
+        existing = {booking_id for (booking_id,) in db.query(models.Booking.id).filter(models.Booking.id.in_(missing))}
+
+    db.commit()
+
+    for row in updated:
+        occupancy.booking_changed(row.id, row.instrument_id, row.slot_index, row.status)
+
+    return {
+        "applied": [booking_id for booking_id in booking_ids if booking_id in applied],
+        "not_found": [booking_id for booking_id in missing if booking_id not in existing],
+        "forbidden": [booking_id for booking_id in missing if booking_id in existing],
+        "conflicts": conflicts
+    }
+
+
+def _activates(decision: schemas.BookingStatus):
+    return models.BookingStatusEnum(decision.value) in models.ACTIVE_BOOKING_STATUSES
+
+
+# One UPDATE for all of `decisions`; only bookings addressed to the current user are touched
+def _apply_decisions(db: Session, decisions: dict, current_user: Principal):
+    if not decisions:
+        return []
+    table = models.Booking.__table__
+    new_status = cast(
+        case({booking_id: decision.value for booking_id, decision in decisions.items()}, value=table.c.id),
+        table.c.status.type
+    )
+    statement = update(table)\
+        .where(table.c.id.in_(list(decisions)), table.c.requested_to_id == current_user.id)\
+        .values(status=new_status)\
+        .returning(table.c.id, table.c.instrument_id, table.c.slot_index, table.c.status)
+    return db.execute(statement).all()
+
+
+# Bookings the batch would re-activate in a slot that stays taken: by an active booking the batch leaves
+# active, or by one re-activated earlier in the batch. Two queries: the batch's bookings, the active ones in their slots.
+def _reactivation_conflicts(db: Session, decisions: dict, current_user: Principal):
+    table = models.Booking.__table__
+    active = models.ACTIVE_BOOKING_STATUSES
+    rows = {
+        row.id: row
+        for row in db.execute(
+            select(table.c.id, table.c.instrument_id, table.c.slot_index, table.c.status)
+            .where(table.c.id.in_(list(decisions)), table.c.requested_to_id == current_user.id)
+        )
+    }
+    reactivated = [
+        rows[booking_id] for booking_id, decision in decisions.items()
+        if booking_id in rows and rows[booking_id].status not in active
+        and rows[booking_id].slot_index is not None and _activates(decision)
+    ]
+    if not reactivated:
+        return []
+
+    holders = db.execute(
+        select(table.c.id, table.c.instrument_id, table.c.slot_index).where(
+            table.c.instrument_id.in_({row.instrument_id for row in reactivated}),
+            table.c.slot_index.in_({row.slot_index for row in reactivated}),
+            table.c.status.in_(active)
+        )
+    )
+    taken = {
+        (holder.instrument_id, holder.slot_index)
+        for holder in holders
+        if holder.id not in rows or _activates(decisions[holder.id])
+    }
+
+    conflicts = []
+    for row in reactivated:
+        if (row.instrument_id, row.slot_index) in taken:
+            conflicts.append(row.id)
+        else:
+            taken.add((row.instrument_id, row.slot_index))
+    return conflicts
@@ -1,14 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status , Query
-from sqlalchemy.orm import Session,joinedload
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, status , Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, func, literal, select
+from sqlalchemy.orm import Session, aliased, contains_eager, joinedload
+from datetime import datetime, timedelta
 from typing import List,Optional
-from collections import defaultdict
 
+import csv
+import io
+import json
+import admission
+import numpy as np
 import pytz
 import models
 import schemas
-from db import get_db
-from oauth2 import get_current_user
+import live
+import occupancy
+import pagination
+import partitions
+import serialization
+import slots
+from db import DB_MODE, AsyncReadSessionLocal, ReadSessionLocal, dialect_insert, get_read_session, get_session, mark_recent_write, run_db
+from oauth2 import Principal, get_current_user
 
 router = APIRouter(
     prefix="/bookings",
@@ -17,71 +29,212 @@ router = APIRouter(
 
 
 # --------- CREATE BOOKING (User) ---------
-@router.post("/", response_model=schemas.Booking)
-def create_booking(
+@router.post("/", response_model=schemas.Booking, dependencies=[admission.admit("booking_write", "primary")])
+async def create_booking(
     booking_data: schemas.BookingCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    response: Response,
+    db = Depends(get_session),
+    current_user: Principal = Depends(get_current_user)
 ):
-    # No timezone handling
-    naive_slot = booking_data.slot
+    new_booking = await run_db(db, _create_booking, booking_data, current_user)
+    mark_recent_write(current_user.id, response)
+    return new_booking
 
-    overlap = db.query(models.Booking).filter(
-        models.Booking.instrument_id == booking_data.instrument_id,
-        models.Booking.slot == naive_slot
-    ).first()
 
-    if overlap:
+def _create_booking(db: Session, booking_data: schemas.BookingCreate, current_user: Principal):
+    # No timezone handling: wall-clock times are stored as given, like BookingBatchCreate.expand()
+    naive_slot = booking_data.slot.replace(tzinfo=None)
+
+    # One atomic statement: the slot index is computed from the instrument's lab grid as the row is
+    # inserted, and the partial unique index on active bookings rejects overlaps, so concurrent
+    # requests for the same slot (at any time inside it) cannot both succeed. No conflict target:
+    # on a partitioned table (partitions.py) that index exists per partition, not on bookings itself.
+    table = models.Booking.__table__
+    slot_index, within_working_hours = _lab_slot_index_sql(naive_slot)
+    source = select(
+        models.Instrument.instrument_id,
+        literal(naive_slot, table.c.slot.type),
+        slot_index,
+        literal(booking_data.requested_to_id),
+        literal(current_user.id),
+        literal(models.BookingStatusEnum.pending, table.c.status.type)
+    ).join(models.Labs, models.Labs.id == models.Instrument.lab_id).where(
+        models.Instrument.instrument_id == booking_data.instrument_id,
+        within_working_hours
+    )
+    statement = dialect_insert(db, table).from_select(
+        ["instrument_id", "slot", "slot_index", "requested_to_id", "requested_by_id", "status"], source
+    ).on_conflict_do_nothing().returning(*table.c)
+
+    new_booking = db.execute(statement).first()
+    if new_booking is None:
+        db.rollback()
+        grid = _instrument_grid(db, booking_data.instrument_id)
+        if grid.index(naive_slot) is None:
+            raise HTTPException(status_code=400, detail="This time is outside the lab's booking slots.")
         raise HTTPException(status_code=400, detail="This time slot is already booked.")
 
-    new_booking = models.Booking(
-        instrument_id=booking_data.instrument_id,
-        slot=naive_slot,
-        requested_to_id=booking_data.requested_to_id,
-        requested_by_id=current_user.id,
-        status="pending"
+    db.commit()
+    occupancy.booking_changed(new_booking.id, new_booking.instrument_id, new_booking.slot_index, new_booking.status)
+    return new_booking
+
+
+# SlotGrid.index() of `slot` against the grid of the lab joined in the query
+def _lab_slot_index_sql(slot: datetime):
+    return slots.slot_index_sql(
+        slot,
+        slots.minutes_of_day_sql(models.Labs.slot_start),
+        models.Labs.slot_minutes,
+        models.Labs.slots_per_day
     )
 
-    db.add(new_booking)
+
+def _instrument_grid(db: Session, instrument_id: int):
+    lab = db.query(models.Labs.slot_start, models.Labs.slot_minutes, models.Labs.slots_per_day)\
+        .join(models.Instrument, models.Instrument.lab_id == models.Labs.id)\
+        .filter(models.Instrument.instrument_id == instrument_id).first()
+    if lab is None:
+        raise HTTPException(status_code=404, detail="Instrument not found")
+    return slots.SlotGrid.for_lab(lab)
+
+
+# --------- CREATE BOOKINGS IN BULK / RECURRING (User) ---------
+@router.post("/batch", response_model=schemas.BookingBatchResult, dependencies=[admission.admit("booking_write", "primary")])
+async def create_bookings_batch(
+    batch: schemas.BookingBatchCreate,
+    response: Response,
+    db = Depends(get_session),
+    current_user: Principal = Depends(get_current_user)
+):
+    try:
+        requested_slots = batch.expand()
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    result = await run_db(db, _create_bookings_batch, batch, requested_slots, current_user)
+    mark_recent_write(current_user.id, response)
+    return result
+
+
+def _create_bookings_batch(db: Session, batch: schemas.BookingBatchCreate, requested_slots, current_user: Principal):
+    table = models.Booking.__table__
+
+    # Step 1: The instrument's slot grid; every requested time must fall on it
+    grid = _instrument_grid(db, batch.instrument_id)
+    slot_indexes = [grid.index(slot) for slot in requested_slots]
+    outside = [slot for slot, slot_index in zip(requested_slots, slot_indexes) if slot_index is None]
+    if outside:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Outside the lab's booking slots: {', '.join(slot.isoformat() for slot in outside)}"
+        )
+
+    # Step 2: One multi-row insert, in one transaction; times inside the same slot only count once.
+    # ON CONFLICT skips the slots that are already taken.
+    first_requests = {}
+    for slot, slot_index in zip(requested_slots, slot_indexes):
+        first_requests.setdefault(slot_index, slot)
+    statement = dialect_insert(db, table).values([
+        {
+            "instrument_id": batch.instrument_id,
+            "slot": slot,
+            "slot_index": slot_index,
+            "requested_to_id": batch.requested_to_id,
+            "requested_by_id": current_user.id,
+            "status": models.BookingStatusEnum.pending,
+        }
+        for slot_index, slot in first_requests.items()
+    ]).on_conflict_do_nothing().returning(*table.c)
+
+    created = {row.slot_index: row for row in db.execute(statement)}
     db.commit()
-    db.refresh(new_booking)
-    return new_booking
+
+    for row in created.values():
+        occupancy.booking_changed(row.id, row.instrument_id, row.slot_index, row.status)
+
+    # Step 3: Per-slot report, in request order
+    results = [
+        {"slot": slot, "status": "created", "booking": created[slot_index]}
+        if slot_index in created and first_requests[slot_index] == slot
+        else {"slot": slot, "status": "conflict", "booking": None}
+        for slot, slot_index in zip(requested_slots, slot_indexes)
+    ]
+    return {
+        "created": len(created),
+        "conflicts": len(requested_slots) - len(created),
+        "results": results
+    }
 
 
 
 # --------- GET USER'S BOOKINGS ---------
-@router.get("/me", response_model=List[dict])
-def get_my_bookings_formatted(
+@router.get("/me", response_model=List[dict], dependencies=[admission.admit("read", "replica", "primary")])
+async def get_my_bookings_formatted(
     lab_name: Optional[str] = Query(None),
     instrument_name: Optional[str] = Query(None),
     limit: int = Query(10, ge=1),
     offset: int = Query(0, ge=0),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    cursor: Optional[str] = Query(None),
+    include_history: bool = Query(False),
+    response: Response = None,
+    db = Depends(get_read_session),
+    current_user: Principal = Depends(get_current_user)
 ):
-    query = db.query(models.Booking).join(models.Instrument).join(models.Labs)\
-        .options(
-            joinedload(models.Booking.requested_by),  # eager load requester
-            joinedload(models.Booking.requested_to),  # eager load supervisor
-            joinedload(models.Booking.instrument).joinedload(models.Instrument.lab)  # eager load lab through instrument
-        )\
+    if serialization.FAST_JSON:
+        result, next_cursor = await run_db(
+            db, _get_my_bookings_fast, current_user, lab_name, instrument_name, limit, offset, cursor, include_history
+        )
+        response = serialization.FastJSONResponse(result)
+        pagination.set_next_cursor(response, next_cursor)
+        return response
+
+    result, next_cursor = await run_db(
+        db, _get_my_bookings_formatted, current_user, lab_name, instrument_name, limit, offset, cursor, include_history
+    )
+    pagination.set_next_cursor(response, next_cursor)
+    return result
+
+
+def _my_bookings_query(query, current_user: Principal, lab_name, instrument_name, limit, offset, cursor, include_history):
+    query = query.join(models.Instrument, models.Booking.instrument_id == models.Instrument.instrument_id)\
+        .join(models.Labs, models.Instrument.lab_id == models.Labs.id)\
         .filter(models.Booking.requested_by_id == current_user.id)
 
     if lab_name:
         query = query.filter(models.Labs.name == lab_name)
     if instrument_name:
         query = query.filter(models.Instrument.instrument_name == instrument_name)
+    query = partitions.current_bookings(query, include_history)
 
-    bookings = query.offset(offset).limit(limit).all()
+    return pagination.keyset(query, cursor).offset(offset).limit(limit)
+
+
+# ("Slot", "Booking Date") of a booking on `grid`
+def _slot_labels(grid: slots.SlotGrid, slot_index, slot: datetime):
+    slot_start = grid.slot_start(slot_index) if slot_index is not None else slot
+    slot_end = slot_start + grid.duration
+
+    slot_str = f"{slot_start.strftime('%I:%M %p')} - {slot_end.strftime('%I:%M %p')}"
+    booking_date = slot_start.strftime("%d/%m/%Y %I:%M %p")
+    return slot_str, booking_date
+
+
+def _get_my_bookings_formatted(db: Session, current_user: Principal, lab_name, instrument_name, limit, offset, cursor, include_history=False):
+    query = db.query(models.Booking)\
+        .options(
+            joinedload(models.Booking.requested_by),  # eager load requester
+            joinedload(models.Booking.requested_to),  # eager load supervisor
+            contains_eager(models.Booking.instrument).contains_eager(models.Instrument.lab)  # lab through instrument, from the filter joins
+        )
+
+    bookings = _my_bookings_query(query, current_user, lab_name, instrument_name, limit, offset, cursor, include_history).all()
 
     result = []
 
     for idx, booking in enumerate(bookings, start=1):
-        slot_start = booking.slot
-        slot_end = slot_start + timedelta(hours=2)  # assuming slot duration 2 hours
-
-        slot_str = f"{slot_start.strftime('%I:%M %p')} - {slot_end.strftime('%I:%M %p')}"
-        booking_date = slot_start.strftime("%d/%m/%Y %I:%M %p")
+        slot_str, booking_date = _slot_labels(
+            slots.SlotGrid.for_lab(booking.instrument.lab), booking.slot_index, booking.slot
+        )
 
         result.append({
             "S. No.": idx,
@@ -93,22 +246,89 @@ def get_my_bookings_formatted(
             "Supervisor": booking.requested_to.username if booking.requested_to else "Unknown"
         })
 
-    return result
+    return result, pagination.next_cursor(bookings, limit)
+
+
+# FAST_JSON: the same page from one tuple query, each distinct slot formatted once
+def _get_my_bookings_fast(db: Session, current_user: Principal, lab_name, instrument_name, limit, offset, cursor, include_history=False):
+    requested_by = aliased(models.User)
+    requested_to = aliased(models.User)
+    query = db.query(
+        models.Booking.id,
+        models.Booking.slot,
+        models.Booking.slot_index,
+        models.Booking.status,
+        models.Labs.slot_start,
+        models.Labs.slot_minutes,
+        models.Labs.slots_per_day,
+        requested_by.username.label("requested_by"),
+        requested_to.username.label("requested_to")
+    ).select_from(models.Booking)\
+        .outerjoin(requested_by, models.Booking.requested_by_id == requested_by.id)\
+        .outerjoin(requested_to, models.Booking.requested_to_id == requested_to.id)
+
+    rows = _my_bookings_query(query, current_user, lab_name, instrument_name, limit, offset, cursor, include_history).all()
+
+    labels = {}  # (grid columns, slot index or slot) -> ("Slot", "Booking Date")
+    result = []
+    for idx, row in enumerate(rows, start=1):
+        key = (row.slot_start, row.slot_minutes, row.slots_per_day, row.slot if row.slot_index is None else row.slot_index)
+        slot_labels = labels.get(key)
+        if slot_labels is None:
+            slot_labels = labels[key] = _slot_labels(slots.SlotGrid.for_lab(row), row.slot_index, row.slot)
+
+        result.append({
+            "S. No.": idx,
+            "Application No.": row.id,
+            "Slot": slot_labels[0],
+            "Booking Date": slot_labels[1],
+            "status": row.status,
+            "User name": row.requested_by if row.requested_by is not None else "Unknown",
+            "Supervisor": row.requested_to if row.requested_to is not None else "Unknown"
+        })
+
+    return result, pagination.next_cursor(rows, limit)
 
 # --------- GET ALL BOOKINGS (Admin only, with pagination and filters) ---------
-@router.get("/", response_model=List[schemas.Booking])
-def get_all_bookings(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+@router.get("/", response_model=List[schemas.Booking], dependencies=[admission.admit("read", "replica", "primary")])
+async def get_all_bookings(
+    db = Depends(get_read_session),
+    current_user: Principal = Depends(get_current_user),
     skip: int = Query(0, ge=0),
     limit: int = Query(10, le=100),
     user_id: int = None,
-    instrument_id: int = None
+    instrument_id: int = None,
+    cursor: Optional[str] = Query(None),
+    include_history: bool = Query(False),
+    response: Response = None
 ):
     if current_user.privilege_level != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view all bookings")
 
-    query = db.query(models.Booking)
+    if serialization.FAST_JSON:
+        rows = await run_db(db, _get_all_bookings, skip, limit, user_id, instrument_id, cursor, include_history, BOOKING_COLUMNS)
+        response = serialization.FastJSONResponse(serialization.as_dicts(rows))
+        pagination.set_next_cursor(response, pagination.next_cursor(rows, limit))
+        return response
+
+    bookings = await run_db(db, _get_all_bookings, skip, limit, user_id, instrument_id, cursor, include_history)
+    pagination.set_next_cursor(response, pagination.next_cursor(bookings, limit))
+    return bookings
+
+
+# schemas.Booking's fields, in its order, for the FAST_JSON path
+BOOKING_COLUMNS = (
+    models.Booking.instrument_id,
+    models.Booking.slot,
+    models.Booking.requested_to_id,
+    models.Booking.status,
+    models.Booking.requested_by_id,
+    models.Booking.id,
+)
+
+
+def _get_all_bookings(db: Session, skip, limit, user_id, instrument_id, cursor, include_history=False, entities=(models.Booking,)):
+    query = db.query(*entities)
 
     if user_id:
         query = query.filter(models.Booking.requested_by_id == user_id)
@@ -116,85 +336,255 @@ def get_all_bookings(
     if instrument_id:
         query = query.filter(models.Booking.instrument_id == instrument_id)
 
-    return query.offset(skip).limit(limit).all()
+    query = partitions.current_bookings(query, include_history)
+    return pagination.keyset(query, cursor).offset(skip).limit(limit).all()
+
+
+# --------- EXPORT ALL BOOKINGS (Admin only, streamed NDJSON or CSV) ---------
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ["instrument_id", "slot", "requested_to_id", "status", "requested_by_id", "id"]
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+# Holds its pool slots until the last row is streamed: the stream keeps its replica connection that long
 
+# Holds a replica pool slot until the last row is streamed: the stream keeps its connection that long
+@router.get("/export", dependencies=[admission.admit("read", "replica", "primary")])
+async def export_bookings(
+    current_user: Principal = Depends(get_current_user),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    user_id: int = None,
+    instrument_id: int = None,
+    slot_from: Optional[datetime] = None,
+    slot_to: Optional[datetime] = None
+):
+    if current_user.privilege_level != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can export bookings")
+
+    table = models.Booking.__table__
+    query = select(*(table.c[column] for column in EXPORT_COLUMNS)).order_by(table.c.id)
+
+    # Same filters as get_all_bookings, plus a slot range
+    if user_id:
+        query = query.where(table.c.requested_by_id == user_id)
+    if instrument_id:
+        query = query.where(table.c.instrument_id == instrument_id)
+    if slot_from:
+        query = query.where(table.c.slot >= slot_from)
+    if slot_to:
+        query = query.where(table.c.slot <= slot_to)
+
+    rows = _export_rows_async(query, format) if DB_MODE == "async" else _export_rows(query, format)
+    return StreamingResponse(
+        rows,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="bookings.{format}"'}
+    )
+
+
+def _export_header(format: str):
+    if format != "csv":
+        return ""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_COLUMNS)
+    return buffer.getvalue()
+
+
+def _export_batch(rows, format: str):
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows(
+            (row.instrument_id, row.slot.isoformat(), row.requested_to_id, row.status.value, row.requested_by_id, row.id)
+            for row in rows
+        )
+        return buffer.getvalue()
+    return "".join(
+        json.dumps({
+            "instrument_id": row.instrument_id,
+            "slot": row.slot.isoformat(),
+            "requested_to_id": row.requested_to_id,
+            "status": row.status.value,
+            "requested_by_id": row.requested_by_id,
+            "id": row.id
+        }) + "\n"
+        for row in rows
+    )
 
-from datetime import datetime, timedelta, time
-from typing import List
 
-@router.get("/availability/{lab_name}/{instrument_name}")
-def get_availability(instrument_name: str, lab_name: str, db: Session = Depends(get_db)):
-    from_zone = time(10, 0)
-    to_zone = time(16, 0)
-    slot_duration = timedelta(hours=2)
+# Runs after the route has returned, so it owns its session. A server-side cursor
+# (yield_per) keeps only one batch of rows in memory however large the export is.
+def _export_rows(query, format: str):
+    db = ReadSessionLocal()
+    try:
+        result = db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        header = _export_header(format)
+        if header:
+            yield header
+        for rows in result.partitions():
+            yield _export_batch(rows, format)
+    finally:
+        db.close()
+
+
+# The same on the async replica engine (DB_MODE=async)
+async def _export_rows_async(query, format: str):
+    async with AsyncReadSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        header = _export_header(format)
+        if header:
+            yield header
+        async for rows in result.partitions():
+            yield _export_batch(rows, format)
+
+
+@router.get("/availability/{lab_name}/{instrument_name}", dependencies=[admission.admit("availability", "replica")])
+async def get_availability(
+    instrument_name: str,
+    lab_name: str,
+    days: int = Query(slots.AVAILABILITY_DAYS, ge=1, le=slots.MAX_AVAILABILITY_DAYS),
+    db = Depends(get_read_session)
+):
+    return await run_db(db, _get_availability, instrument_name, lab_name, days)
+
+
+def _get_availability(db: Session, instrument_name: str, lab_name: str, days: int = slots.AVAILABILITY_DAYS):
     today = datetime.now().date()
-    num_days = 5
 
-    # Step 1: Get lab
-    lab = db.query(models.Labs).filter(models.Labs.name == lab_name).first()
-    if not lab:
+    # Served from the in-memory occupancy index once it is warm, otherwise from the database
+    occupancy_lookup = occupancy.lookup(db)
+
+    # Step 1 + 2: Get lab, its slot grid and all working instruments of this name in it
+    lab_id, grid, instrument_ids = occupancy_lookup.lab_instruments(lab_name, instrument_name)
+    if lab_id is None:
         raise HTTPException(status_code=404, detail="Lab not found")
+    if not instrument_ids:
+        raise HTTPException(status_code=404, detail="No working instruments found")
 
-    # Step 2: Get all working instruments of this name in that lab
-    instruments = db.query(models.Instrument).filter(
-        models.Instrument.instrument_name == instrument_name,
-        models.Instrument.working == True,
-        models.Instrument.lab_id == lab.id
-    ).all()
+    # Step 3: Slot-wise availability for the next `days` days
+    first_index, last_index = grid.window(today, days)
+    return occupancy.availability(occupancy_lookup, instrument_ids, grid, first_index, last_index)
 
-    if not instruments:
-        raise HTTPException(status_code=404, detail="No working instruments found")
 
-    instrument_ids = [instr.instrument_id for instr in instruments]
-    total = len(instrument_ids)
-
-    # Step 3: Get all bookings for these instruments in next 5 days
-    start_datetime = datetime.combine(today, from_zone)
-    end_datetime = datetime.combine(today + timedelta(days=num_days), time(23, 59))
-
-    bookings = db.query(models.Booking).filter(
-        models.Booking.instrument_id.in_(instrument_ids),
-        models.Booking.slot >= start_datetime,
-        models.Booking.slot <= end_datetime,
-        models.Booking.status.in_([
-            models.BookingStatusEnum.approved,
-            models.BookingStatusEnum.pending
-        ])
-    ).all()
-
-    # Helper to normalize bookings into proper slot start time
-    def normalize_slot(slot_datetime):
-        base_time = datetime.combine(slot_datetime.date(), time(10, 0))
-        diff = slot_datetime - base_time
-        if diff.total_seconds() < 0:
-            return None  # Before working hours
-        slot_index = int(diff.total_seconds() // (2 * 3600))  # 2-hour slots
-        if slot_index >= 4:
-            return None  # After working hours
-        return base_time + timedelta(hours=2 * slot_index)
-
-    # Step 4: Group bookings by normalized slot time
-    bookings_by_slot = defaultdict(set)
-    for b in bookings:
-        normalized_slot = normalize_slot(b.slot)
-        if normalized_slot is not None:
-            bookings_by_slot[normalized_slot].add(b.instrument_id)
-
-    # Step 5: Construct slot-wise availability
-    result = []
-    for day_offset in range(num_days):
-        date = today + timedelta(days=day_offset)
-        for i in range(4):  # 4 slots: 10–12, 12–2, 2–4, 4–6
-            slot_start = datetime.combine(date, time(10)) + i * slot_duration
-            booked = len(bookings_by_slot.get(slot_start, set()))
-            available = total - booked
-
-            result.append({
-                "date": date.strftime("%A, %d %B %Y"),
-                "slot": slot_start.isoformat(),
-                "available": available,
-                "status": f"{available} out of {total}",
-                "can_book": available > 0
-            })
-
-    return result
\ No newline at end of file
+# --------- LIVE AVAILABILITY (Server-Sent Events) ---------
+# Instead of polling get_availability: one "snapshot" event in the same shape, then a "delta" event
+# with the changed slots' entries whenever a booking is created or decided. An "error" event
+# (e.g. the last working instrument was removed) ends the stream.
+@router.get("/availability/{lab_name}/{instrument_name}/events", dependencies=[admission.admit("availability")])
+async def stream_availability(
+    instrument_name: str,
+    lab_name: str,
+    days: int = Query(slots.AVAILABILITY_DAYS, ge=1, le=slots.MAX_AVAILABILITY_DAYS)
+):
+    subscription, snapshot = await live.broker.subscribe(lab_name, instrument_name, days)
+    return StreamingResponse(
+        live.stream(subscription, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# --------- LAB-WIDE AVAILABILITY MATRIX (instrument name x day x slot) ---------
+@router.get("/availability/{lab_name}", dependencies=[admission.admit("availability", "replica")])
+async def get_lab_availability(
+    lab_name: str,
+    days: int = Query(slots.AVAILABILITY_DAYS, ge=1, le=slots.MAX_AVAILABILITY_DAYS),
+    db = Depends(get_read_session)
+):
+    return await run_db(db, _get_lab_availability, lab_name, days)
+
+
+def _get_lab_availability(db: Session, lab_name: str, num_days: int = slots.AVAILABILITY_DAYS):
+    today = datetime.now().date()
+
+    # Slot indexes of the window in the lab's own grid; the same window in datetimes keeps the
+    # join to the matching monthly partitions
+    first_index = today.toordinal() * models.Labs.slots_per_day
+    last_index = (today.toordinal() + num_days) * models.Labs.slots_per_day
+    window_start = datetime.combine(today, datetime.min.time())
+    window_end = window_start + timedelta(days=num_days)
+    lab_id = db.query(func.min(models.Labs.id)).filter(models.Labs.name == lab_name).scalar_subquery()
+
+    # Single query: one row per (instrument, booked slot).
+    # Working instruments with no bookings come back once with a NULL slot.
+    rows = db.query(
+        models.Labs.id,
+        models.Labs.slot_start,
+        models.Labs.slot_minutes,
+        models.Labs.slots_per_day,
+        models.Instrument.instrument_name,
+        models.Instrument.instrument_id,
+        models.Booking.slot_index
+    ).select_from(models.Labs)\
+        .outerjoin(models.Instrument, and_(
+            models.Instrument.lab_id == models.Labs.id,
+            models.Instrument.working == True
+        ))\
+        .outerjoin(models.Booking, and_(
+            models.Booking.instrument_id == models.Instrument.instrument_id,
+            models.Booking.slot_index >= first_index,
+            models.Booking.slot_index < last_index,
+            models.Booking.slot >= window_start,
+            models.Booking.slot < window_end,
+            models.Booking.status.in_(occupancy.ACTIVE_STATUSES)
+        ))\
+        .filter(models.Labs.id == lab_id)\
+        .group_by(
+            models.Labs.id,
+            models.Labs.slot_start,
+            models.Labs.slot_minutes,
+            models.Labs.slots_per_day,
+            models.Instrument.instrument_name,
+            models.Instrument.instrument_id,
+            models.Booking.slot_index
+        ).all()
+
+    if not rows:
+        raise HTTPException(status_code=404, detail="Lab not found")
+
+    grid = slots.SlotGrid.for_lab(rows[0])
+    per_day = grid.per_day
+    days = [today + timedelta(days=day_offset) for day_offset in range(num_days)]
+    rows = [row for row in rows if row.instrument_id is not None]
+
+    if not rows:
+        names = np.array([], dtype=object)
+        totals = np.zeros(0, dtype=np.int64)
+        booked = np.zeros((0, num_days, per_day), dtype=np.int64)
+    else:
+        names, name_idx = np.unique([row.instrument_name for row in rows], return_inverse=True)
+        instrument_ids = np.array([row.instrument_id for row in rows], dtype=np.int64)
+
+        # Total working instruments per name
+        _, first_rows = np.unique(instrument_ids, return_index=True)
+        totals = np.bincount(name_idx[first_rows], minlength=len(names))
+
+        # Booked instruments per (name, day, slot); rows are already unique per instrument and slot
+        slot_offsets = np.array(
+            [row.slot_index - grid.first_index(today) if row.slot_index is not None else -1 for row in rows],
+            dtype=np.int64
+        )
+        in_window = (slot_offsets >= 0) & (slot_offsets < num_days * per_day)
+        cells = name_idx[in_window] * num_days * per_day + slot_offsets[in_window]
+        booked = np.bincount(cells, minlength=len(names) * num_days * per_day)\
+            .reshape(len(names), num_days, per_day)
+
+    available = totals[:, None, None] - booked
+
+    return {
+        "lab_name": lab_name,
+        "dates": [day.strftime("%A, %d %B %Y") for day in days],
+        "slots": [
+            [grid.slot_start(grid.first_index(day) + i).isoformat() for i in range(per_day)]
+            for day in days
+        ],
+        "instruments": [
+            {
+                "instrument_name": name,
+                "total": int(total),
+                "available": by_day.tolist()
+            }
+            for name, total, by_day in zip(names.tolist(), totals, available)
+        ]
+    }
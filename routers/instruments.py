@@ -1,11 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response, status
+from sqlalchemy import delete, exists, insert, or_, update
 from sqlalchemy.orm import Session
 from typing import List
 
+import admission
 import models
 import schemas
-from db import get_db
-from oauth2 import get_current_user
+import occupancy
+import catalog
+import search
+import serialization
+from db import get_read_session, get_session, mark_recent_write, run_db
+from oauth2 import Principal, get_current_user
 
 router = APIRouter(
     prefix="/instruments",
@@ -13,7 +19,7 @@ router = APIRouter(
 )
 
 # Utility: Admin check
-def require_admin(user: models.User):
+def require_admin(user: Principal):
     if user.privilege_level != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -22,61 +28,156 @@ def require_admin(user: models.User):
 
 # --------- CREATE INSTRUMENT (ADMIN ONLY) ---------
 @router.post("/", response_model=schemas.Instrument)
-def create_instrument(
+async def create_instrument(
     instrument: schemas.InstrumentCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    response: Response,
+    db = Depends(get_session),
+    current_user: Principal = Depends(get_current_user)
 ):
     require_admin(current_user)
+    db_instrument = await run_db(db, _create_instrument, instrument)
+    mark_recent_write(current_user.id, response)
+    return db_instrument
+
 
-    db_instrument = models.Instrument(**instrument.dict())
-    db.add(db_instrument)
+# Writes are single INSERT/UPDATE/DELETE ... RETURNING statements: no lookup before, no refresh after
+def _create_instrument(db: Session, instrument: schemas.InstrumentCreate):
+    table = models.Instrument.__table__
+    db_instrument = db.execute(insert(table).values(**instrument.dict()).returning(*table.c)).first()
     db.commit()
-    db.refresh(db_instrument)
+    occupancy.instrument_changed(db_instrument.instrument_id, db_instrument.instrument_name, db_instrument.lab_id, db_instrument.working)
+    catalog.bump()
     return db_instrument
 
 
-# --------- GET ALL INSTRUMENTS (PUBLIC) ---------
+# --------- GET ALL INSTRUMENTS (PUBLIC, cached per catalog version, ETag / 304) ---------
+# Filled from the primary, like the other catalog responses (see routers/lab.py)
 @router.get("/", response_model=List[schemas.Instrument])
-def get_instruments(db: Session = Depends(get_db)):
-    return db.query(models.Instrument).all()
+async def get_instruments(request: Request, db = Depends(get_session)):
+    cached = catalog.lookup("instruments")
+    if cached is None:
+        catalog_version = catalog.version()
+        cached = catalog.store("instruments", catalog_version, await run_db(db, _catalog_instruments))
+    return catalog.respond(request, cached)
+
+
+# What the catalog caches for /instruments/; startup warms it with this too
+def _catalog_instruments(db: Session):
+    if serialization.FAST_JSON:
+        return serialization.as_dicts(_get_instruments(db, INSTRUMENT_COLUMNS))
+    return [schemas.Instrument.from_orm(i) for i in _get_instruments(db)]
+
+
+# schemas.Instrument's fields, in its order, for the FAST_JSON path
+INSTRUMENT_COLUMNS = (
+    models.Instrument.instrument_name,
+    models.Instrument.lab_id,
+    models.Instrument.working,
+    models.Instrument.instrument_id,
+)
+
+
+def _get_instruments(db: Session, entities=(models.Instrument,)):
+    return db.query(*entities).all()
+
+
+# --------- SEARCH INSTRUMENTS (PUBLIC, ranked; short autocomplete terms cached per catalog version) ---------
+@router.get("/search", response_model=List[schemas.InstrumentSearchResult], dependencies=[admission.admit("read", "replica")])
+async def search_instruments(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=100),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db = Depends(get_read_session)
+):
+    term = search.normalize(q)
+    cached = search.lookup(term, skip, limit)
+    if cached is None:
+        catalog_version = catalog.version()
+        cached = search.store(term, skip, limit, catalog_version, await run_db(db, _search_instruments, term, skip, limit))
+    return catalog.respond(request, cached)
+
+
+# schemas.InstrumentSearchResult's fields, in its order
+SEARCH_COLUMNS = INSTRUMENT_COLUMNS + (models.Labs.name.label("lab_name"),)
+
+
+def _search_instruments(db: Session, term: str, skip: int, limit: int):
+    if not term:
+        return []
+    rows = search.search_instruments(db, term, skip, limit, SEARCH_COLUMNS)
+    if serialization.FAST_JSON:
+        return serialization.as_dicts(rows)
+    return [schemas.InstrumentSearchResult.from_orm(row) for row in rows]
 
 
 # --------- UPDATE INSTRUMENT (ADMIN ONLY) ---------
 @router.put("/{instrument_id}", response_model=schemas.Instrument)
-def update_instrument(
+async def update_instrument(
     instrument_id: int,
     updated: schemas.InstrumentCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    response: Response,
+    db = Depends(get_session),
+    current_user: Principal = Depends(get_current_user)
 ):
     require_admin(current_user)
+    instrument = await run_db(db, _update_instrument, instrument_id, updated)
+    mark_recent_write(current_user.id, response)
+    return instrument
 
-    instrument = db.query(models.Instrument).filter(models.Instrument.instrument_id == instrument_id).first()
-    if not instrument:
-        raise HTTPException(status_code=404, detail="Instrument not found")
 
-    for key, value in updated.dict().items():
-        setattr(instrument, key, value)
+# A booking's slot_index counts in its lab's grid, so an instrument with active bookings stays in its lab
+def _update_instrument(db: Session, instrument_id: int, updated: schemas.InstrumentCreate):
+    table = models.Instrument.__table__
+    has_active_bookings = exists().where(
+        models.Booking.instrument_id == table.c.instrument_id,
+        models.Booking.status.in_(models.ACTIVE_BOOKING_STATUSES)
+    )
+    statement = update(table)\
+        .where(table.c.instrument_id == instrument_id, or_(table.c.lab_id == updated.lab_id, ~has_active_bookings))\
+        .values(**updated.dict())\
+        .returning(*table.c)
+    instrument = db.execute(statement).first()
+    if not instrument:
+        # Only on failure: tell a missing instrument from one that would leave its bookings behind
+        db.rollback()
+        if db.query(models.Instrument.instrument_id).filter(models.Instrument.instrument_id == instrument_id).first() is None:
+            raise HTTPException(status_code=404, detail="Instrument not found")
+        raise HTTPException(status_code=400, detail="This instrument has active bookings and cannot be moved to another lab.")
 
     db.commit()
-    db.refresh(instrument)
+    occupancy.instrument_changed(instrument.instrument_id, instrument.instrument_name, instrument.lab_id, instrument.working)
+    catalog.bump()
     return instrument
 
 
 # --------- DELETE INSTRUMENT (ADMIN ONLY) ---------
 @router.delete("/{instrument_id}")
-def delete_instrument(
+async def delete_instrument(
     instrument_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    response: Response,
+    db = Depends(get_session),
+    current_user: Principal = Depends(get_current_user)
 ):
     require_admin(current_user)
+    result = await run_db(db, _delete_instrument, instrument_id)
+    mark_recent_write(current_user.id, response)
+    return result
+
+
+# Instruments with bookings are kept: the bookings would be left pointing at nothing
+def _delete_instrument(db: Session, instrument_id: int):
+    table = models.Instrument.__table__
+    has_bookings = exists().where(models.Booking.instrument_id == table.c.instrument_id)
+    statement = delete(table).where(table.c.instrument_id == instrument_id, ~has_bookings).returning(table.c.instrument_id)
+    if db.execute(statement).first() is None:
+        # Only on failure: tell a missing instrument from one that still has bookings
+        db.rollback()
+        if db.query(models.Instrument.instrument_id).filter(models.Instrument.instrument_id == instrument_id).first() is None:
+            raise HTTPException(status_code=404, detail="Instrument not found")
+        raise HTTPException(status_code=400, detail="This instrument has bookings and cannot be deleted.")
 
-    instrument = db.query(models.Instrument).filter(models.Instrument.instrument_id == instrument_id).first()
-    if not instrument:
-        raise HTTPException(status_code=404, detail="Instrument not found")
-
-    db.delete(instrument)
     db.commit()
+    occupancy.instrument_removed(instrument_id)
+    catalog.bump()
     return {"message": "Instrument deleted successfully"}
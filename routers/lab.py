@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from typing import List
 
-import models, schemas
-from db import get_db
+import models, schemas, occupancy, catalog, slots
+from db import get_session, run_db
 
 router = APIRouter(
     prefix="/labs",
@@ -12,21 +13,52 @@ router = APIRouter(
 
 # --------- CREATE LAB ---------
 @router.post("/", response_model=schemas.Lab)
-def create_lab(lab: schemas.LabCreate, db: Session = Depends(get_db)):
-    db_lab = models.Labs(**lab.dict())
-    db.add(db_lab)
+async def create_lab(lab: schemas.LabCreate, db = Depends(get_session)):
+    return await run_db(db, _create_lab, lab)
+
+
+# One INSERT ... RETURNING: the row comes back with its id and grid defaults, no refresh afterwards
+def _create_lab(db: Session, lab: schemas.LabCreate):
+    table = models.Labs.__table__
+    db_lab = db.execute(insert(table).values(**lab.dict()).returning(*table.c)).first()
     db.commit()
-    db.refresh(db_lab)
+    occupancy.lab_changed(db_lab.id, db_lab.name, slots.SlotGrid.for_lab(db_lab))
+    catalog.bump()
     return db_lab
 
-# --------- GET ALL LABS ---------
+# --------- GET ALL LABS (cached per catalog version, ETag / 304) ---------
+# Catalog misses read the primary: right after a bump the replica may not have the write yet, and whatever
+# is read here is served to everyone until the next bump
 @router.get("/", response_model=List[schemas.Lab])
-def get_all_labs(db: Session = Depends(get_db)):
+async def get_all_labs(request: Request, db = Depends(get_session)):
+    cached = catalog.lookup("labs")
+    if cached is None:
+        catalog_version = catalog.version()
+        cached = catalog.store("labs", catalog_version, await run_db(db, _catalog_labs))
+    return catalog.respond(request, cached)
+
+
+def _get_all_labs(db: Session):
     return db.query(models.Labs).all()
 
+
+# What the catalog caches for /labs/; startup warms it with this too
+def _catalog_labs(db: Session):
+    return [schemas.Lab.from_orm(lab) for lab in _get_all_labs(db)]
+
 # --------- GET INSTRUMENTS IN A LAB ---------
 @router.get("/{lab_id}/instruments", response_model=List[schemas.Instrument])
-def get_instruments_in_lab(lab_id: int, db: Session = Depends(get_db)):
+async def get_instruments_in_lab(lab_id: int, request: Request, db = Depends(get_session)):
+    key = f"labs/{lab_id}/instruments"
+    cached = catalog.lookup(key)
+    if cached is None:
+        catalog_version = catalog.version()
+        instruments = await run_db(db, _get_instruments_in_lab, lab_id)
+        cached = catalog.store(key, catalog_version, [schemas.Instrument.from_orm(i) for i in instruments])
+    return catalog.respond(request, cached)
+
+
+def _get_instruments_in_lab(db: Session, lab_id: int):
     lab = db.query(models.Labs).filter(models.Labs.id == lab_id).first()
     if not lab:
         raise HTTPException(status_code=404, detail="Lab not found")
@@ -1,48 +1,69 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
-from passlib.context import CryptContext
 
-import models, schemas, oauth2
-from db import get_db
+import models, schemas, oauth2, hashing
+from db import dialect_insert, get_session, run_db
 
 router = APIRouter(
     prefix="/user",
     tags=["User"]
 )
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _get_user_by_username(db: Session, username: str):
+    return db.query(models.User).filter(models.User.username == username).first()
 
 
 # ----------- SIGNUP -----------
 @router.post("/signup", response_model=schemas.User)
-def signup(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing_user = db.query(models.User).filter(models.User.username == user_data.username).first()
-    if existing_user:
+async def signup(user_data: schemas.UserCreate, db = Depends(get_session)):
+    hashed_password = await hashing.hash_password(user_data.password)
+
+    new_user = await run_db(db, _create_user, user_data, hashed_password)
+    if new_user is None:
         raise HTTPException(status_code=400, detail="Username already taken")
+    return new_user
 
-    hashed_password = pwd_context.hash(user_data.password)
 
-    new_user = models.User(
+# One INSERT ... ON CONFLICT (username) DO NOTHING RETURNING: a taken username (even one taken by a
+# concurrent signup) returns no row instead of raising
+def _create_user(db: Session, user_data: schemas.UserCreate, hashed_password: str):
+    table = models.User.__table__
+    statement = dialect_insert(db, table).values(
         username=user_data.username,
         password=hashed_password,
         privilege_level=user_data.privilege_level
-    )
+    ).on_conflict_do_nothing(index_elements=[table.c.username]).returning(table.c.id, table.c.username, table.c.privilege_level)
 
-    db.add(new_user)
+    new_user = db.execute(statement).first()
+    if new_user is None:
+        db.rollback()
+        return None
     db.commit()
-    db.refresh(new_user)
     return new_user
 
 
 # ----------- LOGIN -----------
 @router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db = Depends(get_session)):
+    user = await run_db(db, _get_user_by_username, form_data.username)
+    if not user:
+        raise HTTPException(status_code=403, detail="Invalid Credentials")
 
-    if not user or not pwd_context.verify(form_data.password, user.password):
+    valid, new_hash = await hashing.verify_password(form_data.password, user.password)
+    if not valid:
         raise HTTPException(status_code=403, detail="Invalid Credentials")
 
+    # Stored hash uses an outdated cost factor: replace it while we have the plain password
+    if new_hash:
+        await run_db(db, _update_password, user.id, new_hash)
+
     access_token = oauth2.create_access_token(data={"user_id": user.id})
 
     return {"access_token": access_token, "token_type": "bearer"}
+
+
+def _update_password(db: Session, user_id: int, hashed_password: str):
+    db.query(models.User).filter(models.User.id == user_id).update({models.User.password: hashed_password})
+    db.commit()
@@ -1,8 +1,10 @@
-from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional
+from pydantic import BaseModel, Field, root_validator
+from datetime import datetime, time, timedelta
+from typing import Dict, List, Optional
 from enum import Enum as PyEnum
 
+from slots import DEFAULT_SLOT_MINUTES, DEFAULT_SLOT_START, DEFAULT_SLOTS_PER_DAY, MINUTES_PER_DAY, grid_fits_in_day
+
 
 # ----------- ENUMS -----------
 class PrivilegeLevel(str, PyEnum):
@@ -17,6 +19,18 @@ class BookingStatus(str, PyEnum):
 # ----------- LABS -----------
 class LabBase(BaseModel):
     name: str
+    # Slot grid: slots_per_day slots of slot_minutes each, back to back from slot_start
+    slot_start: time = DEFAULT_SLOT_START
+    slot_minutes: int = Field(DEFAULT_SLOT_MINUTES, ge=5, le=MINUTES_PER_DAY)
+    slots_per_day: int = Field(DEFAULT_SLOTS_PER_DAY, ge=1)
+
+    @root_validator(skip_on_failure=True)
+    def check_grid(cls, values):
+        if values["slot_start"].second or values["slot_start"].microsecond or values["slot_start"].tzinfo:
+            raise ValueError("slot_start must be a whole minute without a timezone")
+        if not grid_fits_in_day(values["slot_start"], values["slot_minutes"], values["slots_per_day"]):
+            raise ValueError("The slot grid must end by midnight")
+        return values
 
 class LabCreate(LabBase):
     pass
@@ -43,6 +57,11 @@ class Instrument(InstrumentBase):
         orm_mode = True
 
 
+# A search hit: the instrument and its lab's name
+class InstrumentSearchResult(Instrument):
+    lab_name: str
+
+
 # ----------- USER SCHEMAS -----------
 class UserBase(BaseModel):
     username: str
@@ -78,7 +97,98 @@ class Booking(BookingBase):
     class Config:
         orm_mode = True
 
+# ----------- BATCH / RECURRING BOOKING SCHEMAS -----------
+MAX_BATCH_SLOTS = 100
+
+# e.g. every Tuesday 10:00 for 12 weeks: start=<a Tuesday 10:00>, interval_days=7, count=12
+class BookingRecurrence(BaseModel):
+    start: datetime
+    interval_days: int = Field(7, ge=1)
+    count: Optional[int] = Field(None, ge=1, le=MAX_BATCH_SLOTS)
+    until: Optional[datetime] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_end(cls, values):
+        if (values.get("count") is None) == (values.get("until") is None):
+            raise ValueError("Give exactly one of count or until")
+        return values
+
+    def expand(self):
+        step = timedelta(days=self.interval_days)
+        if self.count is not None:
+            return [self.start + i * step for i in range(self.count)]
+        slots = []
+        slot = self.start
+        while slot <= self.until and len(slots) <= MAX_BATCH_SLOTS:
+            slots.append(slot)
+            slot += step
+        return slots
+
+
+class BookingBatchCreate(BaseModel):
+    instrument_id: int
+    requested_to_id: int
+    slots: Optional[List[datetime]] = None
+    recurrence: Optional[BookingRecurrence] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_slots(cls, values):
+        if (values.get("slots") is None) == (values.get("recurrence") is None):
+            raise ValueError("Give exactly one of slots or recurrence")
+        return values
+
+    # Requested slots in order, duplicates removed. No timezone handling: wall-clock times are stored as given.
+    def expand(self):
+        slots = self.slots if self.slots is not None else self.recurrence.expand()
+        slots = list(dict.fromkeys(slot.replace(tzinfo=None) for slot in slots))
+        if not slots:
+            raise ValueError("No slots requested")
+        if len(slots) > MAX_BATCH_SLOTS:
+            raise ValueError(f"At most {MAX_BATCH_SLOTS} slots can be booked at once")
+        return slots
+
+
+class BookingBatchSlotResult(BaseModel):
+    slot: datetime
+    status: str  # "created" or "conflict"
+    booking: Optional[Booking] = None
+
+
+class BookingBatchResult(BaseModel):
+    created: int
+    conflicts: int
+    results: List[BookingBatchSlotResult]
+
+
 # ----------- BOOKING UPDATE SCHEMA -----------
 class BookingStatusUpdate(BaseModel):
     status: BookingStatus
 
+
+# ----------- BATCH DECISION SCHEMAS -----------
+class BookingDecision(BookingStatusUpdate):
+    booking_id: int
+
+class BookingDecisionBatch(BaseModel):
+    decisions: List[BookingDecision] = Field(..., min_items=1, max_items=500)
+
+class BookingDecisionBatchResult(BaseModel):
+    applied: List[int]
+    not_found: List[int]
+    forbidden: List[int]
+    conflicts: List[int]  # re-activations of bookings whose slot is taken; left unchanged
+
+
+# ----------- APPROVER INBOX SCHEMAS -----------
+# Counts per status value; every status is present, 0 when there are none
+class InboxInstrumentCounts(BaseModel):
+    instrument_id: int
+    instrument_name: str
+    lab_id: int
+    total: int
+    by_status: Dict[str, int]
+
+class InboxSummary(BaseModel):
+    total: int
+    by_status: Dict[str, int]
+    by_instrument: List[InboxInstrumentCounts]
@@ -0,0 +1,116 @@
+# Instrument search and autocomplete over instrument and lab names (GET /instruments/search).
+#
+# Results are ranked: exact instrument name, instrument name prefix, lab name prefix, substring of
+# either, then fuzzy (trigram) matches for typos. On PostgreSQL the pg_trgm GIN indexes of alembic
+# revision d2c6a8f0b4e1 serve the ILIKE and `%` (similarity) filters; fuzzy matches use the database's
+# pg_trgm.similarity_threshold (0.3 by default). Elsewhere (SQLite in tests) similarity() is this
+# module's Python version of pg_trgm's, registered on every connection, with the same 0.3 threshold.
+import os
+import re
+
+from sqlalchemy import case, event, func, or_
+from sqlalchemy.orm import Session
+
+import catalog
+import db
+import models
+from cache import TTLCache
+
+# ----- CONFIG -----
+# Responses for terms up to this many characters (what autocomplete sends while someone types) are
+# cached in-process per catalog version, so any lab/instrument write invalidates them
+SEARCH_CACHE_MAX_TERM = int(os.getenv("SEARCH_CACHE_MAX_TERM", "4"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "4096"))
+
+SIMILARITY_THRESHOLD = 0.3  # pg_trgm's default, for the fallback
+
+_results = TTLCache(SEARCH_CACHE_SIZE, catalog.CATALOG_CACHE_TTL)  # (version, term, skip, limit) -> (body, etag)
+
+
+# ----- TERMS -----
+def normalize(term: str):
+    return " ".join(term.lower().split())
+
+
+# ----- TRIGRAMS (pg_trgm semantics) -----
+_WORD = re.compile(r"[^\W_]+")
+
+
+# Each alphanumeric word, lowercased and padded with two spaces in front and one behind
+def trigrams(text: str):
+    result = set()
+    for word in _WORD.findall(text.lower()):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(a, b):
+    if a is None or b is None:
+        return None
+    left, right = trigrams(a), trigrams(b)
+    if not left or not right:
+        return 0.0
+    common = len(left & right)
+    return common / (len(left) + len(right) - common)
+
+
+def _register_similarity(dbapi_connection, connection_record):
+    dbapi_connection.create_function("similarity", 2, similarity, deterministic=True)
+
+
+def _sqlite_engines():
+    engines = {db.engine, db.replica_engine}
+    if db.async_engine is not None:
+        engines |= {db.async_engine.sync_engine, db.async_replica_engine.sync_engine}
+    return [engine for engine in engines if engine.dialect.name == "sqlite"]
+
+
+for _engine in _sqlite_engines():
+    event.listen(_engine, "connect", _register_similarity)
+
+
+# ----- QUERY -----
+def _fuzzy(db: Session, column, term: str):
+    if db.get_bind().dialect.name == "postgresql":
+        return column.op("%")(term)  # indexed; threshold is pg_trgm.similarity_threshold
+    return func.similarity(column, term) >= SIMILARITY_THRESHOLD
+
+
+# One query: matches, ranked, one page of them. `term` is normalize()d.
+def search_instruments(db: Session, term: str, skip: int, limit: int, entities):
+    name, lab_name = models.Instrument.instrument_name, models.Labs.name
+    contains = or_(name.icontains(term, autoescape=True), lab_name.icontains(term, autoescape=True))
+    rank = case(
+        (func.lower(name) == term, 5),
+        (name.istartswith(term, autoescape=True), 4),
+        (lab_name.istartswith(term, autoescape=True), 3),
+        (contains, 2),
+        else_=1
+    )
+    return db.query(*entities)\
+        .join(models.Labs, models.Labs.id == models.Instrument.lab_id)\
+        .filter(or_(contains, _fuzzy(db, name, term), _fuzzy(db, lab_name, term)))\
+        .order_by(
+            rank.desc(),
+            func.similarity(name, term).desc(),
+            func.similarity(lab_name, term).desc(),
+            name,
+            models.Instrument.instrument_id
+        )\
+        .offset(skip).limit(limit).all()
+
+
+# ----- AUTOCOMPLETE CACHE -----
+def lookup(term: str, skip: int, limit: int):
+    if len(term) > SEARCH_CACHE_MAX_TERM:
+        return None
+    return _results.get((catalog.version(), term, skip, limit))
+
+
+# Like catalog.store: `catalog_version` is read before querying
+def store(term: str, skip: int, limit: int, catalog_version: int, content):
+    entry = catalog.serialize(content)
+    if len(term) <= SEARCH_CACHE_MAX_TERM:
+        _results.set((catalog_version, term, skip, limit), entry)
+    return entry
@@ -0,0 +1,50 @@
+import json
+import os
+
+import orjson
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+# ----- CONFIG -----
+# Hot list endpoints (/bookings/, /bookings/me, /instruments/) select column tuples instead of ORM
+# objects, skip Pydantic response validation and serialize with orjson. The bytes sent are the same.
+FAST_JSON = os.getenv("FAST_JSON", "0") == "1"
+
+
+# ----- ENCODERS -----
+# Exactly what FastAPI's JSONResponse sends for `content`
+def standard_dumps(content):
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+# The same bytes as standard_dumps(). Dicts, lists, str, int, bool, None, str enums and naive
+# datetimes (everything the fast paths produce) are encoded natively; anything else, such as
+# Pydantic models, goes through jsonable_encoder first.
+def fast_dumps(content):
+    return orjson.dumps(content, default=jsonable_encoder)
+
+
+def dumps(content):
+    return fast_dumps(content) if FAST_JSON else standard_dumps(content)
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        return fast_dumps(content)
+
+
+# ----- ROWS -----
+# Column tuples as dicts keyed by the selected column names, in select order
+def as_dicts(rows):
+    if not rows:
+        return []
+    keys = rows[0]._fields
+    return [dict(zip(keys, row)) for row in rows]
@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import Integer, and_, cast, extract
+
+# ----- DEFAULT GRID -----
+# Labs get this grid unless created with their own: 2-hour slots from 10:00, 4 per day (10–12, 12–2, 2–4, 4–6)
+DEFAULT_SLOT_START = time(10, 0)
+DEFAULT_SLOT_MINUTES = 120
+DEFAULT_SLOTS_PER_DAY = 4
+
+# Days covered by availability unless asked for more, and the most that may be asked for
+AVAILABILITY_DAYS = 5
+MAX_AVAILABILITY_DAYS = 90
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def grid_fits_in_day(slot_start: time, slot_minutes: int, slots_per_day: int):
+    return slot_start.hour * 60 + slot_start.minute + slot_minutes * slots_per_day <= MINUTES_PER_DAY
+
+
+# ----- SLOT GRID -----
+# A lab's bookable slots: `per_day` slots of `minutes` each, back to back from `start`.
+# Slot indexes count slots since day 1 of the proleptic calendar, so they only compare within one grid.
+@dataclass(frozen=True)
+class SlotGrid:
+    start: time = DEFAULT_SLOT_START
+    minutes: int = DEFAULT_SLOT_MINUTES
+    per_day: int = DEFAULT_SLOTS_PER_DAY
+
+    # From anything with the Labs grid columns (a Labs row or a query row)
+    @classmethod
+    def for_lab(cls, lab):
+        return cls(lab.slot_start, lab.slot_minutes, lab.slots_per_day)
+
+    @property
+    def duration(self):
+        return timedelta(minutes=self.minutes)
+
+    @property
+    def start_minutes(self):
+        return self.start.hour * 60 + self.start.minute
+
+    # Position of a datetime inside its day's grid, or None when outside working hours
+    def position(self, slot_datetime: datetime):
+        base_time = datetime.combine(slot_datetime.date(), self.start)
+        diff = slot_datetime - base_time
+        if diff.total_seconds() < 0:
+            return None  # Before working hours
+        position = int(diff.total_seconds() // (self.minutes * 60))
+        if position >= self.per_day:
+            return None  # After working hours
+        return position
+
+    def index(self, slot_datetime: datetime):
+        position = self.position(slot_datetime)
+        if position is None:
+            return None
+        return slot_datetime.date().toordinal() * self.per_day + position
+
+    def first_index(self, day: date):
+        return day.toordinal() * self.per_day
+
+    def slot_start(self, index: int):
+        day = date.fromordinal(index // self.per_day)
+        return datetime.combine(day, self.start) + (index % self.per_day) * self.duration
+
+    # [first, last) slot indexes of `days` days from `day`
+    def window(self, day: date, days: int):
+        return self.first_index(day), self.first_index(day + timedelta(days=days))
+
+
+DEFAULT_GRID = SlotGrid()
+
+
+# ----- SQL -----
+def minutes_of_day_sql(column):
+    return cast(extract("hour", column), Integer) * 60 + cast(extract("minute", column), Integer)
+
+
+# SlotGrid.index() of a datetime against a grid given as SQL (e.g. the Labs grid columns in a join),
+# and the test that it falls inside working hours; the index is only valid then
+def slot_index_sql(slot_datetime: datetime, start_minutes, slot_minutes, slots_per_day):
+    minutes = slot_datetime.hour * 60 + slot_datetime.minute
+    index = slot_datetime.date().toordinal() * slots_per_day + (minutes - start_minutes) // slot_minutes
+    within_working_hours = and_(start_minutes <= minutes, start_minutes + slots_per_day * slot_minutes > minutes)
+    return index, within_working_hours
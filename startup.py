@@ -0,0 +1,237 @@
+# Worker boot: schema check, parallel warm-up, readiness.
+#
+#   python -m startup --create-schema    # new database: create the tables at the Alembic head
+import argparse
+import asyncio
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+import catalog
+import db
+import hashing
+import live
+import metrics
+import models
+import occupancy
+from routers import instruments, lab
+
+# ----- CONFIG -----
+# Refuse to serve unless the database is at the newest Alembic revision; 0 skips the check
+SCHEMA_CHECK = os.getenv("SCHEMA_CHECK", "1") == "1"
+# How long a booting worker keeps retrying an unreachable database before giving up
+STARTUP_DB_WAIT_SECONDS = float(os.getenv("STARTUP_DB_WAIT_SECONDS", "30"))
+# /healthz/ready reports the database as down when SELECT 1 takes longer than this
+READY_TIMEOUT_SECONDS = float(os.getenv("READY_TIMEOUT_SECONDS", "2"))
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic")
+
+log = logging.getLogger("startup")
+
+state = SimpleNamespace(ready=False, timings={})  # timings: phase -> seconds, for the last boot
+
+
+# ----- SCHEMA -----
+_REVISION_LINE = re.compile(r"^(revision|down_revision)\b[^=\n]*=(.*)$", re.M)
+_REVISION_ID = re.compile(r"['\"](\w+)['\"]")
+
+
+# Head revision(s), read straight from alembic/versions: importing alembic would cost every worker ~170 ms
+def head_revisions():
+    revisions, parents = set(), set()
+    versions_dir = os.path.join(MIGRATIONS_DIR, "versions")
+    for name in os.listdir(versions_dir):
+        if not name.endswith(".py"):
+            continue
+        with open(os.path.join(versions_dir, name)) as f:
+            for key, value in _REVISION_LINE.findall(f.read()):
+                (revisions if key == "revision" else parents).update(_REVISION_ID.findall(value))
+    return revisions - parents
+
+
+def _connect(engine):
+    deadline = time.monotonic() + STARTUP_DB_WAIT_SECONDS
+    delay = 0.25
+    while True:
+        try:
+            return engine.connect()
+        except OperationalError as error:
+            if time.monotonic() + delay > deadline:
+                raise
+            log.warning("Database not reachable yet, retrying in %.2fs: %s", delay, error.orig)
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+
+
+def _current_revisions(connection):
+    try:
+        return set(connection.execute(text("SELECT version_num FROM alembic_version")).scalars())
+    except DBAPIError:
+        return None  # no version table
+
+
+# What the app's old import-time create_all left behind: the tables as of this revision, without alembic_version
+PRE_ALEMBIC_REVISION = "fa7335734eb3"
+
+
+# One query. Waits up to STARTUP_DB_WAIT_SECONDS for the database instead of failing the boot outright.
+def check_schema():
+    with _connect(db.engine) as connection:
+        if not SCHEMA_CHECK:
+            return
+        current = _current_revisions(connection)
+
+    expected = head_revisions()
+    if current is None:
+        raise RuntimeError(
+            "The database has no alembic_version table. If its tables were created by an older version of the app "
+            f"(create_all at import), run `alembic stamp {PRE_ALEMBIC_REVISION}` and then `alembic upgrade head`; "
+            "for an empty database run `python -m startup --create-schema`."
+        )
+    if current != expected:
+        raise RuntimeError(
+            f"The database schema is at revision {', '.join(sorted(current)) or '(none)'} but this code expects "
+            f"{', '.join(sorted(expected))}: run `alembic upgrade head` first."
+        )
+
+
+# The models describe the schema as of this revision; later ones (partitioning bookings on PostgreSQL)
+# only exist as migrations
+MODELS_REVISION = "3f9b2e7c4a15"
+
+
+# Tables from the models, stamped MODELS_REVISION, then the migrations after it, all on one connection in one
+# transaction (alembic/env.py runs on the connection passed in the config's attributes): on PostgreSQL, whose
+# DDL is transactional, a failed migration leaves the database empty rather than half created
+def create_schema(engine=None):
+    from alembic import command
+    from alembic.config import Config
+
+    engine = engine or db.engine
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    with engine.begin() as connection:
+        models.Base.metadata.create_all(bind=connection)
+        config.attributes["connection"] = connection
+        command.stamp(config, MODELS_REVISION)
+        command.upgrade(config, "heads")
+
+
+# ----- WARM-UP -----
+# Connects DB_POOL_SIZE connections at once, so the first requests don't each pay for a connection
+async def _warm_pool(engine):
+    if db.DB_MODE == "async":
+        connections = await asyncio.gather(*(engine.connect().start() for _ in range(db.DB_POOL_SIZE)))
+        await asyncio.gather(*(connection.close() for connection in connections))
+    else:
+        connections = await asyncio.gather(*(asyncio.to_thread(engine.connect) for _ in range(db.DB_POOL_SIZE)))
+        for connection in connections:
+            connection.close()
+
+
+async def _warm_pools():
+    if db.DB_MODE == "async":
+        engines = {db.async_engine, db.async_replica_engine}
+    else:
+        engines = {db.engine, db.replica_engine}
+    await asyncio.gather(*(_warm_pool(engine) for engine in engines))
+
+
+# On the primary: the catalog and the occupancy index are served to everyone, so a lagging replica's rows must not get in
+async def _in_session(fn):
+    if db.DB_MODE == "async":
+        async with db.AsyncSessionLocal() as session:
+            await session.run_sync(fn)
+    else:
+        def run():
+            with db.SessionLocal() as session:
+                fn(session)
+
+        await asyncio.to_thread(run)
+
+
+def _warm_catalog(session):
+    for key, build in (("labs", lab._catalog_labs), ("instruments", instruments._catalog_instruments)):
+        catalog_version = catalog.version()
+        catalog.store(key, catalog_version, build(session))
+
+
+async def _timed(phase: str, awaitable):
+    started = time.perf_counter()
+    result = await awaitable
+    state.timings[phase] = time.perf_counter() - started
+    metrics.STARTUP_SECONDS.labels(phase).set(state.timings[phase])
+    return result
+
+
+async def warm():
+    phases = {"pool": _warm_pools(), "catalog": _in_session(_warm_catalog)}
+    if occupancy.OCCUPANCY_INDEX_ENABLED:
+        phases["occupancy"] = _in_session(occupancy.index.warm)
+    await asyncio.gather(*(_timed(phase, awaitable) for phase, awaitable in phases.items()))
+
+
+# ----- LIFESPAN -----
+@asynccontextmanager
+async def lifespan(app):
+    started = time.perf_counter()
+    await _timed("schema", asyncio.to_thread(check_schema))
+    await _timed("warm", warm())
+    live.broker.start()
+    state.timings["total"] = time.perf_counter() - started
+    metrics.STARTUP_SECONDS.labels("total").set(state.timings["total"])
+    log.info("Ready in %.0f ms (%s)", state.timings["total"] * 1000, ", ".join(
+        f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in state.timings.items() if phase != "total"
+    ))
+    state.ready = True
+    try:
+        yield
+    finally:
+        state.ready = False
+        live.broker.stop()
+        hashing.shutdown()
+
+
+# ----- HEALTH -----
+async def ping():
+    if db.DB_MODE == "async":
+        async with db.async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+    else:
+        def run():
+            with db.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+
+        await asyncio.to_thread(run)
+
+
+# (ready, reason): booted, not shutting down, and the database answers
+async def readiness():
+    if not state.ready:
+        return False, "starting"
+    try:
+        await asyncio.wait_for(ping(), READY_TIMEOUT_SECONDS)
+    except Exception as error:
+        log.warning("Readiness check failed: %r", error)
+        return False, "database unavailable"
+    return True, "ready"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database setup for the API")
+    parser.add_argument("--create-schema", action="store_true", help="create the tables of a new database and stamp the Alembic head")
+    args = parser.parse_args(argv)
+    if not args.create_schema:
+        parser.error("nothing to do; pass --create-schema")
+    create_schema()
+    print(f"Created the schema at revision {', '.join(sorted(head_revisions()))} in {db.engine.url.render_as_string(hide_password=True)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import pytest
+
+# The app reads its configuration at import time: point it at a throwaway SQLite database first
+_db_dir = tempfile.mkdtemp(prefix="lab-booking-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_dir}/test.db"
+os.environ.pop("REPLICA_DATABASE_URL", None)
+os.environ.setdefault("HASH_WORKERS", "0")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# Tests fire requests back to back as one user; test_admission turns it on where it is under test
+os.environ.setdefault("ADMISSION_CONTROL", "0")
+# One process here, so the occupancy index is safe to use (it is off by default)
+os.environ.setdefault("OCCUPANCY_INDEX", "1")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import catalog
+import db
+import hashing
+import main
+import models
+import oauth2
+import slots
+import startup
+
+PASSWORD = "password"
+
+# Statements an authenticated route may add on top of its own: the principal lookup
+AUTH_QUERIES = 1
+
+
+# ----- QUERY COUNTING -----
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __str__(self):
+        return "\n".join(f"  {n}. {statement}" for n, statement in enumerate(self.statements, start=1))
+
+
+def _engines():
+    engines = {db.engine, db.replica_engine}
+    if db.async_engine is not None:
+        engines |= {db.async_engine.sync_engine, db.async_replica_engine.sync_engine}
+    return engines
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    for engine in _engines():
+        event.listen(engine, "before_cursor_execute", counter._record)
+    try:
+        yield counter
+    finally:
+        for engine in _engines():
+            event.remove(engine, "before_cursor_execute", counter._record)
+
+
+# Fails when the block runs more than `budget` statements, listing the ones it ran
+@contextmanager
+def assert_max_queries(budget: int):
+    with count_queries() as counter:
+        yield counter
+    assert counter.count <= budget, f"expected at most {budget} queries, got {counter.count}:\n{counter}"
+
+
+@pytest.fixture(autouse=True)
+def cold_caches():
+    # Every request pays for its lookups: no cached principals or catalog responses
+    oauth2._principals.clear()
+    catalog.bump()
+    yield
+
+
+# ----- DATA -----
+@pytest.fixture(scope="session")
+def seeded():
+    models.Base.metadata.drop_all(bind=db.engine)
+    startup.create_schema()
+    hashed_password = hashing.pwd_context.hash(PASSWORD)
+
+    with db.SessionLocal() as session:
+        admin = models.User(username="admin", password=hashed_password, privilege_level=models.PrivilegeLevelEnum.admin)
+        user = models.User(username="user", password=hashed_password, privilege_level=models.PrivilegeLevelEnum.user)
+        lab = models.Labs(name="Lab A")
+        session.add_all([admin, user, lab])
+        session.flush()
+
+        instruments = [
+            models.Instrument(instrument_name="Microscope", lab_id=lab.id, working=True),
+            models.Instrument(instrument_name="Microscope", lab_id=lab.id, working=True),
+            models.Instrument(instrument_name="Microscope", lab_id=lab.id, working=False),
+            models.Instrument(instrument_name="Centrifuge", lab_id=lab.id, working=True),
+        ]
+        session.add_all(instruments)
+        session.flush()
+
+        # 60 bookings for `user` spread over the past and the availability window
+        grid = slots.DEFAULT_GRID
+        first_index = grid.first_index(date.today() - timedelta(days=10))
+        for n in range(60):
+            session.add(models.Booking(
+                instrument_id=instruments[n % 2].instrument_id,
+                slot=grid.slot_start(first_index + n),
+                slot_index=first_index + n,
+                requested_by_id=user.id,
+                requested_to_id=admin.id,
+                status=models.BookingStatusEnum.pending
+            ))
+        session.commit()
+
+        return {
+            "admin_id": admin.id,
+            "user_id": user.id,
+            "lab_id": lab.id,
+            "instrument_ids": [instrument.instrument_id for instrument in instruments],
+        }
+
+
+@pytest.fixture(scope="session")
+def client(seeded):
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _auth(user_id: int):
+    return {"Authorization": f"Bearer {oauth2.create_access_token(data={'user_id': user_id})}"}
+
+
+@pytest.fixture(scope="session")
+def admin_headers(seeded):
+    return _auth(seeded["admin_id"])
+
+
+@pytest.fixture(scope="session")
+def user_headers(seeded):
+    return _auth(seeded["user_id"])
+
+
+def future_slot(days: int, position: int = 0):
+    grid = slots.DEFAULT_GRID
+    return datetime.combine(date.today() + timedelta(days=days), grid.start) + position * grid.duration
@@ -0,0 +1,119 @@
+# Bursts are turned away with 429/503 + Retry-After before they reach the connection pool
+import asyncio
+
+import pytest
+
+import admission
+import db
+
+AVAILABILITY = "/bookings/availability/Lab A/Microscope"
+
+
+@pytest.fixture
+def admission_on(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL", True)
+    monkeypatch.setattr(admission, "backend", admission.MemoryBackend())
+    monkeypatch.setitem(admission.RATE_LIMITS, "availability", (0.1, 2))
+
+
+def test_rate_limited_per_user(client, admission_on, user_headers, admin_headers):
+    assert client.get(AVAILABILITY, headers=user_headers).status_code == 200
+    assert client.get(AVAILABILITY, headers=user_headers).status_code == 200
+
+    response = client.get(AVAILABILITY, headers=user_headers)
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 10
+
+    # Someone else's bucket is untouched
+    assert client.get(AVAILABILITY, headers=admin_headers).status_code == 200
+
+
+def test_anonymous_callers_not_rate_limited_by_default(client, admission_on):
+    for _ in range(3):
+        assert client.get(AVAILABILITY).status_code == 200
+
+
+def test_anonymous_callers_keyed_on_forwarded_for(client, admission_on, monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_LIMIT_ANONYMOUS", True)
+    monkeypatch.setattr(admission, "ADMISSION_FORWARDED_FOR_HEADER", "X-Forwarded-For")
+    student = {"X-Forwarded-For": "203.0.113.9, 10.0.0.1"}
+    for _ in range(2):
+        assert client.get(AVAILABILITY, headers=student).status_code == 200
+    assert client.get(AVAILABILITY, headers=student).status_code == 429
+    assert client.get(AVAILABILITY, headers={"X-Forwarded-For": "10.0.0.2"}).status_code == 200
+
+
+def test_busy_pool(client, admission_on, monkeypatch, user_headers):
+    limiter = admission.PoolLimiter("replica", 1)
+    monkeypatch.setitem(admission.limiters, "replica", limiter)
+    monkeypatch.setattr(admission, "ADMISSION_MAX_WAITING", 0)
+    asyncio.run(limiter.acquire())
+
+    response = client.get(AVAILABILITY, headers=user_headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(admission.ADMISSION_RETRY_AFTER_SECONDS)
+
+    limiter.release()
+    assert client.get(AVAILABILITY, headers=user_headers).status_code == 200
+    assert limiter.in_flight == 0
+
+
+def test_export_counts_against_the_replica_pool(client, admission_on, monkeypatch, admin_headers):
+    limiter = admission.PoolLimiter("replica", 1)
+    monkeypatch.setitem(admission.limiters, "replica", limiter)
+    monkeypatch.setattr(admission, "ADMISSION_MAX_WAITING", 0)
+    asyncio.run(limiter.acquire())
+    assert client.get("/bookings/export", headers=admin_headers).status_code == 503
+
+    limiter.release()
+    assert client.get("/bookings/export", headers=admin_headers).status_code == 200
+    assert limiter.in_flight == 0
+
+
+def test_pool_limiter_hands_slots_to_waiters(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_MAX_WAITING", 1)
+    monkeypatch.setattr(admission, "ADMISSION_WAIT_SECONDS", 0.05)
+    limiter = admission.PoolLimiter("primary", 1)
+
+    async def scenario():
+        assert await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not await limiter.acquire()  # one waiting already
+        limiter.release()
+        assert await waiter
+        assert not await limiter.acquire()  # timed out
+        limiter.release()
+
+    asyncio.run(scenario())
+    assert limiter.in_flight == 0 and limiter.waiting == 0
+
+
+@pytest.fixture
+def separate_pools(admission_on, monkeypatch):
+    pools = {"primary": admission.PoolLimiter("primary", 1), "replica": admission.PoolLimiter("replica", 1)}
+    for name, limiter in pools.items():
+        monkeypatch.setitem(admission.limiters, name, limiter)
+    monkeypatch.setattr(admission, "ADMISSION_MAX_WAITING", 0)
+    yield pools
+    assert all(limiter.in_flight == 0 for limiter in pools.values())
+
+
+# get_current_user's session is on the primary: a signed-in replica read needs a slot of both
+def test_signed_in_replica_reads_count_the_primary(client, separate_pools, user_headers):
+    asyncio.run(separate_pools["primary"].acquire())
+    assert client.get("/bookings/me", headers=user_headers).status_code == 503
+    assert separate_pools["replica"].in_flight == 0  # the replica slot it got is given back
+
+    separate_pools["primary"].release()
+    assert client.get("/bookings/me", headers=user_headers).status_code == 200
+
+
+def test_reads_sent_to_the_primary_count_the_primary(client, separate_pools):
+    asyncio.run(separate_pools["primary"].acquire())
+    assert client.get(AVAILABILITY).status_code == 200
+    cookie = {"Cookie": f"{db.READ_PRIMARY_COOKIE}=1"}
+    assert client.get(AVAILABILITY, headers=cookie).status_code == 503
+
+    separate_pools["primary"].release()
+    assert client.get(AVAILABILITY, headers=cookie).status_code == 200
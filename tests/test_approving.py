@@ -0,0 +1,86 @@
+# Batch approve/reject: the per-id report and conflicting re-activations
+import pytest
+
+import db
+import models
+import occupancy
+import slots
+from conftest import AUTH_QUERIES, PASSWORD, assert_max_queries, future_slot
+
+GRID = slots.DEFAULT_GRID
+
+
+@pytest.fixture(scope="module")
+def other_supervisor(seeded):
+    with db.SessionLocal() as session:
+        prof = models.User(username="other-supervisor", password=PASSWORD, privilege_level=models.PrivilegeLevelEnum.admin)
+        session.add(prof)
+        session.commit()
+        return prof.id
+
+
+def _booking(seeded, day: int, position: int, status="pending", requested_to_id=None):
+    slot = future_slot(day, position)
+    with db.SessionLocal() as session:
+        booking = models.Booking(
+            instrument_id=seeded["instrument_ids"][0],
+            slot=slot,
+            slot_index=GRID.index(slot),
+            requested_by_id=seeded["user_id"],
+            requested_to_id=requested_to_id or seeded["admin_id"],
+            status=models.BookingStatusEnum(status)
+        )
+        session.add(booking)
+        session.commit()
+        occupancy.booking_changed(booking.id, booking.instrument_id, booking.slot_index, booking.status)
+        return booking.id
+
+
+def _statuses(*booking_ids):
+    with db.SessionLocal() as session:
+        rows = session.query(models.Booking.id, models.Booking.status).filter(models.Booking.id.in_(booking_ids))
+        return {booking_id: status.value for booking_id, status in rows}
+
+
+def _decide(client, admin_headers, decisions):
+    payload = {"decisions": [{"booking_id": booking_id, "status": status} for booking_id, status in decisions]}
+    response = client.put("/approving/decisions", json=payload, headers=admin_headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_batch_is_one_update(client, seeded, admin_headers):
+    first, second = _booking(seeded, 86, 0), _booking(seeded, 86, 1)
+    with assert_max_queries(AUTH_QUERIES + 1):  # update ... returning
+        report = _decide(client, admin_headers, [(first, "approved"), (second, "rejected")])
+    assert report == {"applied": [first, second], "not_found": [], "forbidden": [], "conflicts": []}
+    assert _statuses(first, second) == {first: "approved", second: "rejected"}
+
+
+def test_batch_reports_missing_and_forbidden_ids(client, seeded, admin_headers, other_supervisor):
+    mine, theirs = _booking(seeded, 86, 2), _booking(seeded, 86, 3, requested_to_id=other_supervisor)
+    with assert_max_queries(AUTH_QUERIES + 2):  # update ... returning, then which of the rest exist
+        report = _decide(client, admin_headers, [(999999, "approved"), (theirs, "approved"), (mine, "approved")])
+    assert report == {"applied": [mine], "not_found": [999999], "forbidden": [theirs], "conflicts": []}
+    assert _statuses(mine, theirs) == {mine: "approved", theirs: "pending"}
+
+
+def test_batch_reports_reactivations_of_taken_slots(client, seeded, admin_headers):
+    rejected, holder = _booking(seeded, 87, 0, "rejected"), _booking(seeded, 87, 0)
+    # two rejected bookings of one free slot: the first one re-activated gets it
+    first, second = _booking(seeded, 87, 1, "rejected"), _booking(seeded, 87, 1, "rejected")
+    other = _booking(seeded, 87, 2)
+
+    report = _decide(client, admin_headers, [(rejected, "approved"), (first, "pending"), (second, "approved"), (other, "approved")])
+    assert report == {"applied": [first, other], "not_found": [], "forbidden": [], "conflicts": [rejected, second]}
+    assert _statuses(rejected, holder, first, second, other) == {
+        rejected: "rejected", holder: "pending", first: "pending", second: "rejected", other: "approved"
+    }
+
+
+# A slot the batch frees can be taken by a booking the same batch re-activates
+def test_batch_can_swap_a_slot(client, seeded, admin_headers):
+    holder, rejected = _booking(seeded, 87, 3), _booking(seeded, 87, 3, "rejected")
+    report = _decide(client, admin_headers, [(rejected, "approved"), (holder, "rejected")])
+    assert report == {"applied": [rejected, holder], "not_found": [], "forbidden": [], "conflicts": []}
+    assert _statuses(holder, rejected) == {holder: "rejected", rejected: "approved"}
@@ -0,0 +1,177 @@
+# Booking routes' behaviour (query budgets are in test_query_counts)
+import asyncio
+import csv
+import io
+import json
+from datetime import timedelta
+
+from sqlalchemy import event, select
+
+import db
+import models
+from routers import booking
+from conftest import future_slot
+
+
+def _batch(seeded, slots):
+    return {
+        "instrument_id": seeded["instrument_ids"][3],
+        "requested_to_id": seeded["admin_id"],
+        "slots": [slot.isoformat() for slot in slots],
+    }
+
+
+def _active_bookings(seeded, slots):
+    with db.SessionLocal() as session:
+        return session.query(models.Booking.slot).filter(
+            models.Booking.instrument_id == seeded["instrument_ids"][3],
+            models.Booking.slot.in_(slots),
+            models.Booking.status.in_(models.ACTIVE_BOOKING_STATUSES)
+        ).count()
+
+
+# ----- BATCH CREATE -----
+def test_batch_reports_each_slot(client, seeded, user_headers):
+    taken, free, same_slot, last = future_slot(80), future_slot(80, 1), future_slot(80, 1) + timedelta(minutes=30), future_slot(81, 2)
+    single = {"instrument_id": seeded["instrument_ids"][3], "slot": taken.isoformat(), "requested_to_id": seeded["admin_id"]}
+    assert client.post("/bookings/", json=single, headers=user_headers).status_code == 200
+
+    response = client.post("/bookings/batch", json=_batch(seeded, [taken, free, same_slot, last]), headers=user_headers)
+    assert response.status_code == 200
+    report = response.json()
+    created = [result["booking"] for result in report["results"] if result["booking"]]
+
+    def booking(slot, result):
+        return {
+            "instrument_id": seeded["instrument_ids"][3],
+            "slot": slot.isoformat(),
+            "requested_to_id": seeded["admin_id"],
+            "status": "pending",
+            "requested_by_id": seeded["user_id"],
+            "id": result["id"],
+        }
+
+    assert report == {
+        "created": 2,
+        "conflicts": 2,
+        "results": [
+            {"slot": taken.isoformat(), "status": "conflict", "booking": None},
+            {"slot": free.isoformat(), "status": "created", "booking": booking(free, created[0])},
+            # inside the slot just booked by this batch
+            {"slot": same_slot.isoformat(), "status": "conflict", "booking": None},
+            {"slot": last.isoformat(), "status": "created", "booking": booking(last, created[1])},
+        ],
+    }
+    assert _active_bookings(seeded, [taken, free, same_slot, last]) == 3
+
+
+def test_batch_all_taken(client, seeded, user_headers):
+    slots = [future_slot(82), future_slot(83)]
+    assert client.post("/bookings/batch", json=_batch(seeded, slots), headers=user_headers).json()["created"] == 2
+
+    report = client.post("/bookings/batch", json=_batch(seeded, slots), headers=user_headers).json()
+    assert report == {
+        "created": 0,
+        "conflicts": 2,
+        "results": [{"slot": slot.isoformat(), "status": "conflict", "booking": None} for slot in slots],
+    }
+
+
+# Nothing is booked when any requested time is off the lab's grid
+def test_batch_with_a_slot_outside_lab_hours_books_nothing(client, seeded, user_headers):
+    inside, outside = future_slot(84), future_slot(84) - timedelta(hours=1)
+    response = client.post("/bookings/batch", json=_batch(seeded, [inside, outside]), headers=user_headers)
+    assert response.status_code == 400
+    assert response.json() == {"detail": f"Outside the lab's booking slots: {outside.isoformat()}"}
+    assert _active_bookings(seeded, [inside]) == 0
+
+
+def test_batch_validation(client, seeded, user_headers):
+    payload = _batch(seeded, [future_slot(85)])
+    assert client.post("/bookings/batch", json={**payload, "instrument_id": 999999}, headers=user_headers).status_code == 404
+    assert client.post("/bookings/batch", json={**payload, "slots": []}, headers=user_headers).status_code == 422
+    recurrence = {"start": future_slot(85).isoformat(), "interval_days": 1, "count": 2}
+    assert client.post("/bookings/batch", json={**payload, "recurrence": recurrence}, headers=user_headers).status_code == 422
+
+
+# ----- EXPORT -----
+def _exported(**filters):
+    with db.SessionLocal() as session:
+        query = session.query(models.Booking).order_by(models.Booking.id)
+        if "user_id" in filters:
+            query = query.filter(models.Booking.requested_by_id == filters["user_id"])
+        if "instrument_id" in filters:
+            query = query.filter(models.Booking.instrument_id == filters["instrument_id"])
+        if "slot_from" in filters:
+            query = query.filter(models.Booking.slot >= filters["slot_from"])
+        if "slot_to" in filters:
+            query = query.filter(models.Booking.slot <= filters["slot_to"])
+        return [
+            {
+                "instrument_id": row.instrument_id,
+                "slot": row.slot.isoformat(),
+                "requested_to_id": row.requested_to_id,
+                "status": row.status.value,
+                "requested_by_id": row.requested_by_id,
+                "id": row.id,
+            }
+            for row in query
+        ]
+
+
+def test_export_ndjson(client, seeded, admin_headers):
+    response = client.get("/bookings/export", headers=admin_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"] == 'attachment; filename="bookings.ndjson"'
+    assert [json.loads(line) for line in response.text.splitlines()] == _exported()
+
+
+def test_export_csv_with_filters(client, seeded, admin_headers):
+    filters = {
+        "user_id": seeded["user_id"],
+        "instrument_id": seeded["instrument_ids"][0],
+        "slot_from": future_slot(-5),
+        "slot_to": future_slot(2),
+    }
+    params = {**filters, "format": "csv", "slot_from": filters["slot_from"].isoformat(), "slot_to": filters["slot_to"].isoformat()}
+    response = client.get("/bookings/export", params=params, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+
+    expected = _exported(**filters)
+    assert expected and len(expected) < len(_exported())
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert rows == [{column: str(value) for column, value in row.items()} for row in expected]
+
+
+def test_export_rejects_unknown_formats_and_non_admins(client, admin_headers, user_headers):
+    assert client.get("/bookings/export", params={"format": "xml"}, headers=admin_headers).status_code == 422
+    assert client.get("/bookings/export", headers=user_headers).status_code == 403
+
+
+# One chunk per EXPORT_BATCH_SIZE rows, read through a server-side cursor (yield_per) rather than all at once
+def test_export_streams_in_batches(seeded, monkeypatch):
+    monkeypatch.setattr(booking, "EXPORT_BATCH_SIZE", 7)
+    table = models.Booking.__table__
+    query = select(*(table.c[column] for column in booking.EXPORT_COLUMNS)).order_by(table.c.id)
+    execution_options = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        execution_options.append(context.execution_options)
+
+    engine = db.async_replica_engine.sync_engine if db.DB_MODE == "async" else db.replica_engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        if db.DB_MODE == "async":
+            async def collect():
+                return [chunk async for chunk in booking._export_rows_async(query, "ndjson")]
+            chunks = asyncio.run(collect())
+        else:
+            chunks = list(booking._export_rows(query, "ndjson"))
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    total = len(_exported())
+    assert [chunk.count("\n") for chunk in chunks] == [7] * (total // 7) + ([total % 7] if total % 7 else [])
+    assert [options.get("yield_per") for options in execution_options] == [7]
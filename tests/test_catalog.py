@@ -0,0 +1,74 @@
+# Cached catalog responses: ETag, If-None-Match -> 304, and a new ETag after every lab/instrument write
+import pytest
+
+from conftest import assert_max_queries
+
+CATALOG_URLS = ["/labs/", "/instruments/", "/labs/{lab_id}/instruments"]
+
+
+def _get(client, seeded, url, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.get(url.format(lab_id=seeded["lab_id"]), headers=headers)
+
+
+@pytest.mark.parametrize("url", CATALOG_URLS)
+def test_etag_and_not_modified(client, seeded, url):
+    response = _get(client, seeded, url)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert etag.startswith('"') and response.headers["Cache-Control"] == "no-cache"
+
+    with assert_max_queries(0):
+        for if_none_match in [etag, f"W/{etag}", f'"other", {etag}', "*"]:
+            not_modified = _get(client, seeded, url, if_none_match)
+            assert not_modified.status_code == 304 and not_modified.content == b""
+            assert not_modified.headers["ETag"] == etag
+
+    stale = _get(client, seeded, url, '"stale"')
+    assert stale.status_code == 200 and stale.content == response.content
+
+
+INSTRUMENT_URLS = ["/instruments/", "/labs/{lab_id}/instruments"]
+
+
+def _etags(client, seeded, urls):
+    return {url: _get(client, seeded, url).headers["ETag"] for url in urls}
+
+
+def _revalidates(client, seeded, etags):
+    # The cached responses were dropped and rebuilt: the old ETag no longer gets a 304
+    for url, etag in etags.items():
+        response = _get(client, seeded, url, etag)
+        assert response.status_code == 200, url
+        assert response.headers["ETag"] != etag, url
+
+
+def test_instrument_writes_change_the_etag(client, seeded, admin_headers):
+    labs_etag = _get(client, seeded, "/labs/").headers["ETag"]
+    etags = _etags(client, seeded, INSTRUMENT_URLS)
+    payload = {"instrument_name": "Spectrometer", "lab_id": seeded["lab_id"], "working": True}
+    response = client.post("/instruments/", json=payload, headers=admin_headers)
+    assert response.status_code == 200
+    instrument_id = response.json()["instrument_id"]
+    _revalidates(client, seeded, etags)
+    # The ETag is the content's: /labs/ is fetched again but didn't change, so it still revalidates
+    assert _get(client, seeded, "/labs/", labs_etag).status_code == 304
+    assert any(i["instrument_id"] == instrument_id for i in _get(client, seeded, "/instruments/").json())
+
+    etags = _etags(client, seeded, INSTRUMENT_URLS)
+    response = client.put(f"/instruments/{instrument_id}", json={**payload, "working": False}, headers=admin_headers)
+    assert response.status_code == 200
+    _revalidates(client, seeded, etags)
+
+    etags = _etags(client, seeded, INSTRUMENT_URLS)
+    assert client.delete(f"/instruments/{instrument_id}", headers=admin_headers).status_code == 200
+    _revalidates(client, seeded, etags)
+    assert all(i["instrument_id"] != instrument_id for i in _get(client, seeded, "/instruments/").json())
+
+
+def test_lab_writes_change_the_etag(client, seeded):
+    etag = _get(client, seeded, "/labs/").headers["ETag"]
+    assert client.post("/labs/", json={"name": "Lab ETag"}).status_code == 200
+    response = _get(client, seeded, "/labs/", etag)
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+    assert "Lab ETag" in [lab["name"] for lab in response.json()]
@@ -0,0 +1,45 @@
+# DB_MODE is read at import time: the rest of the suite runs in one mode, and this runs the route
+# tests again in async mode (aiosqlite) in a pytest of its own
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import event
+
+import db
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# Booking, approval and catalog routes, plus the checks below
+ROUTE_TESTS = ["test_query_counts.py", "test_db_modes.py"]
+
+
+@pytest.mark.skipif(db.DB_MODE == "async", reason="already running in async mode")
+def test_routes_in_async_mode():
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", *ROUTE_TESTS],
+        cwd=TESTS_DIR, env={**os.environ, "DB_MODE": "async"}, capture_output=True, text=True, timeout=300
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+@pytest.mark.skipif(db.DB_MODE != "async", reason="async mode only")
+def test_routes_use_the_async_engine(client, user_headers, admin_headers):
+    statements = {"sync": 0, "async": 0}
+
+    def on_sync(*args):
+        statements["sync"] += 1
+
+    def on_async(*args):
+        statements["async"] += 1
+
+    event.listen(db.engine, "before_cursor_execute", on_sync)
+    event.listen(db.async_engine.sync_engine, "before_cursor_execute", on_async)
+    try:
+        assert client.get("/bookings/me", headers=user_headers).status_code == 200
+        assert client.get("/approving/to_approve", headers=admin_headers).status_code == 200
+        assert client.get("/instruments/").status_code == 200
+    finally:
+        event.remove(db.engine, "before_cursor_execute", on_sync)
+        event.remove(db.async_engine.sync_engine, "before_cursor_execute", on_async)
+    assert statements["sync"] == 0 and statements["async"] >= 3
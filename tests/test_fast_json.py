@@ -0,0 +1,50 @@
+# FAST_JSON must not change a single byte of what the hot list endpoints send
+import pytest
+
+import catalog
+import serialization
+from conftest import AUTH_QUERIES, assert_max_queries
+
+
+def _fetch(client, monkeypatch, fast: bool, url: str, params=None, headers=None):
+    monkeypatch.setattr(serialization, "FAST_JSON", fast)
+    catalog.bump()
+    response = client.get(url, params=params, headers=headers)
+    assert response.status_code == 200
+    return response
+
+
+@pytest.mark.parametrize("params", [
+    {"limit": 50},
+    {"limit": 5, "offset": 3},
+    {"limit": 10, "lab_name": "Lab A", "instrument_name": "Microscope"},
+    {"limit": 50, "include_history": True},
+])
+def test_my_bookings(client, monkeypatch, user_headers, params):
+    standard = _fetch(client, monkeypatch, False, "/bookings/me", params, user_headers)
+    fast = _fetch(client, monkeypatch, True, "/bookings/me", params, user_headers)
+    assert fast.content == standard.content
+    assert fast.headers.get("X-Next-Cursor") == standard.headers.get("X-Next-Cursor")
+
+
+@pytest.mark.parametrize("params", [{"limit": 100}, {"limit": 10, "skip": 5}, {"limit": 100, "include_history": True}])
+def test_all_bookings(client, monkeypatch, admin_headers, params):
+    standard = _fetch(client, monkeypatch, False, "/bookings/", params, admin_headers)
+    fast = _fetch(client, monkeypatch, True, "/bookings/", params, admin_headers)
+    assert fast.content == standard.content
+    assert fast.headers.get("X-Next-Cursor") == standard.headers.get("X-Next-Cursor")
+
+
+@pytest.mark.parametrize("url", ["/instruments/", "/labs/"])
+def test_catalog(client, monkeypatch, url):
+    standard = _fetch(client, monkeypatch, False, url)
+    fast = _fetch(client, monkeypatch, True, url)
+    assert fast.content == standard.content
+    assert fast.headers["ETag"] == standard.headers["ETag"]
+
+
+def test_my_bookings_fast_path_is_one_query(client, monkeypatch, user_headers):
+    monkeypatch.setattr(serialization, "FAST_JSON", True)
+    with assert_max_queries(AUTH_QUERIES + 1):
+        response = client.get("/bookings/me", params={"limit": 50, "include_history": True}, headers=user_headers)
+    assert len(response.json()) == 50
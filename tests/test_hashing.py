@@ -0,0 +1,70 @@
+# bcrypt off the event loop: the process pool, the bounded queue in front of it and rehash-on-login
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+import db
+import hashing
+import models
+from conftest import PASSWORD
+
+
+@pytest.fixture
+def process_pool(monkeypatch):
+    monkeypatch.setattr(hashing, "HASH_WORKERS", 1)
+    monkeypatch.setattr(hashing, "_executor", None)
+    yield
+    hashing.shutdown()
+
+
+def test_signup_and_login_on_the_process_pool(client, process_pool):
+    credentials = {"username": "pool-user", "password": PASSWORD}
+    assert client.post("/user/signup", json={**credentials, "privilege_level": "user"}).status_code == 200
+    assert isinstance(hashing._executor, ProcessPoolExecutor)
+    assert client.post("/user/login", data=credentials).status_code == 200
+    assert client.post("/user/login", data={**credentials, "password": "wrong"}).status_code == 403
+
+
+def test_full_queue_is_rejected(monkeypatch):
+    monkeypatch.setattr(hashing, "HASH_QUEUE_SIZE", 1)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(hashing._submit("hash", release.wait, 5))
+        await asyncio.sleep(0)
+        assert hashing._in_flight == 1
+        with pytest.raises(HTTPException) as rejected:
+            await hashing.hash_password(PASSWORD)
+        release.set()
+        await running
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.status_code == 503 and rejected.headers == {"Retry-After": str(hashing.HASH_RETRY_AFTER_SECONDS)}
+    assert hashing._in_flight == 0
+
+
+def test_login_while_saturated_is_503(client, monkeypatch):
+    monkeypatch.setattr(hashing, "_in_flight", hashing.HASH_QUEUE_SIZE)
+    response = client.post("/user/login", data={"username": "user", "password": PASSWORD})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(hashing.HASH_RETRY_AFTER_SECONDS)
+
+
+def test_login_rehashes_an_outdated_cost_factor(client):
+    old_hash = hashing.pwd_context.hash(PASSWORD, rounds=hashing.BCRYPT_ROUNDS + 1)
+    with db.SessionLocal() as session:
+        user = models.User(username="old-cost", password=old_hash, privilege_level=models.PrivilegeLevelEnum.user)
+        session.add(user)
+        session.commit()
+        user_id = user.id
+
+    assert client.post("/user/login", data={"username": "old-cost", "password": PASSWORD}).status_code == 200
+    with db.SessionLocal() as session:
+        new_hash = session.get(models.User, user_id).password
+    assert new_hash != old_hash
+    assert not hashing.pwd_context.needs_update(new_hash)
+    assert hashing.pwd_context.verify(PASSWORD, new_hash)
@@ -0,0 +1,46 @@
+# Instrument updates: moving to another lab is refused while the instrument has active bookings
+import pytest
+
+import db
+import models
+from conftest import future_slot
+
+
+@pytest.fixture(scope="module")
+def other_lab(client):
+    response = client.post("/labs/", json={"name": "Lab Moves"})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def _lab_of(instrument_id: int):
+    with db.SessionLocal() as session:
+        return session.get(models.Instrument, instrument_id).lab_id
+
+
+def test_move_is_refused_while_bookings_are_active(client, seeded, other_lab, admin_headers, user_headers):
+    payload = {"instrument_name": "Rheometer", "lab_id": seeded["lab_id"], "working": True}
+    instrument_id = client.post("/instruments/", json=payload, headers=admin_headers).json()["instrument_id"]
+    booking = {"instrument_id": instrument_id, "slot": future_slot(88).isoformat(), "requested_to_id": seeded["admin_id"]}
+    booking_id = client.post("/bookings/", json=booking, headers=user_headers).json()["id"]
+
+    moved = {**payload, "lab_id": other_lab}
+    response = client.put(f"/instruments/{instrument_id}", json=moved, headers=admin_headers)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "This instrument has active bookings and cannot be moved to another lab."}
+    assert _lab_of(instrument_id) == seeded["lab_id"]
+
+    # Anything else can still change
+    response = client.put(f"/instruments/{instrument_id}", json={**payload, "working": False}, headers=admin_headers)
+    assert response.status_code == 200 and response.json()["working"] is False
+
+    # Once no booking holds a slot in the old lab's grid, it can move
+    decision = client.put(f"/approving/{booking_id}/decision", json={"status": "rejected"}, headers=admin_headers)
+    assert decision.status_code == 200
+    response = client.put(f"/instruments/{instrument_id}", json=moved, headers=admin_headers)
+    assert response.status_code == 200 and response.json()["lab_id"] == other_lab
+
+
+def test_update_missing_instrument(client, seeded, other_lab, admin_headers):
+    payload = {"instrument_name": "Nothing", "lab_id": other_lab, "working": True}
+    assert client.put("/instruments/999999", json=payload, headers=admin_headers).status_code == 404
@@ -0,0 +1,237 @@
+# Live availability (live.broker): snapshots, deltas, resyncs and the LISTEN/NOTIFY payloads of peers
+import asyncio
+import json
+from datetime import date, timedelta
+
+import pytest
+
+import catalog
+import db
+import live
+import models
+import occupancy
+import slots
+
+GRID = slots.DEFAULT_GRID
+DAYS = 60
+LAB, INSTRUMENT = "Live Lab", "Spectrometer"
+# Far enough out that no other test books these slots
+FIRST_SLOT = GRID.first_index(date.today() + timedelta(days=50))
+
+
+@pytest.fixture(scope="module")
+def live_lab(client):
+    with db.SessionLocal() as session:
+        lab = models.Labs(name=LAB)
+        session.add(lab)
+        session.flush()
+        instruments = [models.Instrument(instrument_name=INSTRUMENT, lab_id=lab.id, working=True) for _ in range(2)]
+        session.add_all(instruments)
+        session.commit()
+        occupancy.lab_changed(lab.id, lab.name, slots.SlotGrid.for_lab(lab))
+        for instrument in instruments:
+            occupancy.instrument_changed(instrument.instrument_id, instrument.instrument_name, lab.id, True)
+        catalog.bump()
+        return {"lab_id": lab.id, "instrument_ids": [instrument.instrument_id for instrument in instruments]}
+
+
+# The app's broker, detached from the TestClient's event loop: each test runs its own
+@pytest.fixture
+def broker(monkeypatch, live_lab):
+    monkeypatch.setattr(live.broker, "_loop", None)
+    monkeypatch.setattr(live.broker, "_topics", {})
+    return live.broker
+
+
+def _insert_booking(seeded, instrument_id: int, slot_index: int):
+    with db.SessionLocal() as session:
+        booking = models.Booking(
+            instrument_id=instrument_id,
+            slot=GRID.slot_start(slot_index),
+            slot_index=slot_index,
+            requested_by_id=seeded["user_id"],
+            requested_to_id=seeded["admin_id"],
+            status=models.BookingStatusEnum.pending
+        )
+        session.add(booking)
+        session.commit()
+        return booking.id
+
+
+# What a write route does: commit, then announce
+def _book(seeded, instrument_id: int, slot_index: int):
+    booking_id = _insert_booking(seeded, instrument_id, slot_index)
+    occupancy.booking_changed(booking_id, instrument_id, slot_index, models.BookingStatusEnum.pending)
+
+
+def _entry(slot_index: int, available: int):
+    return occupancy.availability_entry(GRID, slot_index, 2, 2 - available)
+
+
+async def _next(subscription):
+    return await asyncio.wait_for(subscription.queue.get(), 5)
+
+
+async def _assert_quiet(subscription):
+    await asyncio.sleep(0.1)
+    assert subscription.queue.empty()
+
+
+def test_snapshot_matches_get_availability(client, broker):
+    expected = client.get(f"/bookings/availability/{LAB}/{INSTRUMENT}", params={"days": DAYS}).json()
+
+    async def scenario():
+        subscription, snapshot = await broker.subscribe(LAB, INSTRUMENT, DAYS)
+        broker.unsubscribe(subscription)
+        return snapshot
+
+    assert asyncio.run(scenario()) == expected
+
+
+def test_one_booking_sends_one_delta(seeded, broker, live_lab):
+    slot_index = FIRST_SLOT
+
+    async def scenario():
+        subscription, snapshot = await broker.subscribe(LAB, INSTRUMENT, DAYS)
+        _book(seeded, live_lab["instrument_ids"][0], slot_index)
+        assert await _next(subscription) == ("delta", [_entry(slot_index, 1)])
+        await _assert_quiet(subscription)
+        broker.unsubscribe(subscription)
+
+    asyncio.run(scenario())
+
+
+def test_changes_are_coalesced(seeded, broker, live_lab):
+    slot_indexes = [FIRST_SLOT + 4, FIRST_SLOT + 5]
+
+    async def scenario():
+        subscription, snapshot = await broker.subscribe(LAB, INSTRUMENT, DAYS)
+        for slot_index in slot_indexes:
+            _book(seeded, live_lab["instrument_ids"][0], slot_index)
+        assert await _next(subscription) == ("delta", [_entry(slot_index, 1) for slot_index in slot_indexes])
+        await _assert_quiet(subscription)
+        broker.unsubscribe(subscription)
+
+    asyncio.run(scenario())
+
+
+# A change committed after the snapshot was read, but before subscribe() returned, still arrives
+def test_changes_during_the_snapshot_are_not_lost(seeded, broker, live_lab, monkeypatch):
+    slot_index = FIRST_SLOT + 8
+    load_snapshot = live._load_snapshot
+
+    def load_then_book(*key):
+        loaded = load_snapshot(*key)
+        _book(seeded, live_lab["instrument_ids"][0], slot_index)
+        return loaded
+
+    monkeypatch.setattr(live, "_load_snapshot", load_then_book)
+
+    async def scenario():
+        subscription, snapshot = await broker.subscribe(LAB, INSTRUMENT, DAYS)
+        assert _entry(slot_index, 2) in snapshot
+        assert await _next(subscription) == ("delta", [_entry(slot_index, 1)])
+        broker.unsubscribe(subscription)
+
+    asyncio.run(scenario())
+
+
+def test_stale_subscriber_gets_a_snapshot(broker):
+    async def scenario():
+        subscription, snapshot = await broker.subscribe(LAB, INSTRUMENT, DAYS)
+        for _ in range(live.LIVE_QUEUE_SIZE + 1):
+            subscription.push(("delta", []))
+        assert subscription.stale
+
+        events = live.stream(subscription, snapshot)
+        assert (await events.__anext__()).startswith("event: snapshot\n")
+        assert await asyncio.wait_for(events.__anext__(), 5) == live._format("snapshot", snapshot)
+        await events.aclose()
+        assert not broker._topics
+
+    asyncio.run(scenario())
+
+
+# The next change after a lab/instrument write finds the topic out of date and resyncs everyone
+def test_catalog_bump_resyncs(seeded, broker, live_lab):
+    slot_index = FIRST_SLOT + 12
+
+    async def scenario():
+        subscription, snapshot = await broker.subscribe(LAB, INSTRUMENT, DAYS)
+        catalog.bump()
+        _book(seeded, live_lab["instrument_ids"][0], slot_index)
+        event, entries = await _next(subscription)
+        assert event == "snapshot" and _entry(slot_index, 1) in entries
+        broker.unsubscribe(subscription)
+
+    asyncio.run(scenario())
+
+
+def test_last_instrument_removed_sends_an_error(broker, live_lab):
+    with db.SessionLocal() as session:
+        instrument = models.Instrument(instrument_name="Laser Tweezers", lab_id=live_lab["lab_id"], working=True)
+        session.add(instrument)
+        session.commit()
+        instrument_id = instrument.instrument_id
+    occupancy.instrument_changed(instrument_id, "Laser Tweezers", live_lab["lab_id"], True)
+
+    async def scenario():
+        subscription, snapshot = await broker.subscribe(LAB, "Laser Tweezers", DAYS)
+        with db.SessionLocal() as session:
+            session.query(models.Instrument).filter(models.Instrument.instrument_id == instrument_id).delete()
+            session.commit()
+        occupancy.instrument_removed(instrument_id)
+        catalog.bump()
+
+        events = live.stream(subscription, snapshot)
+        await events.__anext__()
+        assert await asyncio.wait_for(events.__anext__(), 5) == live._format("error", {"detail": "No working instruments found"})
+        with pytest.raises(StopAsyncIteration):
+            await events.__anext__()
+
+    asyncio.run(scenario())
+
+
+# ----- PEERS (NotifyBridge payloads; the bridge itself needs PostgreSQL) -----
+def test_peer_booking_sends_a_delta(seeded, broker, live_lab):
+    slot_index = FIRST_SLOT + 16
+    instrument_id = live_lab["instrument_ids"][1]
+
+    async def scenario():
+        subscription, snapshot = await broker.subscribe(LAB, INSTRUMENT, DAYS)
+        bridge = live.NotifyBridge(broker)
+        booking_id = _insert_booking(seeded, instrument_id, slot_index)
+        change = {"kind": "booking", "booking_id": booking_id, "instrument_id": instrument_id, "slot_index": slot_index, "status": "pending"}
+
+        bridge._receive(json.dumps({"worker": live._worker_id, **change}))  # our own, already applied
+        await _assert_quiet(subscription)
+        bridge._receive(json.dumps({"worker": "peer", **change}))
+        assert await _next(subscription) == ("delta", [_entry(slot_index, 1)])
+        broker.unsubscribe(subscription)
+
+    asyncio.run(scenario())
+
+
+def test_peer_instrument_change_is_applied(broker, live_lab):
+    with db.SessionLocal() as session:
+        instrument = models.Instrument(instrument_name=INSTRUMENT, lab_id=live_lab["lab_id"], working=True)
+        session.add(instrument)
+        session.commit()
+        instrument_id = instrument.instrument_id
+
+    async def scenario():
+        subscription, snapshot = await broker.subscribe(LAB, INSTRUMENT, DAYS)
+        bridge = live.NotifyBridge(broker)
+        version = catalog.version()
+        bridge._receive(json.dumps({
+            "worker": "peer", "kind": "instrument", "instrument_id": instrument_id,
+            "instrument_name": INSTRUMENT, "lab_id": live_lab["lab_id"], "working": True
+        }))
+        assert catalog.version() > version
+        event, entries = await _next(subscription)
+        assert event == "snapshot" and all(entry["status"].endswith("out of 3") for entry in entries)
+        broker.unsubscribe(subscription)
+
+    asyncio.run(scenario())
+    if occupancy.OCCUPANCY_INDEX_ENABLED:
+        assert instrument_id in occupancy.index.working_instruments(live_lab["lab_id"], INSTRUMENT)
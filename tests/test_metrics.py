@@ -0,0 +1,58 @@
+# /metrics: per-route SQL statement counts, DB time and pool wait, plus the slow request log
+import logging
+
+from prometheus_client.parser import text_string_to_metric_families
+
+import metrics
+from conftest import count_queries
+
+ROUTE = "/bookings/me"
+
+
+def _samples(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(response.text)
+        for sample in family.samples
+    }
+
+
+def _route_sample(samples, name: str, **labels):
+    return samples.get((name, tuple(sorted({"method": "GET", "route": ROUTE, **labels}.items()))), 0)
+
+
+def test_route_series(client, user_headers):
+    before = _samples(client)
+    with count_queries() as counter:
+        assert client.get(ROUTE, headers=user_headers).status_code == 200
+    after = _samples(client)
+
+    def delta(name, **labels):
+        return _route_sample(after, name, **labels) - _route_sample(before, name, **labels)
+
+    assert delta("http_request_duration_seconds_count", status="200") == 1
+    assert delta("http_request_sql_statements_count") == 1
+    assert delta("http_request_sql_statements_sum") == counter.count > 0
+    assert delta("http_request_sql_repeated_statements_count") == 1
+    assert delta("http_request_db_seconds_count") == 1
+    assert delta("http_request_db_seconds_sum") > 0
+    assert delta("http_request_pool_wait_seconds_count") == 1
+    assert delta("http_request_pool_wait_seconds_sum") > 0
+
+
+def test_unmatched_paths_share_one_series(client):
+    before = _samples(client)
+    assert client.get("/no/such/path").status_code == 404
+    key = ("http_request_duration_seconds_count", (("method", "GET"), ("route", "unmatched"), ("status", "404")))
+    assert _samples(client)[key] == before.get(key, 0) + 1
+
+
+def test_slow_request_log(client, user_headers, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "SLOW_REQUEST_MS", 0)
+    with caplog.at_level(logging.WARNING, logger="perf.slow_requests"):
+        assert client.get(ROUTE, headers=user_headers).status_code == 200
+    message = caplog.records[-1].getMessage()
+    assert message.startswith(f"GET {ROUTE} -> 200 took ")
+    assert "SELECT" in message and "ms waiting for the pool" in message
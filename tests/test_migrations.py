@@ -0,0 +1,109 @@
+# Migrations that have to deal with existing rows, run against a minimal copy of the schema before them
+import importlib.util
+import logging
+import os
+from datetime import datetime
+
+import pytest
+import sqlalchemy as sa
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+
+import startup
+
+
+def _migration(revision: str):
+    versions = os.path.join(startup.MIGRATIONS_DIR, "versions")
+    filename = next(name for name in os.listdir(versions) if name.startswith(revision))
+    spec = importlib.util.spec_from_file_location(f"migration_{revision}", os.path.join(versions, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _upgrade(connection, revision: str):
+    with Operations.context(MigrationContext.configure(connection)):
+        _migration(revision).upgrade()
+
+
+def _statuses(connection):
+    return dict(connection.execute(sa.text("SELECT id, status FROM bookings ORDER BY id")).all())
+
+
+# ----- 5c2e8d41b7a3: unique index on active (instrument, slot) -----
+@pytest.fixture
+def before_5c2e8d41b7a3():
+    engine = sa.create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.execute(sa.text(
+            "CREATE TABLE bookings (id INTEGER PRIMARY KEY, instrument_id INTEGER, slot DATETIME, "
+            "requested_by_id INTEGER, requested_to_id INTEGER, status VARCHAR)"
+        ))
+        slot = datetime(2026, 1, 5, 10)
+        connection.execute(sa.text(
+            "INSERT INTO bookings (id, instrument_id, slot, requested_by_id, requested_to_id, status) "
+            "VALUES (:id, :instrument_id, :slot, 1, 2, :status)"
+        ), [
+            {"id": 1, "instrument_id": 1, "slot": slot, "status": "approved"},
+            {"id": 2, "instrument_id": 1, "slot": slot, "status": "pending"},
+            {"id": 3, "instrument_id": 1, "slot": slot, "status": "rejected"},
+            {"id": 4, "instrument_id": 2, "slot": slot, "status": "pending"},
+            {"id": 5, "instrument_id": 1, "slot": slot, "status": "pending"},
+        ])
+    return engine
+
+
+def test_duplicate_active_bookings_stop_the_upgrade(before_5c2e8d41b7a3, monkeypatch):
+    monkeypatch.delenv("REJECT_DUPLICATE_BOOKINGS", raising=False)
+    with before_5c2e8d41b7a3.connect() as connection:
+        with pytest.raises(RuntimeError, match=r"2 active bookings .* \(ids 2, 5\).*REJECT_DUPLICATE_BOOKINGS=1"):
+            _upgrade(connection, "5c2e8d41b7a3")
+        assert _statuses(connection) == {1: "approved", 2: "pending", 3: "rejected", 4: "pending", 5: "pending"}
+
+
+def test_duplicate_active_bookings_rejected_when_allowed(before_5c2e8d41b7a3, monkeypatch, caplog):
+    monkeypatch.setenv("REJECT_DUPLICATE_BOOKINGS", "1")
+    with before_5c2e8d41b7a3.begin() as connection, caplog.at_level(logging.WARNING):
+        _upgrade(connection, "5c2e8d41b7a3")
+        assert _statuses(connection) == {1: "approved", 2: "rejected", 3: "rejected", 4: "pending", 5: "rejected"}
+    assert "Rejected 2 duplicate active bookings (REJECT_DUPLICATE_BOOKINGS=1): ids 2, 5" in caplog.text
+
+
+# ----- 3f9b2e7c4a15: slot index, unique per active (instrument, slot index) -----
+@pytest.fixture
+def before_3f9b2e7c4a15():
+    engine = sa.create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.execute(sa.text(
+            "CREATE TABLE labs (id INTEGER PRIMARY KEY, slot_start TIME, slot_minutes INTEGER, slots_per_day INTEGER)"
+        ))
+        connection.execute(sa.text("CREATE TABLE instruments (instrument_id INTEGER PRIMARY KEY, lab_id INTEGER)"))
+        connection.execute(sa.text("CREATE TABLE bookings (id INTEGER PRIMARY KEY, instrument_id INTEGER, slot DATETIME, status VARCHAR)"))
+        connection.execute(sa.text(
+            "CREATE UNIQUE INDEX uq_bookings_active_instrument_slot ON bookings (instrument_id, slot) "
+            "WHERE status IN ('pending', 'approved')"
+        ))
+        connection.execute(sa.text("INSERT INTO labs VALUES (1, '10:00:00.000000', 120, 4)"))
+        connection.execute(sa.text("INSERT INTO instruments VALUES (1, 1)"))
+        # 10:00 and 10:30 share the 10:00-12:00 slot
+        connection.execute(sa.text("INSERT INTO bookings VALUES (:id, 1, :slot, :status)"), [
+            {"id": 1, "slot": datetime(2026, 1, 5, 10), "status": "pending"},
+            {"id": 2, "slot": datetime(2026, 1, 5, 10, 30), "status": "approved"},
+            {"id": 3, "slot": datetime(2026, 1, 5, 12), "status": "pending"},
+        ])
+    return engine
+
+
+def test_bookings_sharing_a_slot_stop_the_upgrade(before_3f9b2e7c4a15, monkeypatch):
+    monkeypatch.delenv("REJECT_DUPLICATE_BOOKINGS", raising=False)
+    with before_3f9b2e7c4a15.connect() as connection:
+        with pytest.raises(RuntimeError, match=r"1 active bookings .* \(ids 2\).*REJECT_DUPLICATE_BOOKINGS=1"):
+            _upgrade(connection, "3f9b2e7c4a15")
+
+
+def test_bookings_sharing_a_slot_rejected_when_allowed(before_3f9b2e7c4a15, monkeypatch, caplog):
+    monkeypatch.setenv("REJECT_DUPLICATE_BOOKINGS", "1")
+    with before_3f9b2e7c4a15.begin() as connection, caplog.at_level(logging.WARNING):
+        _upgrade(connection, "3f9b2e7c4a15")
+        assert _statuses(connection) == {1: "pending", 2: "rejected", 3: "pending"}
+    assert "Rejected 1 duplicate active bookings (REJECT_DUPLICATE_BOOKINGS=1): ids 2" in caplog.text
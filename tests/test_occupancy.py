@@ -0,0 +1,122 @@
+# The in-memory occupancy index against the SQL path it stands in for
+import threading
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import db
+import models
+import occupancy
+import slots
+from routers import booking
+from conftest import assert_max_queries
+
+pytestmark = pytest.mark.skipif(not occupancy.OCCUPANCY_INDEX_ENABLED, reason="occupancy index disabled")
+
+GRID = slots.DEFAULT_GRID
+
+
+def _wait_for_rewarm():
+    for thread in threading.enumerate():
+        if thread.name == "occupancy-rewarm":
+            thread.join()
+
+
+def _add_booking(seeded, instrument_id: int, slot_index: int, status):
+    with db.SessionLocal() as session:
+        booking_row = models.Booking(
+            instrument_id=instrument_id,
+            slot=GRID.slot_start(slot_index),
+            slot_index=slot_index,
+            requested_by_id=seeded["user_id"],
+            requested_to_id=seeded["admin_id"],
+            status=status
+        )
+        session.add(booking_row)
+        session.commit()
+        booking_id = booking_row.id
+    occupancy.booking_changed(booking_id, instrument_id, slot_index, status)
+
+
+@pytest.mark.parametrize("days", [5, 90])
+def test_index_matches_the_database(client, seeded, monkeypatch, days):
+    # Past, rejected and non-working instruments' bookings must not count on either path
+    today = GRID.first_index(date.today())
+    _add_booking(seeded, seeded["instrument_ids"][2], today + days, models.BookingStatusEnum.approved)
+    _add_booking(seeded, seeded["instrument_ids"][3], today + 2 + days, models.BookingStatusEnum.rejected)
+    _add_booking(seeded, seeded["instrument_ids"][3], today - days, models.BookingStatusEnum.approved)
+
+    with db.SessionLocal() as session:
+        matrix = booking._get_lab_availability(session, "Lab A", days)
+        for instrument in matrix["instruments"]:
+            name = instrument["instrument_name"]
+            with assert_max_queries(0):
+                from_index = booking._get_availability(session, name, "Lab A", days)
+            with monkeypatch.context() as patch:
+                patch.setattr(occupancy.index, "ready", False)
+                from_database = booking._get_availability(session, name, "Lab A", days)
+
+            assert from_index == from_database
+            assert [entry["available"] for entry in from_index] == \
+                [available for day in instrument["available"] for available in day]
+            assert all(entry["status"].endswith(f"out of {instrument['total']}") for entry in from_index)
+
+
+# An instrument written by another worker is not in this worker's index yet: answered from the database,
+# then the index is re-warmed from the primary in the background
+def test_index_miss_falls_back_to_database(client):
+    expected = client.get("/bookings/availability/Lab A/Microscope").json()
+    lab_id = occupancy.index.lab_id("Lab A")
+    for instrument_id in occupancy.index.working_instruments(lab_id, "Microscope"):
+        occupancy.index.remove_instrument(instrument_id)
+
+    response = client.get("/bookings/availability/Lab A/Microscope")
+    assert response.status_code == 200 and response.json() == expected
+    _wait_for_rewarm()
+    assert occupancy.index.working_instruments(lab_id, "Microscope")
+    with assert_max_queries(0):
+        assert client.get("/bookings/availability/Lab A/Microscope").json() == expected
+
+
+def test_concurrent_misses_start_one_rewarm(client, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    warm = occupancy.index.warm
+
+    def slow_warm(session):
+        started.set()
+        release.wait(5)
+        warm(session)
+
+    monkeypatch.setattr(occupancy.index, "warm", slow_warm)
+    first = occupancy.index.rewarm()
+    started.wait(5)
+    assert occupancy.index.rewarm() is first
+    release.set()
+    first.join()
+
+
+# A booking change that commits while warm() reads its snapshot is kept
+def test_changes_during_warm_are_not_lost(client, seeded):
+    instrument_id = seeded["instrument_ids"][0]
+    slot_index = GRID.first_index(date.today() + timedelta(days=70)) + 3
+    booking_id = -1  # never in the snapshot
+    changed = []
+
+    def change_during_read(conn, cursor, statement, parameters, context, executemany):
+        if "FROM bookings" in statement and not changed:
+            changed.append(booking_id)
+            occupancy.index.set_booking(booking_id, instrument_id, slot_index, models.BookingStatusEnum.pending)
+
+    event.listen(db.engine, "before_cursor_execute", change_during_read)
+    try:
+        with db.SessionLocal() as session:
+            occupancy.index.warm(session)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", change_during_read)
+    assert changed
+    assert occupancy.index.booked_counts([instrument_id], slot_index, slot_index + 1) == {slot_index: 1}
+
+    occupancy.index.set_booking(booking_id, instrument_id, slot_index, models.BookingStatusEnum.rejected)
+    assert not occupancy.index.booked_counts([instrument_id], slot_index, slot_index + 1)
@@ -0,0 +1,65 @@
+# Listings stay on current bookings unless include_history is set; month arithmetic for the partitions
+from datetime import date, datetime
+
+import pytest
+
+import db
+import partitions
+
+
+def _slots(response):
+    return [datetime.fromisoformat(booking["slot"]) for booking in response.json()]
+
+
+@pytest.mark.parametrize("url", ["/bookings/", "/approving/to_approve"])
+def test_listings_skip_history_by_default(client, admin_headers, url):
+    current = _slots(client.get(url, params={"limit": 100}, headers=admin_headers))
+    everything = _slots(client.get(url, params={"limit": 100, "include_history": True}, headers=admin_headers))
+
+    assert current and all(slot >= partitions.history_cutoff() for slot in current)
+    assert any(slot < partitions.history_cutoff() for slot in everything)
+    assert set(current) < set(everything)
+
+
+def test_my_bookings_skip_history_by_default(client, user_headers):
+    current = client.get("/bookings/me", params={"limit": 100}, headers=user_headers).json()
+    everything = client.get("/bookings/me", params={"limit": 100, "include_history": True}, headers=user_headers).json()
+    assert 0 < len(current) < len(everything)
+
+
+def test_add_months():
+    assert partitions.add_months(date(2026, 11, 1), 1) == date(2026, 12, 1)
+    assert partitions.add_months(date(2026, 12, 1), 1) == date(2027, 1, 1)
+    assert partitions.add_months(date(2027, 1, 1), -13) == date(2025, 12, 1)
+    assert partitions.partition_name(date(2027, 1, 1)) == "bookings_2027_01"
+
+
+def test_maintenance_is_a_no_op_without_partitions(seeded, capsys):
+    with db.engine.connect() as connection:
+        assert not partitions.is_partitioned(connection)
+    assert partitions.main([]) == 0
+    assert "nothing to do" in capsys.readouterr().out
+
+
+# The DDL itself needs PostgreSQL; this checks what create_partition sends, and in which order
+class _RecordingConnection:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, parameters=None):
+        self.statements.append(str(statement))
+
+
+def test_create_partition_blocks_writers_until_attached():
+    connection = _RecordingConnection()
+    partitions.create_partition(connection, date(2027, 3, 1))
+    statements = connection.statements
+
+    def position(prefix):
+        return next(n for n, statement in enumerate(statements) if statement.startswith(prefix))
+
+    assert statements[0] == "SELECT set_config('lock_timeout', :timeout, true)"
+    assert position("LOCK TABLE ONLY bookings IN SHARE ROW EXCLUSIVE MODE") < position("LOCK TABLE bookings_default IN ACCESS EXCLUSIVE MODE")
+    assert position("LOCK TABLE bookings_default") < position("WITH moved AS (DELETE FROM bookings_default")
+    assert position("WITH moved") < position("ALTER TABLE bookings ATTACH PARTITION bookings_2027_03 FOR VALUES FROM ('2027-03-01') TO ('2027-04-01')")
+    assert statements[-1].startswith("ALTER TABLE bookings ATTACH PARTITION")
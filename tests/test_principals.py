@@ -0,0 +1,81 @@
+# The principal cache: changes to a user take effect on the next request, on this worker and its peers
+import asyncio
+import json
+
+import pytest
+
+import db
+import live
+import models
+import oauth2
+from conftest import PASSWORD
+
+
+@pytest.fixture
+def admin(seeded, request):
+    with db.SessionLocal() as session:
+        user = models.User(username=f"admin-{request.node.name}", password=PASSWORD, privilege_level=models.PrivilegeLevelEnum.admin)
+        session.add(user)
+        session.commit()
+        user_id = user.id
+    return user_id, {"Authorization": f"Bearer {oauth2.create_access_token(data={'user_id': user_id})}"}
+
+
+@pytest.fixture
+def announced(monkeypatch):
+    user_ids = []
+    monkeypatch.setattr(oauth2, "_listeners", [user_ids.append])
+    return user_ids
+
+
+def test_demoted_user_loses_access_on_the_next_request(client, admin, announced):
+    user_id, headers = admin
+    assert client.get("/bookings/", headers=headers).status_code == 200
+    assert oauth2._principals.get(user_id) is not None
+
+    with db.SessionLocal() as session:
+        session.get(models.User, user_id).privilege_level = models.PrivilegeLevelEnum.user
+        session.commit()
+    assert announced == [user_id]
+    assert client.get("/bookings/", headers=headers).status_code == 403
+
+
+def test_deleted_user_is_rejected_on_the_next_request(client, admin, announced):
+    user_id, headers = admin
+    assert client.get("/bookings/", headers=headers).status_code == 200
+
+    with db.SessionLocal() as session:
+        session.delete(session.get(models.User, user_id))
+        session.commit()
+    assert announced == [user_id]
+    assert client.get("/bookings/", headers=headers).status_code == 401
+
+
+def test_rolled_back_changes_are_not_announced(admin, announced):
+    user_id, headers = admin
+    with db.SessionLocal() as session:
+        session.get(models.User, user_id).privilege_level = models.PrivilegeLevelEnum.user
+        session.flush()
+        session.rollback()
+    assert announced == []
+
+
+# What NotifyBridge does with a peer's "principal" payload (the bridge itself needs PostgreSQL)
+def test_peer_user_change_drops_the_cached_principal(client, admin, monkeypatch):
+    user_id, headers = admin
+    assert client.get("/bookings/", headers=headers).status_code == 200
+    assert oauth2._principals.get(user_id) is not None
+    monkeypatch.setattr(live.broker, "_loop", None)
+
+    async def receive():
+        live.NotifyBridge(live.broker)._receive(json.dumps({"worker": "peer", "kind": "principal", "user_id": user_id}))
+
+    asyncio.run(receive())
+    assert oauth2._principals.get(user_id) is None
+
+
+def test_user_id_from_token(admin):
+    user_id, headers = admin
+    assert oauth2.user_id_from_token(headers["Authorization"].split()[1]) == user_id
+    assert oauth2.user_id_from_token("not-a-token") is None
+    assert oauth2.user_id_from_token(oauth2.create_access_token(data={"sub": "no user id"})) is None
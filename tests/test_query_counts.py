@@ -0,0 +1,263 @@
+# Per-endpoint SQL budgets. A route that starts issuing more statements than its budget
+# (an N+1, a lost eager load, a lookup moved out of a join) fails here with the statements it ran.
+# Caches are cold for every test (see conftest.cold_caches), so these are worst-case counts.
+from datetime import timedelta
+
+import pytest
+from prometheus_client import REGISTRY
+
+import occupancy
+from routers import booking
+from conftest import AUTH_QUERIES, PASSWORD, assert_max_queries, count_queries, future_slot
+
+
+# ----- AUTH -----
+def test_authentication_adds_only_the_principal_lookup(client, user_headers):
+    with count_queries() as cold:
+        client.get("/bookings/me", params={"limit": 1}, headers=user_headers)
+    with count_queries() as cached:
+        client.get("/bookings/me", params={"limit": 1}, headers=user_headers)
+    assert cold.count - cached.count == AUTH_QUERIES
+
+    # Bad tokens are rejected before touching the database
+    with assert_max_queries(0):
+        response = client.get("/bookings/me", headers={"Authorization": "Bearer invalid"})
+    assert response.status_code == 401
+
+
+# ----- USERS -----
+def test_signup(client):
+    with assert_max_queries(1):  # insert ... returning
+        response = client.post("/user/signup", json={"username": "new-user", "password": PASSWORD, "privilege_level": "user"})
+    assert response.status_code == 200
+
+
+def test_signup_taken_username(client):
+    with assert_max_queries(1):
+        response = client.post("/user/signup", json={"username": "user", "password": PASSWORD, "privilege_level": "user"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Username already taken"
+
+
+def test_login(client):
+    with assert_max_queries(1):
+        response = client.post("/user/login", data={"username": "user", "password": PASSWORD})
+    assert response.status_code == 200
+
+
+# ----- LABS / INSTRUMENTS -----
+def test_list_labs(client):
+    with assert_max_queries(1):
+        assert client.get("/labs/").status_code == 200
+
+
+def test_list_lab_instruments(client, seeded):
+    with assert_max_queries(2):  # lab exists, its instruments
+        assert client.get(f"/labs/{seeded['lab_id']}/instruments").status_code == 200
+
+
+def test_list_instruments(client):
+    with assert_max_queries(1):
+        assert client.get("/instruments/").status_code == 200
+
+
+def test_catalog_cache_hit_runs_no_queries(client):
+    client.get("/instruments/")
+    with assert_max_queries(0):
+        assert client.get("/instruments/").status_code == 200
+
+
+def test_create_lab(client):
+    with assert_max_queries(1):  # insert ... returning
+        assert client.post("/labs/", json={"name": "Lab B"}).status_code == 200
+
+
+def test_create_update_delete_instrument(client, seeded, admin_headers):
+    payload = {"instrument_name": "Oscilloscope", "lab_id": seeded["lab_id"], "working": True}
+    with assert_max_queries(AUTH_QUERIES + 1):  # insert ... returning
+        response = client.post("/instruments/", json=payload, headers=admin_headers)
+    assert response.status_code == 200
+    instrument_id = response.json()["instrument_id"]
+
+    with assert_max_queries(AUTH_QUERIES + 1):  # update ... returning
+        response = client.put(f"/instruments/{instrument_id}", json={**payload, "working": False}, headers=admin_headers)
+    assert response.status_code == 200
+
+    with assert_max_queries(AUTH_QUERIES + 1):  # delete ... returning
+        assert client.delete(f"/instruments/{instrument_id}", headers=admin_headers).status_code == 200
+
+
+
+def test_update_delete_missing_or_booked_instrument(client, seeded, admin_headers):
+    payload = {"instrument_name": "Oscilloscope", "lab_id": seeded["lab_id"], "working": True}
+    with assert_max_queries(AUTH_QUERIES + 2):  # update ... returning, then the lookup telling 404 from 400
+        assert client.put("/instruments/999999", json=payload, headers=admin_headers).status_code == 404
+    with assert_max_queries(2):  # delete ... returning, then the lookup telling 404 from 400
+        assert client.delete("/instruments/999999", headers=admin_headers).status_code == 404
+    with assert_max_queries(2):
+        response = client.delete(f"/instruments/{seeded['instrument_ids'][0]}", headers=admin_headers)
+    assert response.status_code == 400
+    assert client.get("/instruments/").json()[0]["instrument_id"] == seeded["instrument_ids"][0]
+
+
+# ----- BOOKINGS -----
+def test_create_booking(client, seeded, user_headers):
+    payload = {
+        "instrument_id": seeded["instrument_ids"][3],
+        "slot": future_slot(2).isoformat(),
+        "requested_to_id": seeded["admin_id"],
+    }
+    with assert_max_queries(AUTH_QUERIES + 1):
+        assert client.post("/bookings/", json=payload, headers=user_headers).status_code == 200
+
+    # Principal cached by now: the insert that found the conflict, then the lab grid to explain it.
+    # Any time inside the same slot conflicts.
+    payload["slot"] = (future_slot(2) + timedelta(minutes=30)).isoformat()
+    with assert_max_queries(2):
+        response = client.post("/bookings/", json=payload, headers=user_headers)
+    assert response.json()["detail"] == "This time slot is already booked."
+
+
+def test_create_booking_keeps_the_wall_clock_of_aware_slots(client, seeded, user_headers):
+    slot = future_slot(40, 1)
+    payload = {
+        "instrument_id": seeded["instrument_ids"][3],
+        "slot": slot.isoformat() + "+02:00",
+        "requested_to_id": seeded["admin_id"],
+    }
+    response = client.post("/bookings/", json=payload, headers=user_headers)
+    assert response.status_code == 200
+    assert response.json()["slot"] == slot.isoformat()
+
+
+def test_create_booking_outside_working_hours(client, seeded, user_headers):
+    payload = {
+        "instrument_id": seeded["instrument_ids"][3],
+        "slot": (future_slot(2) - timedelta(hours=1)).isoformat(),
+        "requested_to_id": seeded["admin_id"],
+    }
+    with assert_max_queries(AUTH_QUERIES + 2):
+        response = client.post("/bookings/", json=payload, headers=user_headers)
+    assert response.status_code == 400
+
+
+def test_create_bookings_batch_is_independent_of_batch_size(client, seeded, user_headers):
+    payload = {
+        "instrument_id": seeded["instrument_ids"][3],
+        "requested_to_id": seeded["admin_id"],
+        "recurrence": {"start": future_slot(3, 1).isoformat(), "interval_days": 1, "count": 20},
+    }
+    with assert_max_queries(AUTH_QUERIES + 2):  # lab grid + one multi-row insert
+        response = client.post("/bookings/batch", json=payload, headers=user_headers)
+    assert response.json()["created"] == 20
+
+
+@pytest.mark.parametrize("limit", [1, 10, 50])
+def test_my_bookings_is_one_query_per_page(client, user_headers, limit):
+    with assert_max_queries(AUTH_QUERIES + 1):
+        response = client.get("/bookings/me", params={"limit": limit, "include_history": True}, headers=user_headers)
+    assert len(response.json()) == limit
+
+
+def test_my_bookings_with_filters_and_cursor(client, user_headers):
+    first_page = client.get("/bookings/me", params={"limit": 5}, headers=user_headers)
+    cursor = first_page.headers["X-Next-Cursor"]
+    params = {"limit": 5, "cursor": cursor, "lab_name": "Lab A", "instrument_name": "Microscope"}
+    with assert_max_queries(AUTH_QUERIES + 1):
+        assert client.get("/bookings/me", params=params, headers=user_headers).status_code == 200
+
+
+@pytest.mark.parametrize("limit", [1, 50])
+def test_all_bookings(client, admin_headers, limit):
+    with assert_max_queries(AUTH_QUERIES + 1):
+        response = client.get("/bookings/", params={"limit": limit, "include_history": True}, headers=admin_headers)
+    assert len(response.json()) == limit
+
+
+def test_export_streams_with_one_query(client, admin_headers):
+    with assert_max_queries(AUTH_QUERIES + 1):
+        response = client.get("/bookings/export", params={"format": "csv"}, headers=admin_headers)
+    assert response.status_code == 200
+    header, *rows = response.text.splitlines()
+    assert header == ",".join(booking.EXPORT_COLUMNS) and rows
+
+
+# The request metrics are recorded once the body has been streamed, so they include the export's SQL
+def test_export_metrics_include_the_stream(client, admin_headers):
+    labels = {"method": "GET", "route": "/bookings/export"}
+    before = REGISTRY.get_sample_value("http_request_sql_statements_sum", labels) or 0
+    with count_queries() as counter:
+        assert client.get("/bookings/export", headers=admin_headers).status_code == 200
+    assert counter.count == AUTH_QUERIES + 1
+    assert REGISTRY.get_sample_value("http_request_sql_statements_sum", labels) - before == counter.count
+
+
+@pytest.mark.skipif(not occupancy.OCCUPANCY_INDEX_ENABLED, reason="occupancy index disabled")
+def test_availability_from_occupancy_index(client):
+    assert occupancy.index.ready
+    with assert_max_queries(0):
+        assert client.get("/bookings/availability/Lab A/Microscope").status_code == 200
+
+
+@pytest.mark.parametrize("days", [5, 90])
+def test_availability_from_database(client, monkeypatch, days):
+    monkeypatch.setattr(occupancy.index, "ready", False)
+    with assert_max_queries(2):  # lab + grid + instruments, bucketed booked slots
+        response = client.get("/bookings/availability/Lab A/Microscope", params={"days": days})
+    assert len(response.json()) == days * 4
+
+
+@pytest.mark.parametrize("days", [5, 90])
+def test_lab_availability(client, days):
+    with assert_max_queries(1):
+        response = client.get("/bookings/availability/Lab A", params={"days": days})
+    assert len(response.json()["dates"]) == days
+
+
+# ----- APPROVING -----
+@pytest.mark.parametrize("limit", [1, 50])
+def test_bookings_to_approve(client, admin_headers, limit):
+    with assert_max_queries(AUTH_QUERIES + 1):
+        response = client.get("/approving/to_approve", params={"limit": limit, "include_history": True}, headers=admin_headers)
+    assert len(response.json()) == limit
+
+
+def test_bookings_to_approve_filtered(client, admin_headers):
+    params = {"status": ["pending", "approved"], "slot_from": future_slot(0).isoformat(), "slot_to": future_slot(30).isoformat()}
+    with assert_max_queries(AUTH_QUERIES + 1):
+        response = client.get("/approving/to_approve", params=params, headers=admin_headers)
+    assert response.json() and all(booking["status"] in ("pending", "approved") for booking in response.json())
+
+
+def test_inbox_summary_is_one_query(client, admin_headers):
+    with assert_max_queries(AUTH_QUERIES + 1):
+        response = client.get("/approving/to_approve/summary", params={"include_history": True}, headers=admin_headers)
+    summary = response.json()
+    assert summary["total"] == sum(summary["by_status"].values()) == sum(i["total"] for i in summary["by_instrument"])
+
+    pending = client.get(
+        "/approving/to_approve", params={"status": "pending", "include_history": True, "limit": 100}, headers=admin_headers
+    ).json()
+    assert len(pending) == min(100, summary["by_status"]["pending"])
+
+
+def test_decide_booking(client, admin_headers, user_headers):
+    booking_id = client.get("/approving/to_approve", params={"limit": 1}, headers=admin_headers).json()[0]["id"]
+    with assert_max_queries(AUTH_QUERIES + 1):  # update ... returning
+        response = client.put(f"/approving/{booking_id}/decision", json={"status": "approved"}, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json()["status"] == "approved"
+
+    with assert_max_queries(2):  # update ... returning, then the lookup telling 404 from 403
+        assert client.put("/approving/999999/decision", json={"status": "approved"}, headers=admin_headers).status_code == 404
+    with assert_max_queries(AUTH_QUERIES + 2):
+        assert client.put(f"/approving/{booking_id}/decision", json={"status": "rejected"}, headers=user_headers).status_code == 403
+
+
+def test_decide_bookings_batch_is_independent_of_batch_size(client, admin_headers):
+    bookings = client.get("/approving/to_approve", params={"limit": 30}, headers=admin_headers).json()
+    decisions = [{"booking_id": booking["id"], "status": "rejected"} for booking in bookings]
+    decisions.append({"booking_id": 10 ** 9, "status": "approved"})
+    with assert_max_queries(AUTH_QUERIES + 2):  # one update returning + one lookup of the unmatched ids
+        response = client.put("/approving/decisions", json={"decisions": decisions}, headers=admin_headers)
+    assert response.json()["not_found"] == [10 ** 9]
@@ -0,0 +1,99 @@
+# After a write, the user's reads go to the primary on every worker, not only the one that took the write
+import asyncio
+import json
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from starlette.requests import Request
+
+import catalog
+import db
+import startup
+from conftest import future_slot
+
+
+def _request(headers: dict):
+    return Request({"type": "http", "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()]})
+
+
+def test_write_sets_the_read_primary_cookie(client, seeded, admin_headers, user_headers):
+    payload = {"instrument_name": "Balance", "lab_id": seeded["lab_id"], "working": True}
+    response = client.post("/instruments/", json=payload, headers=admin_headers)
+    assert response.status_code == 200
+    cookie = response.cookies[db.READ_PRIMARY_COOKIE]
+    assert cookie == str(seeded["admin_id"])
+    client.cookies.clear()
+
+    # Another worker: nothing in its own cache, only the cookie
+    db._recent_writers.clear()
+    with_cookie = {"Cookie": f"{db.READ_PRIMARY_COOKIE}={cookie}"}
+    assert db._reads_from_primary(_request({**admin_headers, **with_cookie}))
+    assert not db._reads_from_primary(_request(admin_headers))
+    # The cookie only counts for the user who wrote
+    assert not db._reads_from_primary(_request({**user_headers, **with_cookie}))
+
+
+def test_cookie_without_a_token_reads_from_the_primary():
+    assert db._reads_from_primary(_request({"Cookie": f"{db.READ_PRIMARY_COOKIE}=1"}))
+    assert not db._reads_from_primary(_request({}))
+
+
+# ----- ROUTING: a real second database file standing in for a replica that never catches up -----
+@pytest.fixture
+def lagging_replica(seeded, tmp_path, monkeypatch):
+    path = tmp_path / "replica.db"
+    source, target = sqlite3.connect(db.engine.url.database), sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+    target.close()
+
+    if db.DB_MODE == "async":
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+        monkeypatch.setattr(db, "AsyncReadSessionLocal", sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False))
+        engine = engine.sync_engine
+    else:
+        engine = create_engine(f"sqlite:///{path}", poolclass=NullPool)
+        monkeypatch.setattr(db, "ReadSessionLocal", sessionmaker(bind=engine))
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *rest: statements.append(statement))
+    return statements
+
+
+def test_reads_go_to_the_replica(client, lagging_replica, user_headers):
+    assert client.get("/bookings/me", headers=user_headers).status_code == 200
+    assert lagging_replica
+
+
+# Whatever a catalog miss reads is served to everyone until the next bump
+def test_catalog_is_filled_from_the_primary(client, seeded, lagging_replica, admin_headers):
+    payload = {"instrument_name": "Refractometer", "lab_id": seeded["lab_id"], "working": True}
+    response = client.post("/instruments/", json=payload, headers=admin_headers)
+    assert response.status_code == 200
+    client.cookies.clear()
+
+    instrument_id = response.json()["instrument_id"]
+    assert instrument_id in [i["instrument_id"] for i in client.get("/instruments/").json()]
+    assert instrument_id in [i["instrument_id"] for i in client.get(f"/labs/{seeded['lab_id']}/instruments").json()]
+    asyncio.run(startup.warm())
+    assert instrument_id in [i["instrument_id"] for i in json.loads(catalog.lookup("instruments")[0])]
+    assert lagging_replica == []
+
+
+def test_anonymous_read_after_a_booking_follows_the_cookie(client, seeded, lagging_replica, user_headers):
+    payload = {"instrument_id": seeded["instrument_ids"][3], "slot": future_slot(1, 3).isoformat(), "requested_to_id": seeded["admin_id"]}
+    response = client.post("/bookings/", json=payload, headers=user_headers)
+    assert response.status_code == 200
+    cookie = response.cookies[db.READ_PRIMARY_COOKIE]
+    client.cookies.clear()
+
+    url = "/bookings/availability/Lab A"
+    from_primary = client.get(url, headers={"Cookie": f"{db.READ_PRIMARY_COOKIE}={cookie}"}).json()
+    assert lagging_replica == []
+    # The replica doesn't have the booking yet
+    assert client.get(url).json() != from_primary
+    assert lagging_replica
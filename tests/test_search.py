@@ -0,0 +1,72 @@
+# Ranking, pagination, the trigram fallback and the autocomplete cache of /instruments/search
+import pytest
+
+import catalog
+import db
+import models
+import search
+from conftest import AUTH_QUERIES, assert_max_queries, count_queries
+
+
+@pytest.fixture(scope="module", autouse=True)
+def laser_instruments(seeded):
+    with db.SessionLocal() as session:
+        optics, laser_lab = models.Labs(name="Optics Lab"), models.Labs(name="Laser Lab")
+        session.add_all([optics, laser_lab])
+        session.flush()
+        session.add_all([
+            models.Instrument(instrument_name="Fiber Laser", lab_id=optics.id),
+            models.Instrument(instrument_name="Laser Cutter", lab_id=optics.id),
+            models.Instrument(instrument_name="Laser", lab_id=optics.id),
+            models.Instrument(instrument_name="Power Meter", lab_id=laser_lab.id),
+        ])
+        session.commit()
+    catalog.bump()
+
+
+def _names(response):
+    assert response.status_code == 200
+    return [hit["instrument_name"] for hit in response.json()]
+
+
+def test_ranking(client):
+    # exact, name prefix, lab prefix, substring
+    assert _names(client.get("/instruments/search", params={"q": " LASER "})) == ["Laser", "Laser Cutter", "Power Meter", "Fiber Laser"]
+
+
+def test_pagination(client):
+    assert _names(client.get("/instruments/search", params={"q": "laser", "skip": 1, "limit": 2})) == ["Laser Cutter", "Power Meter"]
+
+
+def test_fuzzy_match(client):
+    hits = client.get("/instruments/search", params={"q": "lazer"}).json()
+    assert [(hit["instrument_name"], hit["lab_name"]) for hit in hits] == [("Laser", "Optics Lab")]
+
+
+def test_wildcards_are_literal(client):
+    assert _names(client.get("/instruments/search", params={"q": "%"})) == []
+
+
+def test_similarity_matches_pg_trgm():
+    assert search.similarity("Laser", "lazer") == pytest.approx(3 / 9)
+    assert search.similarity("word", "word") == 1
+    assert search.similarity("", "word") == 0
+
+
+def test_autocomplete_cache_is_invalidated_by_catalog_writes(client, seeded, admin_headers):
+    with assert_max_queries(1):
+        before = _names(client.get("/instruments/search", params={"q": "las"}))
+    with assert_max_queries(0):
+        assert _names(client.get("/instruments/search", params={"q": "las"})) == before
+
+    payload = {"instrument_name": "Laser Scanner", "lab_id": seeded["lab_id"], "working": True}
+    with assert_max_queries(AUTH_QUERIES + 1):
+        assert client.post("/instruments/", json=payload, headers=admin_headers).status_code == 200
+    assert "Laser Scanner" in _names(client.get("/instruments/search", params={"q": "las"}))
+
+
+def test_long_terms_are_not_cached(client):
+    client.get("/instruments/search", params={"q": "laser cutter"})
+    with count_queries() as counter:
+        assert _names(client.get("/instruments/search", params={"q": "laser cutter"}))[0] == "Laser Cutter"
+    assert counter.count == 1
@@ -0,0 +1,95 @@
+# Boot without import-time create_all: Alembic head check, warm caches, health endpoints
+import asyncio
+
+import pytest
+from alembic import command
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, event, inspect, text
+
+import catalog
+import db
+import occupancy
+import startup
+
+
+def test_head_revisions_match_alembic():
+    assert startup.head_revisions() == set(ScriptDirectory(startup.MIGRATIONS_DIR).get_heads())
+
+
+def test_schema_at_head(seeded):
+    startup.check_schema()
+
+
+def test_schema_behind_head(seeded, monkeypatch):
+    monkeypatch.setattr(startup, "head_revisions", lambda: {"0123456789ab"})
+    with pytest.raises(RuntimeError, match="alembic upgrade head"):
+        startup.check_schema()
+
+
+@pytest.fixture
+def empty_database(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/empty.db")
+
+    # pysqlite commits DDL on its own; make it transactional like PostgreSQL's
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    monkeypatch.setattr(db, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+def test_schema_without_alembic_version(empty_database):
+    with empty_database.begin() as connection:
+        connection.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY)"))
+    with pytest.raises(RuntimeError, match=r"`alembic stamp fa7335734eb3` and then `alembic upgrade head`"):
+        startup.check_schema()
+
+
+def test_create_schema(empty_database):
+    startup.create_schema(empty_database)
+    startup.check_schema()
+
+
+def test_failed_create_schema_leaves_nothing_behind(empty_database, monkeypatch):
+    def fail(config, revision):
+        raise RuntimeError("migration failed")
+
+    monkeypatch.setattr(command, "upgrade", fail)
+    with pytest.raises(RuntimeError, match="migration failed"):
+        startup.create_schema(empty_database)
+    assert inspect(empty_database).get_table_names() == []
+
+
+def test_warm_on_startup(client):
+    assert startup.state.ready
+    assert {"schema", "pool", "catalog", "total"} <= set(startup.state.timings)
+    if occupancy.OCCUPANCY_INDEX_ENABLED:
+        assert "occupancy" in startup.state.timings
+        assert occupancy.index.ready
+
+
+def test_warm_fills_catalog(client):
+    assert catalog.lookup("labs") is None
+    asyncio.run(startup.warm())
+    assert catalog.lookup("labs") is not None
+    assert catalog.lookup("instruments") is not None
+
+
+def test_health(client):
+    assert client.get("/healthz/live").json() == {"status": "alive"}
+    response = client.get("/healthz/ready")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
+
+
+def test_not_ready(client, monkeypatch):
+    monkeypatch.setattr(startup.state, "ready", False)
+    response = client.get("/healthz/ready")
+    assert response.status_code == 503
+    assert response.json() == {"status": "starting"}